@@ -1,74 +1,676 @@
-import os, pyperclip, json, sys
-from src.vox import cli_quick_answer, chat, user_says
+from src import startup
+import os, json, sqlite3, stat, sys, time
+from src import config, daemon, engine, ledger, metrics, transport
+from src.conversation import Conversation, Message
+from src.history import TokenBudget
+from src.jobs import LABELS, JobQueue
+from src.output import StreamWriter
+from src.pins import Pins, prefix
+from src.prefetch import Prefetcher
+from src.scheduler import Scheduler
+from src.sessions import SessionStore
+from src.vox import cli_quick_answer, chat, fill_input, user_says
 from src.custom_types import TMESSAGE
 
+startup.mark("imports")
+
 CONFIGS_PATH = os.path.sep.join(
     os.path.dirname(__file__).split(os.path.sep) + ["configs.json"]
 )
 
-with open(CONFIGS_PATH, "r", encoding="utf-8") as fp:
-    settings = json.load(fp)
+try:
+    CONFIG = config.load(CONFIGS_PATH)
+except config.ConfigError as e:
+    sys.exit(f"<{e}>")
+settings = CONFIG.settings
+
+startup.mark("config")
+
+
+def paste() -> str:
+    # pyperclip is only needed when the clipboard is actually used.
+    import pyperclip
+
+    return pyperclip.paste()
+
+
+def stdin_is_piped() -> bool:
+    # a pipe or a redirected file; not a terminal nor /dev/null
+    try:
+        mode = os.fstat(sys.stdin.fileno()).st_mode
+    except (OSError, ValueError):
+        return False
+    return stat.S_ISFIFO(mode) or stat.S_ISREG(mode)
+
+
+def model_names(keys: list[str]) -> list[str]:
+    # keys of settings["models"] or model names
+    return [CONFIG.model(key) for key in keys]
+
+
+def fan_out(
+    text: str,
+    models: list[str],
+    race: bool,
+    retrieved: list[TMESSAGE] | None = None,
+    messages: list[TMESSAGE] | None = None,
+) -> str | None:
+    # `messages`, when given, is the whole request (the REPL's history)
+    from src import fanout
+
+    messages = messages or [
+        *prefix(CONTEXT, PINS),
+        *(retrieved or []),
+        {"role": "user", "content": text},
+    ]
+    if race:
+        out = StreamWriter()
+        try:
+            winner, answer = engine.run(
+                fanout.race(messages, models, MAX_TOKENS, out.write)
+            )
+        except ledger.BudgetExceeded as e:
+            print(f"<{e}>")
+            return None
+        out.flush()
+        print()
+        print(f"<vencedor: {winner}>", file=sys.stderr)
+        return answer
+    results = engine.run(fanout.compare(messages, models, MAX_TOKENS))
+    print(fanout.format_comparison(results, settings.get("prices", {})))
+    return None
+
+
+def aliases_of(text: str) -> str:
+    # the aliases a prompt uses, for the ledger
+    return " ".join(ALIASES.used(text))
 
-CONTEXT = settings["system"].strip()
-MAX_TOKENS = settings["max_tokens"]
-MODEL: str = settings["models"]["gpt4"]
+
+_index = None
+
+
+def retrieve(text: str) -> list[TMESSAGE]:
+    # the index and its modules are only loaded once retrieval is used
+    global _index
+    from src import retrieval
+
+    if _index is None:
+        _index = retrieval.Index.from_settings(RETRIEVAL)
+    found = _index.search(text, RETRIEVAL.get("top_k", 5))
+    if not found:
+        return []
+    return [{"role": "system", "content": retrieval.format_context(found)}]
+
+
+def copy(text: str) -> None:
+    import pyperclip
+
+    pyperclip.copy(text)
+
+
+def pop_flag(name: str) -> bool:
+    if name in cli_args:
+        cli_args.remove(name)
+        return True
+    return False
+
+
+def pop_option(name: str) -> str | None:
+    if name not in cli_args:
+        return None
+    _j = cli_args.index(name)
+    value = cli_args[_j + 1] if _j + 1 < len(cli_args) else None
+    del cli_args[_j : _j + 2]
+    return value
+
+
+ALIASES = CONFIG.aliases
+CONTEXT = CONFIG.system
+MODEL_KEY = "gpt4"
 cli_args: list[str] = [x.strip() for x in sys.argv[1:]]
+if pop_flag("--startup-profile"):
+    startup.enable()
+USE_DAEMON = not pop_flag("--no-daemon")
+BATCH_PATH = pop_option("--batch")
+MAP_PATH = pop_option("--map")
+PER_LINE = pop_flag("--per-line")
+JSONL = pop_flag("--jsonl")
+USE_STDIN = not pop_flag("--no-stdin")
+FANOUT_MODELS = pop_option("--models")
+RACE = pop_flag("--race")
+metrics.sink_path = pop_option("--metrics")
+PINS = Pins()
+while (_pin := pop_option("--pin")) is not None:
+    PINS.add(_pin)
+INDEX_PATHS: list[str] = []
+while (_path := pop_option("--index")) is not None:
+    INDEX_PATHS.append(_path)
+RETRIEVAL = settings.get("retrieval", {})
+USE_CTX = pop_flag("--ctx")
+transport.options = settings.get("http", {})
+transport.record_dir = pop_option("--record")
+transport.replay_dir = pop_option("--replay")
+transport.replay_speed = float(pop_option("--replay-speed") or 1.0)
+if transport.record_dir or transport.replay_dir:
+    USE_DAEMON = False  # the daemon has its own transport
+engine.scheduler = Scheduler.from_settings(settings)
+NO_CACHE = pop_flag("--no-cache")
+USE_CACHE = not NO_CACHE and settings.get("cache", {}).get("enabled", True)
+if USE_CACHE:
+    from src.cache import ResponseCache
+
+    engine.cache = ResponseCache.from_settings(settings.get("cache", {}))
+# replayed answers cost nothing
+if settings.get("ledger", {}).get("enabled", True) and not transport.replay_dir:
+    engine.ledger = ledger.Ledger.from_config(CONFIG)
 if "3" in cli_args:
-    MODEL = settings["models"]["gpt3"]
+    MODEL_KEY = "gpt3"
 if "v" in cli_args:
-    MODEL = settings["models"]["gpt4vision"]
+    MODEL_KEY = "gpt4vision"
+MODEL: str = CONFIG.model(MODEL_KEY)
+MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
 
 if "-p" in cli_args:
+    _prompt = " ".join(cli_args[cli_args.index("-p") + 1 :])
+    ledger.labels.set((aliases_of(_prompt), None))
+
+if "--daemon" in cli_args:
+    daemon.serve()
+elif cli_args[:1] == ["usage"]:
+    _by = pop_option("--by") or "model"
+    _since, _until = pop_option("--since"), pop_option("--until")
+    _ledger = engine.ledger or ledger.Ledger.from_config(CONFIG)
+    # whole local days; the current month by default
+    _start = (
+        time.mktime(time.strptime(_since, "%Y-%m-%d"))
+        if _since
+        else ledger.month_start(time.time())
+    )
+    _end = (
+        ledger.day_start(time.mktime(time.strptime(_until, "%Y-%m-%d")) + 86400 * 1.5)
+        if _until
+        else None
+    )
+    for _group in _by.split(","):
+        if _group not in ledger.GROUPS:
+            sys.exit(f"<--by: use {', '.join(ledger.GROUPS)}>")
+        print(f"<por {_group}>")
+        print(ledger.format_report(*_ledger.report(_group, _start, _end)))
+    for _name, _limit, _from in (
+        ("hoje", _ledger.daily, ledger.day_start(time.time())),
+        ("este mês", _ledger.monthly, ledger.month_start(time.time())),
+    ):
+        if _limit is not None:
+            print(f"<{_name}: US$ {_ledger.spent(_from):.4f} de US$ {_limit:.2f}>")
+elif INDEX_PATHS:
+    from src.retrieval import Index
+
+    _index = Index.from_settings(RETRIEVAL)
+    for _path in INDEX_PATHS:
+        _files, _chunks = _index.add_tree(_path)
+        print(f"<{_path}: {_files} arquivos, {_chunks} partes novas>")
+    if RETRIEVAL.get("sessions", True) and settings.get("sessions", {}).get(
+        "enabled", True
+    ):
+        _chunks = _index.add_sessions(
+            SessionStore(settings.get("sessions", {}).get("path"))
+        )
+        print(f"<sessões: {_chunks} partes novas>")
+    print(f"<índice: {len(_index)} partes>")
+elif pop_flag("--cache-stats"):
+    if engine.cache is None:
+        print("<cache desativado>")
+    else:
+        print(f"<cache: {engine.cache.totals()}>")
+elif BATCH_PATH is not None:
+    from src import batch
+
+    _out = pop_option("--out") or os.path.splitext(BATCH_PATH)[0] + ".out.jsonl"
+    _concurrency = pop_option("--concurrency")
+    engine.run(
+        batch.run_batch(
+            BATCH_PATH,
+            _out,
+            CONFIG,
+            MODEL,
+            int(_concurrency or settings.get("batch", {}).get("concurrency", 4)),
+            ordered=not pop_flag("--completion-order"),
+        )
+    )
+elif MAP_PATH is not None:
+    from src.mapreduce import map_reduce
+
+    _mapreduce = settings.get("mapreduce", {})
+    _concurrency = int(pop_option("--concurrency") or _mapreduce.get("concurrency", 4))
+    _instruction = ALIASES.expand(
+        " ".join(cli_args[cli_args.index("-p") + 1 :]) if "-p" in cli_args else ""
+    )
+    _out = StreamWriter()
+    with (
+        open(MAP_PATH, "r", encoding="utf-8") if MAP_PATH != "-" else sys.stdin
+    ) as _source:
+        _answer = engine.run(
+            map_reduce(
+                _source,
+                _instruction,
+                MODEL,
+                CONTEXT,
+                MAX_TOKENS,
+                _mapreduce.get("chunk_tokens", 3000),
+                _concurrency,
+                _out.write,
+            )
+        )
+    _out.flush()
+    if _answer:
+        print()
+elif "-p" in cli_args and PER_LINE:
+    from src.pipeline import per_line
+
+    _concurrency = pop_option("--concurrency")
+    _errors = engine.run(
+        per_line(
+            sys.stdin,
+            ALIASES.expand(" ".join(cli_args[cli_args.index("-p") + 1 :])),
+            MODEL,
+            CONTEXT,
+            MAX_TOKENS,
+            int(_concurrency or settings.get("pipeline", {}).get("concurrency", 8)),
+            JSONL,
+        )
+    )
+    sys.exit(1 if _errors else 0)
+elif "-p" in cli_args:
     _i = cli_args.index("-p")
 
-    aliases = set(settings["aliases"].keys())
-    _user_input: str = " ".join(cli_args[_i + 1 :])
-    _user_input_raw_set = set(_user_input.split())
-    while not aliases.isdisjoint(_user_input_raw_set):
-        alias = aliases.intersection(_user_input_raw_set).pop()
-        _user_input = _user_input.replace(alias, settings["aliases"][alias])
-        _user_input_raw_set = set(_user_input.split())
-    if "-:p" in _user_input:
-        _user_input = _user_input.replace("-:p", pyperclip.paste())
-
-    cli_quick_answer(_user_input, MODEL, CONTEXT, MAX_TOKENS)
+    _user_input: str = ALIASES.expand(" ".join(cli_args[_i + 1 :]))
+    # piped content takes the place of the clipboard
+    _piped = sys.stdin.read() if USE_STDIN and stdin_is_piped() else ""
+    if _piped:
+        _user_input = fill_input(_user_input, _piped)
+    elif "-:p" in _user_input:
+        _user_input = _user_input.replace("-:p", paste())
+
+    startup.mark("input")
+    _retrieved = retrieve(_user_input) if USE_CTX else []
+    if FANOUT_MODELS or RACE:
+        fan_out(
+            _user_input,
+            model_names(
+                FANOUT_MODELS.split(",")
+                if FANOUT_MODELS
+                else settings.get("fanout", {}).get("models", ["gpt3", "gpt4"])
+            ),
+            RACE,
+            _retrieved,
+        )
+    elif JSONL:
+        _answer = engine.run(
+            engine.stream_chat(
+                [*prefix(CONTEXT, PINS), *_retrieved, user_says(_user_input)],
+                MODEL,
+                MAX_TOKENS,
+            )
+        )
+        print(json.dumps({"answer": _answer.strip()}, ensure_ascii=False))
+    else:
+        try:
+            _answered = (
+                USE_DAEMON
+                and not PINS
+                and not _retrieved
+                and daemon.quick_answer(
+                    _user_input,
+                    MODEL,
+                    CONTEXT,
+                    MAX_TOKENS,
+                    USE_CACHE,
+                    ledger.labels.get()[0],
+                )
+            )
+        except RuntimeError as e:
+            # part of the answer is already out; do not ask again
+            print()
+            sys.exit(f"<daemon: {e}>")
+        if not _answered:
+            cli_quick_answer(_user_input, MODEL, CONTEXT, MAX_TOKENS, PINS, _retrieved)
+    startup.mark("answer")
+    startup.report()
 else:
-    msgs: list[TMESSAGE] = []
+    startup.report()
+    msgs = Conversation()
+    history = TokenBudget.from_settings(settings.get("history", {}))
+    REPORT_TOKENS: bool = settings.get("history", {}).get("report", False)
+    store = (
+        SessionStore(settings.get("sessions", {}).get("path"))
+        if settings.get("sessions", {}).get("enabled", True)
+        else None
+    )
+    session_id: int | None = None
+
+    def save(message: Message) -> None:
+        global session_id
+        if store is None:
+            return
+        if session_id is None:
+            session_id = store.start(MODEL)
+        store.append(session_id, message.to_api())
+
+    def prefetch_request(
+        prompt: str, text: str
+    ) -> tuple[list[TMESSAGE], str, int] | None:
+        # exactly what the default case below would send
+        _text = ALIASES.expand(prompt)
+        if "-:p" not in _text or USE_CTX:
+            return None
+        # runs on the prefetch thread, right before the request is submitted
+        ledger.labels.set((aliases_of(prompt), session_id))
+        _next = msgs.copy()
+        _next.append(user_says(_text.replace("-:p", text)))
+        _sent = history.preview(_next, CONTEXT, MODEL, PINS)
+        return None if _sent is None else (_sent, MODEL, MAX_TOKENS)
+
+    def prefetch_state() -> tuple:
+        # what prefetch_request depends on
+        return id(msgs), len(msgs), MODEL, PINS.tokens, USE_CTX, CONFIG.version
+
+    def make_prefetcher() -> Prefetcher | None:
+        # prefetched answers are only useful through the cache
+        if engine.cache is None:
+            return None
+        _prefetch = settings.get("prefetch", {})
+        _prefetcher = Prefetcher(
+            _prefetch.get("prompts", []),
+            prefetch_request,
+            paste,
+            _prefetch.get("token_budget", 20000),
+            _prefetch.get("interval", 1.0),
+            _prefetch.get("max_chars", 20000),
+        )
+        if _prefetch.get("enabled", False):
+            _prefetcher.start()
+        return _prefetcher
+
+    prefetcher = make_prefetcher()
+
+    JOBS = JobQueue(settings.get("jobs", {}).get("concurrency", 4))
+
+    def branch_builder(context: str, model: str):
+        # jobs select their window with a budget of their own, so that they
+        # do not disturb the main conversation's
+        async def build(branch: Conversation) -> list[TMESSAGE]:
+            budget = TokenBudget(history.max_tokens, keep=history.keep)
+            return await budget.select(branch, context, model, PINS)
+
+        return build
+
+    def reload_sections(old: config.Config) -> None:
+        # rebuilds what was built from a section that changed; `http` and
+        # `sessions` only apply on restart
+        global RETRIEVAL, _index, prefetcher
+
+        def changed(*names: str) -> bool:
+            return any(old.section(name) != CONFIG.section(name) for name in names)
+
+        if changed("history"):
+            # the window and summary built so far are kept
+            _fresh = TokenBudget.from_settings(settings.get("history", {}))
+            history.max_tokens = _fresh.max_tokens
+            history.summarize = _fresh.summarize
+            history.keep = _fresh.keep
+        if changed("rate_limits", "retry"):
+            engine.scheduler = Scheduler.from_settings(settings)
+        if changed("cache"):
+            from src.cache import ResponseCache
+
+            _cache = settings.get("cache", {})
+            engine.cache = (
+                ResponseCache.from_settings(_cache)
+                if not NO_CACHE and _cache.get("enabled", True)
+                else None
+            )
+        if changed("cache", "prefetch"):
+            if prefetcher is not None:
+                prefetcher.stop()
+            prefetcher = make_prefetcher()
+        if changed("retrieval"):
+            RETRIEVAL, _index = settings.get("retrieval", {}), None
+        if changed("jobs"):
+            JOBS.resize(settings.get("jobs", {}).get("concurrency", 4))
+        if engine.ledger is not None and changed("ledger", "prices", "models"):
+            engine.ledger = ledger.Ledger.from_config(CONFIG)
+
+    def job_id(text: str) -> int | None:
+        _arg = text.split(maxsplit=1)[1]
+        return int(_arg) if _arg.isdigit() and int(_arg) in JOBS.jobs else None
+
     user_input_raw: str = input("> ").strip()
     while user_input_raw not in ("", ":q"):
+        # pick up edits to configs.json; a stat unless it changed
+        try:
+            _config = config.load(CONFIGS_PATH)
+        except config.ConfigError as e:
+            print(f"<configs.json inválido, mantendo o anterior: {e}>")
+            _config = CONFIG
+        if _config is not CONFIG:
+            _old, CONFIG, settings = CONFIG, _config, _config.settings
+            ALIASES, CONTEXT = CONFIG.aliases, CONFIG.system
+            MODEL = CONFIG.model(MODEL_KEY)
+            MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
+            REPORT_TOKENS = settings.get("history", {}).get("report", False)
+            reload_sections(_old)
+            print("<configs.json recarregado>")
+        _state = prefetch_state()
         match user_input_raw:
-            case ":3":
-                MODEL = settings["models"]["gpt3"]
-                print(f"<using {MODEL=}>")
-            case ":4":
-                MODEL = settings["models"]["gpt4"]
+            case ":3" | ":4":
+                MODEL_KEY = "gpt3" if user_input_raw == ":3" else "gpt4"
+                MODEL = CONFIG.model(MODEL_KEY)
+                MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
                 print(f"<using {MODEL=}>")
             case ":model":
                 print(f"<using {MODEL=}>")
+            case ":stats":
+                for _model, _m in metrics.summary().items():
+                    print(
+                        f"<{_model}: {_m['requests']} requisições,"
+                        f" TTFT {_m['ttft']:.2f} s, {_m['tokens_per_second']:.1f} tokens/s,"
+                        f" entre tokens {_m['itl'] * 1000:.0f} ms, total {_m['total']:.2f} s,"
+                        f" {_m['prompt_tokens']}+{_m['completion_tokens']} tokens,"
+                        f" {_m['cached_tokens']} do prompt em cache>"
+                    )
+            case ":usage":
+                _ledger = engine.ledger or ledger.Ledger.from_config(CONFIG)
+                print(
+                    ledger.format_report(
+                        *_ledger.report("model", ledger.day_start(time.time()))
+                    )
+                )
+            case ":tokens":
+                for turn, (sent, full) in enumerate(history.reports, 1):
+                    print(f"<{turn}: {sent} enviados, {full} no histórico>")
+            case ":cache":
+                if engine.cache is None:
+                    print("<cache desativado>")
+                else:
+                    print(
+                        f"<cache: {engine.cache.hits} acertos, {engine.cache.misses}"
+                        f" falhas nesta sessão; total {engine.cache.totals()}>"
+                    )
+            case ":prefetch":
+                if prefetcher is None:
+                    print("<prefetch requer o cache>")
+                else:
+                    if prefetcher.running:
+                        prefetcher.stop()
+                    else:
+                        prefetcher.start()
+                    print(
+                        f"<prefetch {'ligado' if prefetcher.running else 'desligado'}:"
+                        f" {prefetcher.requested} requisições,"
+                        f" ~{prefetcher.spent} de {prefetcher.token_budget} tokens>"
+                    )
+            case ":ctx":
+                USE_CTX = not USE_CTX
+                print(f"<contexto do índice {'ligado' if USE_CTX else 'desligado'}>")
+            case ":pins":
+                for _n, (_path, _tokens) in enumerate(PINS.paths(), 1):
+                    print(f"{_n:>3}  {_path}  {_tokens} tokens")
+            case _ if user_input_raw.startswith(":pin "):
+                try:
+                    PINS.add(os.path.expanduser(user_input_raw.split(maxsplit=1)[1]))
+                except OSError as e:
+                    print(f"Não foi possível fixar: {e}")
+            case _ if user_input_raw.startswith(":unpin "):
+                _arg = user_input_raw.split(maxsplit=1)[1]
+                try:
+                    print(f"<{PINS.remove(int(_arg))} removido>")
+                except (ValueError, IndexError):
+                    print("Documento não encontrado.")
+            case ":sessions":
+                if store is not None:
+                    for _id, _updated, _n, _title in store.recent():
+                        _when = time.strftime("%d/%m %H:%M", time.localtime(_updated))
+                        print(f"{_id:>5}  {_when}  {_n:>3} msgs  {_title}")
+            case _ if user_input_raw.startswith(":load ") and store is not None:
+                _arg = user_input_raw.split(maxsplit=1)[1]
+                _loaded = store.load(int(_arg)) if _arg.isdigit() else []
+                if not _loaded:
+                    print("Sessão não encontrada.")
+                else:
+                    msgs = Conversation(_loaded)
+                    session_id = int(_arg)
+                    history = TokenBudget.from_settings(settings.get("history", {}))
+                    print(f"<sessão {session_id}: {len(msgs)} mensagens>")
+            case _ if user_input_raw.startswith(":search ") and store is not None:
+                try:
+                    _found = store.search(user_input_raw.split(maxsplit=1)[1])
+                except sqlite3.OperationalError:
+                    print("Busca inválida.")
+                    _found = []
+                for _id, _role, _snippet in _found:
+                    print(f"{_id:>5}  {_role}: {_snippet}")
+            case _ if user_input_raw.startswith((":compare ", ":race ")):
+                _command, _text = user_input_raw.split(maxsplit=1)
+                ledger.labels.set((aliases_of(_text), session_id))
+                _text = ALIASES.expand(_text)
+                if "-:p" in _text:
+                    _text = _text.replace("-:p", paste())
+                _sent = None
+                if _command == ":race":
+                    # the winner joins the history, so it answers with it
+                    _next = msgs.copy()
+                    _next.append(user_says(_text))
+                    _sent = engine.run(history.select(_next, CONTEXT, MODEL, PINS))
+                _answer = fan_out(
+                    _text,
+                    model_names(
+                        settings.get("fanout", {}).get("models", ["gpt3", "gpt4"])
+                    ),
+                    _command == ":race",
+                    messages=_sent,
+                )
+                if _answer:
+                    save(msgs.append(user_says(_text)))
+                    save(
+                        msgs.append({"role": "assistant", "content": _answer.strip()})
+                    )
+            case _ if user_input_raw.startswith(":bg "):
+                _text = user_input_raw.split(maxsplit=1)[1]
+                # the job's task keeps the labels of the turn that started it
+                ledger.labels.set((aliases_of(_text), session_id))
+                _text = ALIASES.expand(_text)
+                if "-:p" in _text:
+                    _text = _text.replace("-:p", paste())
+                _branch = msgs.copy()
+                _branch.append(user_says(_text))
+                _job = JOBS.submit(
+                    _text, _branch, MODEL, MAX_TOKENS, branch_builder(CONTEXT, MODEL)
+                )
+                print(f"<job {_job.id}: {LABELS[_job.status]}>")
+            case ":jobs":
+                for _job in JOBS.jobs.values():
+                    _prompt = " ".join(_job.prompt.split())[:50]
+                    print(
+                        f"{_job.id:>3}  {LABELS[_job.status]:<9} {_job.model}"
+                        f"  {len(_job.pieces):>5} partes  {_prompt}"
+                    )
+            case _ if user_input_raw.startswith(":attach "):
+                if (_id := job_id(user_input_raw)) is None:
+                    print("Job não encontrado.")
+                else:
+                    _out = StreamWriter()
+                    print("> ", end="")
+                    try:
+                        JOBS.attach(JOBS.get(_id), _out.write)
+                    except KeyboardInterrupt:
+                        _out.flush()
+                        print(" <desanexado>", end="")
+                    _out.flush()
+                    print()
+            case _ if user_input_raw.startswith(":cancel "):
+                if (_id := job_id(user_input_raw)) is None or not JOBS.cancel(_id):
+                    print("Job não encontrado ou já terminado.")
+            case _ if user_input_raw.startswith(":fork "):
+                _id = job_id(user_input_raw)
+                if _id is None or JOBS.get(_id).status != "done":
+                    print("Job não encontrado ou não terminado.")
+                else:
+                    # the branch becomes the conversation, in a new session
+                    msgs = JOBS.get(_id).branch.copy()
+                    history = TokenBudget.from_settings(settings.get("history", {}))
+                    session_id = None
+                    for _i in range(len(msgs)):
+                        save(msgs[_i])
+                    print(f"<conversa do job {_id}: {len(msgs)} mensagens>")
+            case _ if user_input_raw.startswith(":c "):
+                if (_id := job_id(user_input_raw)) is None:
+                    print("Job não encontrado.")
+                elif not JOBS.get(_id).pieces:
+                    print("Nenhuma resposta no job.")
+                else:
+                    copy(JOBS.get(_id).text().strip())
             case ":c":
-                last_assistant_message = [
-                    x["content"] for x in msgs if x["role"] == "assistant"
-                ].pop()
-                if last_assistant_message is None:
+                if msgs.last_assistant is None:
                     print("Nenhuma resposta na lista.")
                 else:
-                    pyperclip.copy(last_assistant_message)
+                    copy(msgs.last_assistant.text())
             case ":ca":
-                ALL_MSGS = "\n\n".join([f"{x['role']}: {x['content']}" for x in msgs])
-                if ALL_MSGS is None:
+                if not msgs:
                     print("Nenhuma resposta na lista.")
                 else:
-                    pyperclip.copy(ALL_MSGS)
+                    copy(msgs.transcript())
             case _:
-                aliases = set(settings["aliases"].keys())
-                user_input: str = user_input_raw
-                user_input_raw_set = set(user_input.split())
-                while not aliases.isdisjoint(user_input_raw_set):
-                    alias = aliases.intersection(user_input_raw_set).pop()
-                    user_input = user_input.replace(alias, settings["aliases"][alias])
-                    user_input_raw_set = set(user_input.split())
+                user_input: str = ALIASES.expand(user_input_raw)
                 if "-:p" in user_input:
-                    user_input = user_input.replace("-:p", pyperclip.paste())
-                msgs.append(user_says(user_input))
-                chat(msgs, MODEL, CONTEXT, MAX_TOKENS)
+                    user_input = user_input.replace("-:p", paste())
+                save(msgs.append(user_says(user_input)))
+                ledger.labels.set((aliases_of(user_input_raw), session_id))
+                _before = len(msgs)
+                chat(
+                    msgs,
+                    MODEL,
+                    CONTEXT,
+                    MAX_TOKENS,
+                    history,
+                    PINS,
+                    retrieve(user_input) if USE_CTX else None,
+                )
+                for _i in range(_before, len(msgs)):
+                    save(msgs[_i])
+                if REPORT_TOKENS and history.reports:
+                    sent, full = history.reports[-1]
+                    _cached = (
+                        metrics.records[-1].cached_tokens if metrics.records else None
+                    )
+                    print(
+                        f"<tokens: {sent} enviados, {full} no histórico"
+                        + (f", {_cached} em cache>" if _cached is not None else ">")
+                    )
+        # prefetches were built for the conversation as it was
+        if prefetcher is not None and _state != prefetch_state():
+            prefetcher.cancel()
+        for _job in JOBS.finished():
+            print(f"\n<job {_job.id}: {LABELS[_job.status]}>", end="")
+            if _job.error:
+                print(f" {_job.error}", end="")
         user_input_raw = input("\n> ").strip()
@@ -0,0 +1,201 @@
+""" End-to-end benchmarks against the local fake API
+
+Run from the repository root:
+
+    python3 -m benchmarks.run --runs 20 --tokens 200 --out bench.json
+
+Starts `src.fake_server` in-process, points every client at it and measures
+`chat`, `cli_quick_answer`, `Client.ask`, `Client.send_images`, concurrent
+streams and the startup of the `__main__.py` entry point. Results are printed
+(or written to --out) as JSON, one entry per benchmark.
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a 1x1 PNG
+PIXEL = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+
+def describe(samples: list[float]) -> dict[str, float]:
+    """
+    Summarizes a list of durations.
+
+    Args:
+        samples (list[float]): Durations in seconds.
+
+    Returns:
+        dict[str, float]: Mean, median, p95, min and max.
+    """
+    ordered = sorted(samples)
+    return {
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+
+def measure(name: str, runs: int, func: Callable[[], object]) -> dict:
+    """
+    Times `func` `runs` times, with its output discarded.
+
+    Args:
+        name (str): Name of the benchmark.
+        runs (int): Number of timed runs, after one warm-up run.
+        func (Callable[[], object]): The code under test.
+
+    Returns:
+        dict: The benchmark entry.
+    """
+    from src import metrics
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+        metrics.records.clear()
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+
+    entry = {"name": name, "runs": runs, "wall": describe(samples)}
+    streamed = [m for m in metrics.records if m.ttft is not None]
+    if streamed:
+        entry["ttft"] = describe([m.ttft for m in streamed])
+        entry["tokens_per_second"] = statistics.fmean(
+            m.tokens_per_second for m in streamed if m.tokens_per_second
+        )
+    return entry
+
+
+def bench_startup(runs: int, env: dict) -> dict:
+    """
+    Times `python3 <repo> -p ...` end to end in fresh processes.
+
+    Args:
+        runs (int): Number of runs.
+        env (dict): Environment for the child processes.
+
+    Returns:
+        dict: The benchmark entry.
+    """
+    command = [sys.executable, ROOT, "--no-daemon", "--no-cache", "-p", "oi"]
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter() - start)
+    return {"name": "startup_p", "runs": runs, "wall": describe(samples)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=1)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--ttft", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--out", help="write the results here instead of stdout")
+    args = parser.parse_args()
+
+    from src.fake_server import FakeServer, FakeSettings
+
+    server = FakeServer(
+        settings=FakeSettings(args.tokens, args.chunk_size, args.delay, args.ttft)
+    ).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "bench"
+    env = dict(os.environ, XDG_DATA_HOME=tempfile.mkdtemp())
+
+    from src import engine
+    from src.conversation import Conversation
+    from src.helpers import Client
+    from src.vox import chat, cli_quick_answer, user_says
+
+    engine.cache = None
+    model, context, max_tokens = "gpt-4o", "Seja conciso.", args.tokens
+
+    def run_chat() -> None:
+        chat(Conversation([user_says("oi")]), model, context, max_tokens)
+
+    def run_ask() -> None:
+        client = Client("bench", context, model, max_tokens)
+        client.messages.append(Client.format_input("oi"))
+        client.ask()
+
+    image_client = Client("bench", context, model, max_tokens)
+    image = os.path.join(tempfile.mkdtemp(), "pixel.png")
+    with open(image, "wb") as fp:
+        fp.write(PIXEL)
+
+    def run_concurrent() -> None:
+        async def one(_: int) -> str:
+            return await engine.stream_chat(
+                [{"role": "user", "content": "oi"}], model, max_tokens
+            )
+
+        async def all_of_them() -> None:
+            async for _ in engine.bounded_map(
+                one, range(args.concurrency), args.concurrency
+            ):
+                pass
+
+        engine.run(all_of_them())
+
+    results = [
+        measure("chat", args.runs, run_chat),
+        measure(
+            "cli_quick_answer",
+            args.runs,
+            lambda: cli_quick_answer("oi", model, context, max_tokens),
+        ),
+        measure("client_ask", args.runs, run_ask),
+        measure(
+            "client_send_images",
+            args.runs,
+            lambda: image_client.send_images(image, "oi"),
+        ),
+        measure(f"concurrent_{args.concurrency}", args.runs, run_concurrent),
+        bench_startup(args.runs, env),
+    ]
+
+    report = {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "commit": subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip(),
+        "settings": vars(args),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fp:
+            fp.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 """ Main module
 """
-import json
 import os
 import sys
 from dotenv import load_dotenv
@@ -8,6 +7,7 @@ from openai import OpenAI
 import openai.types.chat as openaitypes
 import pyperclip
 from custom_types import TMESSAGE
+import config
 
 load_dotenv()
 
@@ -111,32 +111,22 @@ def cli_quick_answer(text: str, model: str, context: str, max_tokens: int):
 
 
 if __name__ == "__main__":
-    CONFIGS_PATH = os.path.sep.join(
-        os.path.dirname(__file__).split(os.path.sep) + ["configs.json"]
-    )
-
-    with open(CONFIGS_PATH, "r", encoding="utf-8") as fp:
-        settings = json.load(fp)
-
-    CONTEXT = settings["system"].strip()
-    MAX_TOKENS = settings["max_tokens"]
-    MODEL: str = settings["models"]["gpt4"]
+    CONFIG = config.load()
+    ALIASES = CONFIG.aliases
+    CONTEXT = CONFIG.system
+    MODEL_KEY = "gpt4"
     cli_args: list[str] = [x.strip() for x in sys.argv[1:]]
     if "3" in cli_args:
-        MODEL = settings["models"]["gpt3"]
+        MODEL_KEY = "gpt3"
     if "v" in cli_args:
-        MODEL = settings["models"]["gpt4vision"]
+        MODEL_KEY = "gpt4vision"
+    MODEL: str = CONFIG.model(MODEL_KEY)
+    MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
 
     if "-p" in cli_args:
         _i = cli_args.index("-p")
 
-        aliases = set(settings["aliases"].keys())
-        _user_input: str = " ".join(cli_args[_i + 1 :])
-        _user_input_raw_set = set(_user_input.split())
-        while not aliases.isdisjoint(_user_input_raw_set):
-            alias = aliases.intersection(_user_input_raw_set).pop()
-            _user_input = _user_input.replace(alias, settings["aliases"][alias])
-            _user_input_raw_set = set(_user_input.split())
+        _user_input: str = ALIASES.expand(" ".join(cli_args[_i + 1 :]))
         if "-:p" in _user_input:
             _user_input = _user_input.replace("-:p", pyperclip.paste())
 
@@ -145,12 +135,22 @@ if __name__ == "__main__":
         msgs: list[TMESSAGE] = []
         user_input_raw: str = input("> ").strip()
         while user_input_raw not in ("", ":q"):
+            try:
+                _config = config.load()
+            except config.ConfigError as e:
+                print(f"<configs.json inválido, mantendo o anterior: {e}>")
+                _config = CONFIG
+            if _config is not CONFIG:
+                CONFIG = _config
+                ALIASES, CONTEXT = CONFIG.aliases, CONFIG.system
+                MODEL = CONFIG.model(MODEL_KEY)
+                MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
+                print("<configs.json recarregado>")
             match user_input_raw:
-                case ":3":
-                    MODEL = settings["models"]["gpt3"]
-                    print(f"<using {MODEL=}>")
-                case ":4":
-                    MODEL = settings["models"]["gpt4"]
+                case ":3" | ":4":
+                    MODEL_KEY = "gpt3" if user_input_raw == ":3" else "gpt4"
+                    MODEL = CONFIG.model(MODEL_KEY)
+                    MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
                     print(f"<using {MODEL=}>")
                 case ":c":
                     last_assistant_message = [
@@ -169,15 +169,7 @@ if __name__ == "__main__":
                     else:
                         pyperclip.copy(ALL_MSGS)
                 case _:
-                    aliases = set(settings["aliases"].keys())
-                    user_input: str = user_input_raw
-                    user_input_raw_set = set(user_input.split())
-                    while not aliases.isdisjoint(user_input_raw_set):
-                        alias = aliases.intersection(user_input_raw_set).pop()
-                        user_input = user_input.replace(
-                            alias, settings["aliases"][alias]
-                        )
-                        user_input_raw_set = set(user_input.split())
+                    user_input: str = ALIASES.expand(user_input_raw)
                     if "-:p" in user_input:
                         user_input = user_input.replace("-:p", pyperclip.paste())
                     msgs.append(user_says(user_input))
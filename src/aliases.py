@@ -0,0 +1,106 @@
+""" Alias expansion
+
+The aliases from `configs.json` are compiled once into an `AliasEngine`,
+which expands a text in a single left-to-right pass. Only whitespace-
+delimited tokens that start like some alias are looked up, so long pasted
+texts cost linear time regardless of the number of aliases.
+
+An alias may be parameterized: `"-tr": "traduza para {1}"` is used as
+`-tr:inglês`, and several arguments are separated by commas
+(`-x:a,b` fills `{1}` and `{2}`). Aliases inside expansions are expanded as
+well, up to `max_depth` levels; an alias that refers back to itself is left
+as typed instead of looping forever.
+
+This module has no local imports so that every entry point can use it.
+"""
+
+import re
+
+_PLACEHOLDER = re.compile(r"\{(\d+)\}")
+
+
+class AliasEngine:
+    """
+    Compiled table of aliases.
+    """
+
+    def __init__(self, aliases: dict[str, str], max_depth: int = 8) -> None:
+        self.aliases = dict(aliases)
+        self.max_depth = max_depth
+        self._expanded: dict[str, str] = {}
+        starts = {key[0] for key in self.aliases if key}
+        self._candidates = (
+            re.compile(
+                r"(?<!\S)["
+                + "".join(re.escape(c) for c in sorted(starts))
+                + r"]\S*"
+            )
+            if starts
+            else None
+        )
+
+    def expand(self, text: str) -> str:
+        """
+        Replaces every alias in the text by its expansion.
+
+        Args:
+            text (str): The user's input text.
+
+        Returns:
+            str: The expanded text.
+        """
+        return self._expand(text, ())
+
+    def used(self, text: str) -> list[str]:
+        """
+        Lists the aliases a text uses directly, without their arguments.
+
+        Args:
+            text (str): The user's input text, before expansion.
+
+        Returns:
+            list[str]: The alias names, in order of first use.
+        """
+        if self._candidates is None:
+            return []
+        names: dict[str, None] = {}
+        for token in self._candidates.findall(text):
+            name, _, raw_args = token.partition(":")
+            if token in self.aliases:
+                names[token] = None
+            elif name in self.aliases and raw_args:
+                names[name] = None
+        return list(names)
+
+    def _expand(self, text: str, stack: tuple[str, ...]) -> str:
+        if self._candidates is None or len(stack) > self.max_depth:
+            return text
+        return self._candidates.sub(lambda m: self._token(m.group(), stack), text)
+
+    def _token(self, token: str, stack: tuple[str, ...]) -> str:
+        name, _, raw_args = token.partition(":")
+        if token in self.aliases:
+            name, raw_args = token, ""
+        elif name not in self.aliases or not raw_args:
+            return token
+        if name in stack:
+            return token  # cycle
+
+        if not raw_args and not stack and name in self._expanded:
+            return self._expanded[name]
+
+        value = self.aliases[name]
+        if raw_args:
+            args = raw_args.split(",")
+            value = _PLACEHOLDER.sub(
+                lambda m: (
+                    args[int(m.group(1)) - 1]
+                    if 0 < int(m.group(1)) <= len(args)
+                    else m.group()
+                ),
+                value,
+            )
+        value = self._expand(value, stack + (name,))
+        if not raw_args and not stack:
+            self._expanded[name] = value
+        return value
@@ -0,0 +1,126 @@
+""" Batch mode: answers a file of prompts concurrently
+
+Each line of the input is a prompt, either as plain text, a JSON string or a
+JSON object like `{"id": "a1", "prompt": "-kw ...", "model": "gpt3"}`.
+Answers are appended to a JSONL file as they complete, so a run that stops
+midway can be resumed: lines whose id already has an answer are skipped.
+Per-model rate limits are applied by the engine's scheduler.
+"""
+
+import json
+import os
+import sys
+from typing import Iterator
+
+from . import engine, ledger
+from .config import Config
+
+
+def read_prompts(path: str) -> Iterator[dict]:
+    """
+    Reads the prompts of a batch file lazily.
+
+    Args:
+        path (str): The input file.
+
+    Yields:
+        dict: `{"id": ..., "prompt": ...}` plus any other field of the line.
+    """
+    with open(path, "r", encoding="utf-8") as fp:
+        for number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = line
+            if not isinstance(item, dict):
+                item = {"prompt": str(item)}
+            item.setdefault("id", number)
+            yield item
+
+
+def finished_ids(out_path: str) -> set[str]:
+    """
+    Returns the ids already answered in an output file.
+
+    Args:
+        out_path (str): The output JSONL file.
+
+    Returns:
+        set[str]: The ids, as strings, of the records without errors.
+    """
+    if not os.path.exists(out_path):
+        return set()
+    ids = set()
+    with open(out_path, "r", encoding="utf-8") as fp:
+        for line in fp:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash
+            if "answer" in record:
+                ids.add(str(record["id"]))
+    return ids
+
+
+async def run_batch(
+    path: str,
+    out_path: str,
+    config: Config,
+    model: str,
+    concurrency: int,
+    ordered: bool = True,
+) -> tuple[int, int]:
+    """
+    Answers every prompt of `path` that is not yet in `out_path`.
+
+    Args:
+        path (str): The input file.
+        out_path (str): The output JSONL file, appended to.
+        config (Config): The configuration.
+        model (str): The default model.
+        concurrency (int): Maximum number of requests in flight.
+        ordered (bool): Write answers in input order instead of as they finish.
+
+    Returns:
+        tuple[int, int]: The number of answers and of errors written.
+    """
+    done = finished_ids(out_path)
+
+    async def answer(item: dict) -> dict:
+        item_model = config.model(item["model"]) if item.get("model") else model
+        prompt = config.aliases.expand(item["prompt"])
+        # each item runs in a task of its own, with its own labels
+        ledger.labels.set((" ".join(config.aliases.used(item["prompt"])), None))
+        record = {"id": item["id"], "model": item_model}
+        try:
+            answer_text = await engine.stream_chat(
+                [
+                    {"role": "system", "content": config.system},
+                    {"role": "user", "content": prompt},
+                ],
+                item_model,
+                item.get("max_tokens", config.max_tokens_for(item_model)),
+            )
+            record["answer"] = answer_text.strip()
+        except Exception as e:  # recorded, and retried on the next run
+            record["error"] = f"{type(e).__name__}: {e}"
+        return record
+
+    pending = (item for item in read_prompts(path) if str(item["id"]) not in done)
+    answers = errors = 0
+    with open(out_path, "a", encoding="utf-8") as out:
+        async for _, record in engine.bounded_map(
+            answer, pending, concurrency, ordered
+        ):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if "error" in record:
+                errors += 1
+            else:
+                answers += 1
+            sys.stderr.write(f"\r<{answers} respostas, {errors} erros>")
+    sys.stderr.write("\n")
+    return answers, errors
@@ -0,0 +1,190 @@
+""" On-disk response cache
+
+Completed answers are stored in SQLite, keyed by a hash of the whole request
+(model, messages including the system context, and max_tokens). Entries
+expire after `ttl` seconds and the least recently used ones are evicted once
+there are more than `max_entries`.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def default_path() -> str:
+    """
+    Returns the default location of the cache database.
+
+    Returns:
+        str: `$XDG_CACHE_HOME/vox/responses.sqlite`.
+    """
+    return os.path.join(
+        os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "vox",
+        "responses.sqlite",
+    )
+
+
+def request_key(model: str, messages: list, max_tokens: int) -> str:
+    """
+    Hashes a request.
+
+    Args:
+        model (str): The model.
+        messages (list): The messages, system context included.
+        max_tokens (int): The maximum number of tokens to generate.
+
+    Returns:
+        str: The hex digest identifying the request.
+    """
+    raw = json.dumps([model, messages, max_tokens], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache of complete answers with TTL and LRU eviction.
+
+    Attributes:
+        hits (int): Hits in this process.
+        misses (int): Misses in this process.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        ttl: float = 7 * 24 * 3600,
+        max_entries: int = 2000,
+    ) -> None:
+        self.path = path or default_path()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "ResponseCache":
+        """
+        Builds a cache from the `cache` section of `configs.json`.
+
+        Args:
+            settings (dict): The section, possibly empty.
+
+        Returns:
+            ResponseCache: The cache.
+        """
+        return cls(
+            settings.get("path"),
+            settings.get("ttl", 7 * 24 * 3600),
+            settings.get("max_entries", 2000),
+        )
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_last_used
+                    ON responses (last_used);
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                """
+            )
+        return self._db
+
+    def get(self, key: str) -> str | None:
+        """
+        Looks up an answer, refreshing its position in the LRU order.
+
+        Args:
+            key (str): The request key.
+
+        Returns:
+            str | None: The cached answer, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self.db.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                self._count("misses")
+                return None
+            self.db.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            self._count("hits")
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """
+        Stores an answer and evicts what no longer fits.
+
+        Args:
+            key (str): The request key.
+            response (str): The complete answer.
+        """
+        now = time.time()
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self.db.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+            )
+            self.db.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def totals(self) -> dict[str, int]:
+        """
+        Returns the counters accumulated across every process.
+
+        Returns:
+            dict[str, int]: `hits`, `misses` and the number of `entries`.
+        """
+        with self._lock:
+            totals = dict(self.db.execute("SELECT name, value FROM counters"))
+            (entries,) = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return {
+            "hits": totals.get("hits", 0),
+            "misses": totals.get("misses", 0),
+            "entries": entries,
+        }
+
+    def _count(self, name: str) -> None:
+        self.db.execute(
+            "INSERT INTO counters VALUES (?, 1)"
+            " ON CONFLICT (name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
@@ -0,0 +1,213 @@
+""" Validated, cached configuration
+
+`load` reads `configs.json`, checks it once and compiles what every turn
+needs (the alias table, the model table and per-model settings) into an
+immutable `Config`. Snapshots are cached by the file's modification time and
+size, so calling `load` again is a `stat` unless the file changed; the REPL
+does that before each turn to pick up edits without restarting.
+
+`models` entries are either a model name or an object with the name and
+settings for that model:
+
+    "models": {
+        "gpt3": "gpt-3.5-turbo",
+        "gpt4": {"name": "gpt-4o", "max_tokens": 1200}
+    }
+
+Like src/aliases.py, this module is importable both from the package and by
+the standalone script in src/.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any
+
+try:
+    from .aliases import AliasEngine
+except ImportError:  # src/__main__.py, run as `python src`
+    from aliases import AliasEngine
+
+DEFAULT_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "configs.json"
+)
+
+# settings a `models` entry may override
+MODEL_SETTINGS = {"max_tokens": int}
+
+
+class ConfigError(ValueError):
+    """
+    `configs.json` is missing, is not JSON or has an invalid value.
+    """
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    A validated snapshot of `configs.json`.
+
+    Attributes:
+        path (str): The file.
+        version (tuple[int, int]): Its modification time (ns) and size.
+        settings (dict): The whole file, for the optional sections.
+        system (str): The system context.
+        max_tokens (int): Default maximum tokens per answer.
+        models (dict[str, str]): Model name of each key (`gpt3`, `gpt4`...).
+        aliases (AliasEngine): The compiled aliases.
+    """
+
+    path: str
+    version: tuple[int, int]
+    settings: dict
+    system: str
+    max_tokens: int
+    models: dict[str, str]
+    aliases: AliasEngine
+    _model_settings: dict[str, dict[str, Any]] = field(repr=False)
+
+    def model(self, key: str) -> str:
+        """
+        Resolves a key of `models` to its model name.
+
+        Args:
+            key (str): A key of `models`, or already a model name.
+
+        Returns:
+            str: The model name.
+        """
+        return self.models.get(key, key)
+
+    def max_tokens_for(self, model: str) -> int:
+        """
+        Returns the maximum tokens per answer of a model.
+
+        Args:
+            model (str): The model name.
+
+        Returns:
+            int: Its `max_tokens`, or the default one.
+        """
+        return self._model_settings.get(model, {}).get("max_tokens", self.max_tokens)
+
+    def section(self, name: str) -> dict:
+        """
+        Returns an optional section.
+
+        Args:
+            name (str): The section.
+
+        Returns:
+            dict: Its contents, empty if absent.
+        """
+        return self.settings.get(name) or {}
+
+
+_snapshots: dict[str, Config] = {}
+
+
+def load(path: str | None = None) -> Config:
+    """
+    Returns the configuration, reading the file only if it changed since the
+    last call.
+
+    Args:
+        path (str | None): The file; `configs.json` at the project root by
+            default.
+
+    Raises:
+        ConfigError: If the file cannot be read or is invalid.
+
+    Returns:
+        Config: The snapshot; the same object as long as the file does not
+        change.
+    """
+    path = os.path.abspath(path or DEFAULT_PATH)
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        raise ConfigError(f"{path}: {e.strerror}") from e
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _snapshots.get(path)
+    if cached is not None and cached.version == version:
+        return cached
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            settings = json.load(fp)
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"{path}: {e}") from e
+    config = compile_settings(settings, path, version)
+    _snapshots[path] = config
+    return config
+
+
+def compile_settings(
+    settings: dict, path: str = "", version: tuple[int, int] = (0, 0)
+) -> Config:
+    """
+    Validates settings and compiles them into a snapshot.
+
+    Args:
+        settings (dict): The contents of `configs.json`.
+        path (str): Where they came from, for the snapshot and messages.
+        version (tuple[int, int]): The file's modification time and size.
+
+    Raises:
+        ConfigError: If a required key is missing or a value is invalid.
+
+    Returns:
+        Config: The snapshot.
+    """
+
+    def fail(message: str) -> ConfigError:
+        return ConfigError(f"{path or 'configs.json'}: {message}")
+
+    if not isinstance(settings, dict):
+        raise fail("expected an object")
+    system = settings.get("system")
+    if not isinstance(system, str):
+        raise fail("`system` must be a string")
+    max_tokens = settings.get("max_tokens")
+    if not isinstance(max_tokens, int) or max_tokens <= 0:
+        raise fail("`max_tokens` must be a positive integer")
+
+    models: dict[str, str] = {}
+    model_settings: dict[str, dict[str, Any]] = {}
+    raw_models = settings.get("models")
+    if not isinstance(raw_models, dict) or not raw_models:
+        raise fail("`models` must be a non-empty object")
+    for key, value in raw_models.items():
+        if isinstance(value, str):
+            models[key] = value
+            continue
+        if not isinstance(value, dict) or not isinstance(value.get("name"), str):
+            raise fail(f"`models.{key}` must be a name or an object with `name`")
+        models[key] = value["name"]
+        for option, kind in MODEL_SETTINGS.items():
+            if option in value:
+                if not isinstance(value[option], kind):
+                    raise fail(f"`models.{key}.{option}` must be {kind.__name__}")
+                model_settings.setdefault(value["name"], {})[option] = value[option]
+
+    aliases = settings.get("aliases", {})
+    if not isinstance(aliases, dict) or not all(
+        isinstance(k, str) and isinstance(v, str) for k, v in aliases.items()
+    ):
+        raise fail("`aliases` must map strings to strings")
+
+    for name, section in settings.items():
+        if name not in ("system", "max_tokens", "models", "aliases") and not (
+            section is None or isinstance(section, dict)
+        ):
+            raise fail(f"`{name}` must be an object")
+
+    return Config(
+        path,
+        version,
+        settings,
+        system.strip(),
+        max_tokens,
+        models,
+        AliasEngine(aliases),
+        model_settings,
+    )
@@ -0,0 +1,148 @@
+""" Compact conversation storage
+
+A long REPL session keeps thousands of messages around, and most of them are
+never sent again once they fall out of the token budget. `Conversation` keeps
+each one as a slotted `Message` with an interned role and its token count,
+maintains running indexes (last answer, total tokens) as messages arrive and
+only builds the API's dicts for the part of the conversation being sent.
+"""
+
+import sys
+from typing import Iterable, Iterator
+
+from .custom_types import TMESSAGE
+from .history import message_tokens
+
+
+class Message:
+    """
+    One message of a conversation.
+
+    Attributes:
+        role (str): The author's role, interned.
+        content (str | list): The text, or content parts for images.
+        tokens (int): Tokens the message takes in a request.
+    """
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str | list, tokens: int) -> None:
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = tokens
+
+    @classmethod
+    def from_api(cls, message: TMESSAGE) -> "Message":
+        """
+        Builds a record from a message in the API's format.
+
+        Args:
+            message (TMESSAGE): The message.
+
+        Returns:
+            Message: The record.
+        """
+        return cls(message["role"], message["content"], message_tokens(message))
+
+    def to_api(self) -> TMESSAGE:
+        """
+        Returns the message in the API's format.
+
+        Returns:
+            TMESSAGE: The message.
+        """
+        return {"role": self.role, "content": self.content}
+
+    def text(self) -> str:
+        """
+        Returns the text of the message, without its images.
+
+        Returns:
+            str: The text.
+        """
+        if isinstance(self.content, str):
+            return self.content
+        return " ".join(
+            part.get("text", "") for part in self.content if isinstance(part, dict)
+        )
+
+
+class Conversation:
+    """
+    The messages of a conversation, system context excluded.
+
+    Attributes:
+        total_tokens (int): Tokens of all messages together.
+        last_assistant (Message | None): The most recent answer.
+    """
+
+    def __init__(self, messages: Iterable[TMESSAGE | Message] = ()) -> None:
+        self._messages: list[Message] = []
+        self.total_tokens = 0
+        self.last_assistant: Message | None = None
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: TMESSAGE | Message) -> Message:
+        """
+        Adds a message at the end.
+
+        Args:
+            message (TMESSAGE | Message): The message, in either format.
+
+        Returns:
+            Message: Its record.
+        """
+        if not isinstance(message, Message):
+            message = Message.from_api(message)
+        self._messages.append(message)
+        self.total_tokens += message.tokens
+        if message.role == "assistant":
+            self.last_assistant = message
+        return message
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    def __getitem__(self, index: int) -> Message:
+        return self._messages[index]
+
+    def copy(self) -> "Conversation":
+        """
+        Returns a conversation with the same messages that can grow apart.
+
+        Returns:
+            Conversation: The copy.
+        """
+        other = Conversation()
+        other._messages = self._messages.copy()
+        other.total_tokens = self.total_tokens
+        other.last_assistant = self.last_assistant
+        return other
+
+    def to_api(self, start: int = 0) -> list[TMESSAGE]:
+        """
+        Returns the messages from `start` on in the API's format.
+
+        Args:
+            start (int): Index of the first message.
+
+        Returns:
+            list[TMESSAGE]: The messages.
+        """
+        return [message.to_api() for message in self._messages[start:]]
+
+    def transcript(self) -> str:
+        """
+        Returns the whole conversation as text, one `role: content` per
+        message.
+
+        Returns:
+            str: The transcript.
+        """
+        return "\n\n".join(
+            f"{message.role}: {message.text()}" for message in self._messages
+        )
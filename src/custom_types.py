@@ -1,13 +1,19 @@
-from typing import Literal
-import openai.types.chat as openaitypes
+from typing import TYPE_CHECKING, Any, Literal
 
-TMESSAGE = (
-    openaitypes.ChatCompletionSystemMessageParam
-    | openaitypes.ChatCompletionUserMessageParam
-    | openaitypes.ChatCompletionAssistantMessageParam
-    | openaitypes.ChatCompletionToolMessageParam
-    | openaitypes.ChatCompletionFunctionMessageParam
-)
+if TYPE_CHECKING:
+    import openai.types.chat as openaitypes
+
+    TMESSAGE = (
+        openaitypes.ChatCompletionSystemMessageParam
+        | openaitypes.ChatCompletionUserMessageParam
+        | openaitypes.ChatCompletionAssistantMessageParam
+        | openaitypes.ChatCompletionToolMessageParam
+        | openaitypes.ChatCompletionFunctionMessageParam
+    )
+else:
+    # the openai package takes a noticeable fraction of a second to import, so
+    # at runtime messages are plain dicts (which is what the TypedDicts are).
+    TMESSAGE = dict[str, Any]
 
 TInput = (
     dict[Literal["type"], Literal["texto"]]
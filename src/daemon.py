@@ -0,0 +1,227 @@
+""" Background server that keeps a warm OpenAI client for `vox -p`
+
+Start it with `python3 <caminho até o diretório vox> --daemon`. While it is
+running, `-p` invocations send their request through a Unix domain socket and
+reuse its client and connection pool instead of building their own.
+
+Unless `VOX_SOCKET` says otherwise, the socket lives in a directory only its
+user can enter, and the client only talks to a socket owned by its own user;
+anything else is ignored and the request is answered in-process.
+
+The protocol is one JSON line per message: the client sends the request and
+the server answers with `{"t": <text>}` lines followed by `{"done": true}` or
+`{"error": <message>}`.
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import tempfile
+
+from .output import StreamWriter
+
+
+def socket_dir() -> str:
+    """
+    Returns the private directory of the default socket.
+
+    Returns:
+        str: `vox-<uid>` in `XDG_RUNTIME_DIR` or the temporary directory.
+    """
+    return os.path.join(
+        os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir(), f"vox-{os.getuid()}"
+    )
+
+
+def socket_path() -> str:
+    """
+    Returns the path of the daemon socket, `VOX_SOCKET` if it is set.
+
+    Returns:
+        str: The socket path.
+    """
+    return os.getenv("VOX_SOCKET") or os.path.join(socket_dir(), "vox.sock")
+
+
+def _make_private(directory: str) -> None:
+    # created 0700, or taken over only if it is already ours
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise RuntimeError(f"{directory} não pertence a este usuário.")
+    if st.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+
+def _owned(path: str) -> bool:
+    # a socket of this user, so that no one else receives the prompts
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    from . import engine, ledger
+
+    def send(message: dict) -> None:
+        writer.write(json.dumps(message).encode() + b"\n")
+
+    try:
+        request = json.loads(await reader.readline())
+        ledger.labels.set((request.get("aliases", ""), None))
+        await engine.stream_chat(
+            [
+                {"role": "system", "content": request["context"]},
+                {"role": "user", "content": request["text"]},
+            ],
+            request["model"],
+            request["max_tokens"],
+            lambda piece: send({"t": piece}),
+            use_cache=request.get("cache", True),
+        )
+    except (BrokenPipeError, ConnectionResetError):
+        return
+    except Exception as e:  # the client reports it and falls back
+        send({"error": f"{type(e).__name__}: {e}"})
+    else:
+        send({"done": True})
+    try:
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+async def _serve(path: str) -> None:
+    if os.path.dirname(path) == socket_dir():
+        _make_private(socket_dir())
+    # created without access for group and others, with no window to chmod
+    umask = os.umask(0o077)
+    try:
+        server = await asyncio.start_unix_server(_handle, path)
+    finally:
+        os.umask(umask)
+    async with server:
+        await server.serve_forever()
+
+
+def serve(path: str | None = None) -> None:
+    """
+    Runs the daemon in the foreground until interrupted.
+
+    Args:
+        path (str | None): Socket path. Defaults to `socket_path()`.
+    """
+    from . import engine
+
+    path = path or socket_path()
+    if os.path.exists(path):
+        if _is_alive(path):
+            raise RuntimeError(f"Já existe um daemon escutando em {path}.")
+        os.unlink(path)
+
+    engine.get_client()
+    signal.signal(signal.SIGTERM, _stop)
+    print(f"<vox daemon em {path}>", file=sys.stderr)
+    try:
+        engine.run(_serve(path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _stop(*_) -> None:
+    raise KeyboardInterrupt
+
+
+def _is_alive(path: str) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def quick_answer(
+    text: str,
+    model: str,
+    context: str,
+    max_tokens: int,
+    use_cache: bool = True,
+    aliases: str = "",
+) -> bool:
+    """
+    Same as `cli_quick_answer`, but answered by a running daemon.
+
+    Args:
+        text (str): The user's input text.
+        model (str): The model to use for generating the answer.
+        context (str): The system context.
+        max_tokens (int): The maximum number of tokens to generate.
+        use_cache (bool): Whether the daemon may answer from its cache.
+        aliases (str): The aliases used, for the daemon's ledger.
+
+    Raises:
+        RuntimeError: If the daemon fails after it started answering.
+
+    Returns:
+        bool: False if no daemon of this user answered and nothing was
+        printed, so the caller should answer in-process.
+    """
+    path = socket_path()
+    if not _owned(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return False
+
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(
+            json.dumps(
+                {
+                    "text": text,
+                    "model": model,
+                    "context": context,
+                    "max_tokens": max_tokens,
+                    "cache": use_cache,
+                    "aliases": aliases,
+                }
+            ).encode()
+            + b"\n"
+        )
+        stream.flush()
+
+        out = StreamWriter()
+        for line in stream:
+            message = json.loads(line)
+            if "t" in message:
+                out.write(message["t"])
+            elif "error" in message:
+                if not out.pieces:
+                    return False
+                out.flush()
+                raise RuntimeError(message["error"])
+            else:
+                break
+        else:
+            if not out.pieces:
+                return False
+        out.flush()
+    print()
+    return True
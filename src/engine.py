@@ -0,0 +1,433 @@
+""" Asyncio streaming engine
+
+Every completion runs on a single event loop that lives in a background
+thread, so several streams can run at once and share the same client and
+connection pool. Synchronous code hands coroutines to `run`, which blocks
+until they finish and cancels them on Ctrl-C.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import re
+import threading
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+    from .ledger import Ledger
+
+from . import metrics
+from .cache import ResponseCache, request_key
+from .custom_types import TMESSAGE
+from .scheduler import Scheduler
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+_client: "AsyncOpenAI | None" = None
+
+# consulted by stream_chat when set; see src/cache.py
+cache: ResponseCache | None = None
+
+# queues and retries every request; see src/scheduler.py
+scheduler = Scheduler()
+
+# records the usage of every completion and enforces budgets when set; see
+# src/ledger.py
+ledger: "Ledger | None" = None
+
+# cache key -> answer of the identical request already streaming, or None if
+# it failed; lets a request join a prefetch instead of sending it again
+_inflight: dict[str, "asyncio.Future[str | None]"] = {}
+
+# marks the end of an async source in bounded_map and iterate_in_thread
+_END: Any = object()
+
+# what an image part is counted as; a high-detail 1024x1024 image takes 765
+IMAGE_TOKENS = 765
+
+
+def estimate_tokens(messages: list[TMESSAGE], max_tokens: int, model: str) -> int:
+    """
+    Estimates the tokens a request takes from the tokens-per-minute budget.
+
+    Only the text of the messages is counted; each image part counts as
+    `IMAGE_TOKENS`, whatever the size of its data URL.
+
+    Args:
+        messages (list[TMESSAGE]): Messages to send.
+        max_tokens (int): The maximum number of tokens to generate.
+        model (str): The model.
+
+    Returns:
+        int: The estimate.
+    """
+    # deferred: src/history.py imports this module
+    from .history import message_tokens
+
+    tokens = max_tokens
+    for message in messages:
+        tokens += message_tokens(message, model)
+        content = message.get("content")
+        if not isinstance(content, str):
+            tokens += IMAGE_TOKENS * sum(
+                1
+                for part in content or ()
+                if isinstance(part, dict) and part.get("type") == "image_url"
+            )
+    return tokens
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the engine's event loop, starting its thread on first use.
+
+    Returns:
+        asyncio.AbstractEventLoop: The loop.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="vox-engine", daemon=True
+            ).start()
+    return _loop
+
+
+def submit(coro: Coroutine[Any, Any, T]) -> "concurrent.futures.Future[T]":
+    """
+    Schedules a coroutine on the engine's loop without waiting for it.
+
+    Args:
+        coro (Coroutine): The coroutine to run.
+
+    Returns:
+        concurrent.futures.Future: Its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Runs a coroutine on the engine's loop and waits for its result.
+
+    If the wait is interrupted (Ctrl-C), the coroutine is cancelled before the
+    KeyboardInterrupt is re-raised, so the stream stops but the caller lives.
+
+    Args:
+        coro (Coroutine): The coroutine to run.
+
+    Returns:
+        The coroutine's result.
+    """
+    future = submit(coro)
+    try:
+        return future.result()
+    except KeyboardInterrupt:
+        future.cancel()
+        concurrent.futures.wait([future], timeout=5)
+        raise
+
+
+def get_client() -> "AsyncOpenAI":
+    """
+    Returns the shared AsyncOpenAI client, creating it on first use.
+
+    The openai and dotenv imports are deferred to this point so that startup
+    does not pay for them until a request is actually sent.
+
+    Returns:
+        AsyncOpenAI: The client.
+    """
+    global _client
+    if _client is None:
+        from dotenv import load_dotenv
+        from openai import AsyncOpenAI
+
+        from . import startup, transport
+
+        load_dotenv()
+        _client = AsyncOpenAI(
+            # a replay never reaches the API, so it needs no key
+            api_key=os.getenv("OPENAI_API_KEY")
+            or ("replay" if transport.replay_dir else None),
+            http_client=transport.http_client(),
+            max_retries=0,  # the scheduler retries
+        )
+        startup.mark("client")
+    return _client
+
+
+async def stream_chat(
+    messages: list[TMESSAGE],
+    model: str,
+    max_tokens: int,
+    on_text: Callable[[str], None] | None = None,
+    client: "AsyncOpenAI | None" = None,
+    use_cache: bool = True,
+    timer: metrics.Timer | None = None,
+) -> str:
+    """
+    Streams a chat completion.
+
+    A cached answer for the same request, if any, is replayed through
+    `on_text` word by word instead of calling the API; so is the answer of an
+    identical request already in flight, once it completes. Otherwise the
+    request waits for the scheduler's budget and is retried on transient
+    errors that happen before the first token.
+
+    With a ledger, the request may be sent to a cheaper model or refused once
+    a budget is exceeded, and its usage is recorded; that of a request
+    cancelled after it was sent is estimated.
+
+    Args:
+        messages (list[TMESSAGE]): Messages to send, system context included.
+        model (str): The model to use for generating the answer.
+        max_tokens (int): The maximum number of tokens to generate.
+        on_text (Callable[[str], None] | None): Called with each piece of text
+            as it arrives.
+        client (AsyncOpenAI | None): Client to use instead of the shared one.
+        use_cache (bool): Whether to consult and fill the response cache.
+        timer (metrics.Timer | None): Timer to record into, for callers that
+            want this request's metrics.
+
+    Raises:
+        BudgetExceeded: If the ledger refuses the request.
+
+    Returns:
+        str: The whole answer.
+    """
+    client = client or get_client()
+    if ledger is not None:
+        model = ledger.route(model)
+    timer = timer or metrics.Timer(model)
+    timer.metrics.model = model
+    key = None
+    inflight = None
+    if use_cache and cache is not None:
+        key = request_key(model, messages, max_tokens)
+        cached = cache.get(key)
+        while cached is None and key in _inflight:
+            cached = await asyncio.shield(_inflight[key])
+        if cached is not None:
+            for word in re.findall(r"\s*\S+\s*|\s+", cached):
+                timer.piece()
+                if on_text is not None:
+                    on_text(word)
+            timer.finish(cached=True)
+            return cached
+        inflight = _inflight[key] = asyncio.get_running_loop().create_future()
+
+    tokens = estimate_tokens(messages, max_tokens, model)
+    pieces: list[str] = []
+    usage = None
+    attempt = 0
+    sent = False
+    final = ""
+    try:
+        if ledger is not None:
+            ledger.check()
+        while True:
+            attempt += 1
+            await scheduler.acquire(model, tokens)
+            sent = True
+            try:
+                res = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    n=1,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                scheduler.observe(model, res.response.headers)
+                async with res:
+                    async for chunk in res:
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        piece = chunk.choices[0].delta.content or ""
+                        if piece:
+                            timer.piece()
+                            pieces.append(piece)
+                            if on_text is not None:
+                                on_text(piece)
+            except Exception as e:
+                delay = None if pieces else scheduler.backoff(model, attempt, e)
+                if delay is None:
+                    raise
+                sent = False  # a failed attempt is not billed
+                await asyncio.sleep(delay)
+            else:
+                break
+        timer.finish(usage)
+        if ledger is not None and usage is not None:
+            ledger.append(timer.metrics)
+
+        final = "".join(pieces)
+        if key is not None and final:
+            cache.put(key, final)
+    except asyncio.CancelledError:
+        # the provider bills a prompt it received even if the answer is
+        # cancelled (a losing race, Ctrl-C); without the usage chunk, which
+        # comes last, record the estimate
+        if sent:
+            timer.metrics.cancelled = True
+            if usage is None:
+                timer.metrics.prompt_tokens = tokens - max_tokens
+                timer.metrics.completion_tokens = len(pieces)
+            timer.finish(usage)
+            if ledger is not None:
+                ledger.append(timer.metrics)
+        raise
+    finally:
+        if inflight is not None:
+            del _inflight[key]
+            inflight.set_result(final or None)
+    return final
+
+
+async def bounded_map(
+    func: Callable[[T], Awaitable[R]],
+    items: Iterable[T] | AsyncIterable[T],
+    concurrency: int,
+    ordered: bool = True,
+) -> AsyncIterator[tuple[int, R]]:
+    """
+    Applies `func` to `items` with at most `concurrency` calls in flight.
+
+    Items are pulled from the iterable only as slots free up, so it can be a
+    lazy reader over a large file. An async iterable (see `iterate_in_thread`)
+    is awaited alongside the calls, so results keep coming out while the next
+    item is slow to arrive.
+
+    Args:
+        func (Callable[[T], Awaitable[R]]): The coroutine function to apply.
+        items (Iterable[T] | AsyncIterable[T]): The inputs.
+        concurrency (int): Maximum number of calls running at once.
+        ordered (bool): Yield in input order instead of completion order.
+
+    Yields:
+        tuple[int, R]: The index of each input and its result.
+    """
+    concurrency = max(1, concurrency)
+    source: Iterator[T] | AsyncIterator[T] = (
+        aiter(items) if isinstance(items, AsyncIterable) else iter(items)
+    )
+    exhausted = False
+    pulling: asyncio.Future | None = None  # the next item of an async source
+    pulled = 0
+    running: dict[asyncio.Future, int] = {}
+    done: dict[int, R] = {}
+    next_index = 0
+
+    def start(item: T) -> None:
+        nonlocal pulled
+        running[asyncio.ensure_future(func(item))] = pulled
+        pulled += 1
+
+    try:
+        while True:
+            # when ordered, finished results wait for the slow ones before
+            # them; bound those as well so memory stays flat.
+            while (
+                not exhausted
+                and pulling is None
+                and len(running) < concurrency
+                and len(running) + len(done) < 2 * concurrency
+            ):
+                if isinstance(source, AsyncIterator):
+                    pulling = asyncio.ensure_future(anext(source, _END))
+                    break
+                try:
+                    start(next(source))
+                except StopIteration:
+                    exhausted = True
+
+            if not running and pulling is None:
+                break
+
+            finished, _ = await asyncio.wait(
+                [*running, *([pulling] if pulling else [])],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if pulling in finished:
+                finished.discard(pulling)
+                item = pulling.result()
+                pulling = None
+                if item is _END:
+                    exhausted = True
+                else:
+                    start(item)
+            for task in finished:
+                i = running.pop(task)
+                if ordered:
+                    done[i] = task.result()
+                else:
+                    yield i, task.result()
+            while next_index in done:
+                yield next_index, done.pop(next_index)
+                next_index += 1
+    finally:
+        for task in running:
+            task.cancel()
+        if pulling is not None:
+            pulling.cancel()
+
+
+async def iterate_in_thread(items: Iterable[T], buffer: int = 16) -> AsyncIterator[T]:
+    """
+    Iterates a blocking iterable, such as stdin, from a thread of its own.
+
+    The loop never waits for a read, so streams already in flight go on
+    while the next line is slow to come (`tail -f log | vox ...`). The thread
+    reads at most `buffer` items ahead of the consumer.
+
+    Args:
+        items (Iterable[T]): The blocking iterable.
+        buffer (int): Maximum number of items read but not yet consumed.
+
+    Yields:
+        T: Each item, as it is read.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(buffer)
+
+    def put(item: Any) -> None:
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def read() -> None:
+        try:
+            for item in items:
+                put((item, None))
+        except Exception as e:  # raised to the consumer
+            put((_END, e))
+        else:
+            put((_END, None))
+
+    # a daemon thread, so that a read that never returns does not hold up exit
+    threading.Thread(target=read, name="vox-reader", daemon=True).start()
+    while True:
+        item, error = await queue.get()
+        if error is not None:
+            raise error
+        if item is _END:
+            return
+        yield item
@@ -0,0 +1,286 @@
+""" Local stand-in for the OpenAI chat completions API
+
+Run with `python -m src.fake_server --port 8765` and point vox at it with
+OPENAI_BASE_URL=http://127.0.0.1:8765/v1.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class FakeSettings:
+    """
+    Shape of the fake answers.
+
+    Attributes:
+        tokens (int): Number of tokens in each answer.
+        chunk_size (int): Tokens sent per streamed chunk.
+        delay (float): Seconds between streamed chunks.
+        ttft (float): Seconds before the first chunk.
+        word (str): Token repeated to build the answer.
+        fail_first (int): Fail this many requests before answering any.
+        fail_rate (float): Probability of failing each later request.
+        fail_status (int): HTTP status of the injected failures.
+        retry_after (float | None): `Retry-After` sent with the failures.
+        slow_models (dict[str, float]): Extra seconds before the first chunk
+            for these models, e.g. to decide a race.
+    """
+
+    tokens: int = 20
+    chunk_size: int = 1
+    delay: float = 0.0
+    ttft: float = 0.0
+    word: str = "vox "
+    fail_first: int = 0
+    fail_rate: float = 0.0
+    fail_status: int = 429
+    retry_after: float | None = None
+    slow_models: dict[str, float] = field(default_factory=dict)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def do_POST(self):
+        try:
+            self._answer()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading, e.g. a cancelled stream
+            self.close_connection = True
+
+    def _answer(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests.append(body)
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        settings = self.server.settings
+        if self.server.should_fail():
+            headers = {}
+            if settings.retry_after is not None:
+                headers["Retry-After"] = str(settings.retry_after)
+            self._send_json(
+                settings.fail_status,
+                {"error": {"message": "injected failure", "type": "fake"}},
+                headers,
+            )
+            return
+
+        messages = body.get("messages", [])
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        completion_tokens = min(settings.tokens, body.get("max_tokens") or 10**9)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {
+                "cached_tokens": self.server.cached_prefix(body.get("model"), messages)
+            },
+        }
+        base = {
+            "id": "chatcmpl-fake",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+        }
+
+        if not body.get("stream"):
+            self._send_json(
+                200,
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {
+                                "role": "assistant",
+                                "content": settings.word * completion_tokens,
+                            },
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        slow = settings.slow_models.get(body.get("model"), 0.0)
+        time.sleep(settings.ttft + slow)
+        sent = 0
+        while sent < completion_tokens:
+            n = min(settings.chunk_size, completion_tokens - sent)
+            sent += n
+            self._send_event(
+                {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": None,
+                            "delta": {"content": settings.word * n},
+                        }
+                    ],
+                }
+            )
+            if sent < completion_tokens:
+                time.sleep(settings.delay)
+        self._send_event(
+            {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}],
+            }
+        )
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_event(
+                {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [],
+                    "usage": usage,
+                }
+            )
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _send_json(
+        self, status: int, payload: dict, headers: dict | None = None
+    ) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, payload: dict) -> None:
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    HTTP server that answers chat completions with canned, streamed text.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, settings: FakeSettings | None = None) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.settings = settings or FakeSettings()
+        self.requests: list[dict] = []
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._prefixes: set[str] = set()
+
+    def should_fail(self) -> bool:
+        """
+        Decides whether the current request gets an injected failure.
+
+        Returns:
+            bool: True to fail it.
+        """
+        with self._lock:
+            if self.failures < self.settings.fail_first or (
+                random.random() < self.settings.fail_rate
+            ):
+                self.failures += 1
+                return True
+        return False
+
+    def cached_prefix(self, model: str | None, messages: list[dict]) -> int:
+        """
+        Imitates the provider's prompt caching: the tokens of the longest
+        run of leading messages already seen in an earlier request.
+
+        Args:
+            model (str | None): The model requested.
+            messages (list[dict]): The messages sent.
+
+        Returns:
+            int: The cached prompt tokens.
+        """
+        digest = hashlib.sha256(str(model).encode())
+        cached = tokens = 0
+        hit = True
+        with self._lock:
+            for message in messages:
+                digest.update(json.dumps(message, sort_keys=True).encode())
+                key = digest.copy().hexdigest()
+                tokens += len(str(message.get("content", "")).split())
+                if hit and key in self._prefixes:
+                    cached = tokens
+                else:
+                    hit = False
+                    self._prefixes.add(key)
+        return cached
+
+    @property
+    def base_url(self) -> str:
+        """
+        The URL to use as OPENAI_BASE_URL.
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "FakeServer":
+        """
+        Serves requests from a background thread.
+
+        Returns:
+            FakeServer: The server itself.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--chunk-size", type=int, default=1)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--ttft", type=float, default=0.0)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=None)
+    args = parser.parse_args()
+
+    server = FakeServer(
+        args.port,
+        FakeSettings(
+            args.tokens,
+            args.chunk_size,
+            args.delay,
+            args.ttft,
+            fail_first=args.fail_first,
+            fail_rate=args.fail_rate,
+            fail_status=args.fail_status,
+            retry_after=args.retry_after,
+        ),
+    )
+    print(f"OPENAI_BASE_URL={server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,141 @@
+""" Sending one prompt to several models
+
+`race` streams the answer of whichever model starts answering first and
+cancels the others, whose prompts are still billed and so recorded; `compare`
+waits for all of them and reports each answer with its timing and cost.
+"""
+
+import asyncio
+from typing import Callable
+
+from . import engine, metrics
+from .custom_types import TMESSAGE
+
+
+async def race(
+    messages: list[TMESSAGE],
+    models: list[str],
+    max_tokens: int,
+    on_text: Callable[[str], None] | None = None,
+) -> tuple[str, str]:
+    """
+    Streams the answer of the first model to produce a token.
+
+    Args:
+        messages (list[TMESSAGE]): Messages to send, system context included.
+        models (list[str]): The competing models.
+        max_tokens (int): The maximum number of tokens to generate.
+        on_text (Callable[[str], None] | None): Receives the winner's answer
+            as it streams.
+
+    Raises:
+        Exception: The last failure, if every model failed.
+
+    Returns:
+        tuple[str, str]: The winning model and its answer.
+    """
+    winner: list[str] = []
+    decided = asyncio.Event()
+
+    def forward(model: str) -> Callable[[str], None]:
+        def on_piece(text: str) -> None:
+            if not winner:
+                winner.append(model)
+                decided.set()
+            if winner[0] == model and on_text is not None:
+                on_text(text)
+
+        return on_piece
+
+    tasks = {
+        asyncio.ensure_future(
+            engine.stream_chat(messages, model, max_tokens, forward(model))
+        ): model
+        for model in models
+    }
+    waiting_decision = asyncio.ensure_future(decided.wait())
+    try:
+        pending = set(tasks)
+        error: BaseException | None = None
+        while pending and not decided.is_set():
+            done, _ = await asyncio.wait(
+                pending | {waiting_decision}, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done - {waiting_decision}:
+                pending.discard(task)
+                if task.exception() is not None:
+                    error = task.exception()
+        if not winner:
+            raise error or RuntimeError("Nenhum modelo respondeu.")
+        losers = [task for task, model in tasks.items() if model != winner[0]]
+        for task in losers:
+            task.cancel()
+        winning_task = next(t for t, m in tasks.items() if m == winner[0])
+        answer = await winning_task
+        # the losers record what they were billed as they stop
+        await asyncio.gather(*losers, return_exceptions=True)
+        return winner[0], answer
+    finally:
+        waiting_decision.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+async def compare(
+    messages: list[TMESSAGE], models: list[str], max_tokens: int
+) -> list[tuple[str, str | None, metrics.CompletionMetrics]]:
+    """
+    Gets every model's answer concurrently.
+
+    Args:
+        messages (list[TMESSAGE]): Messages to send, system context included.
+        models (list[str]): The models.
+        max_tokens (int): The maximum number of tokens to generate.
+
+    Returns:
+        list[tuple[str, str | None, metrics.CompletionMetrics]]: For each
+        model, in the given order, its answer (None if it failed) and its
+        metrics.
+    """
+
+    async def one(model: str):
+        timer = metrics.Timer(model)
+        try:
+            answer = await engine.stream_chat(messages, model, max_tokens, timer=timer)
+        except Exception as e:  # shown in place of the answer
+            return model, None, timer.metrics, e
+        return model, answer.strip(), timer.metrics, None
+
+    engine.get_client()  # so that the first timer does not include its setup
+    results = await asyncio.gather(*(one(model) for model in models))
+    return [(model, answer, m) for model, answer, m, _ in results]
+
+
+def format_comparison(
+    results: list[tuple[str, str | None, metrics.CompletionMetrics]],
+    prices: dict[str, dict[str, float]],
+) -> str:
+    """
+    Renders the result of `compare` for the terminal.
+
+    Args:
+        results: What `compare` returned.
+        prices (dict[str, dict[str, float]]): The `prices` section of
+            `configs.json`.
+
+    Returns:
+        str: One block per model, with a header holding its numbers.
+    """
+    blocks = []
+    for model, answer, m in results:
+        details = [f"total {m.total:.2f} s"]
+        if m.ttft is not None:
+            details.insert(0, f"TTFT {m.ttft:.2f} s")
+        if m.completion_tokens is not None:
+            details.append(f"{m.prompt_tokens}+{m.completion_tokens} tokens")
+        price = metrics.cost(m, prices)
+        if price is not None:
+            details.append(f"US$ {price:.5f}")
+        header = f"=== {model} ({', '.join(details)}) ==="
+        blocks.append(f"{header}\n{answer if answer is not None else '<falhou>'}")
+    return "\n\n".join(blocks)
@@ -1,15 +1,14 @@
 """ Aux. Classes and Functions
 """
 
-import os
-import sys
-import base64
-from typing import Literal
-from openai import OpenAI
-import openai.types.chat as openaitypes
-from requests import post
+from typing import Callable, Literal
+from openai import AsyncOpenAI
 
-from custom_types import TMESSAGE
+from . import engine
+from .conversation import Conversation
+from .images import encode_image
+from .output import StreamWriter
+from .transport import http_client
 
 
 class Client:
@@ -20,15 +19,13 @@ class Client:
         model: str = "gpt-4o",
         max_tokens: int = 700,
     ) -> None:
-        self.__client = OpenAI(api_key=api_key)
-        self.messages: list[TMESSAGE] = []
+        self.__client = AsyncOpenAI(
+            api_key=api_key, http_client=http_client(), max_retries=0
+        )
+        self.messages = Conversation()
         self.model = model
         self.system: str = system_context
         self.max_tokens: int = max_tokens
-        self.__header_to_image = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
 
     @classmethod
     def format_input(
@@ -60,82 +57,107 @@ class Client:
             }
         return {"role": role, "content": content}
 
-    def send_images(self, absolute_path: str, content: str) -> str:
+    def send_images(
+        self,
+        absolute_path: str | list[str],
+        content: str,
+        per_request: int = 0,
+        max_side: int | None = None,
+        concurrency: int = 4,
+        on_text: Callable[[str], None] | None = None,
+    ) -> str | list[str]:
         """
-        Sends an image to the OpenAI API along with a request for a descriptive rhyming response.
+        Sends images to the OpenAI API along with a textual request.
+
+        Several images can go in a single request or, with `per_request`, be
+        split into groups sent as concurrent requests over the shared
+        connection pool. Encoded images are cached by content (see
+        src/images.py).
 
         Args:
-            absolute_path (str): The absolute file path to the image.
-            content (str): The textual content to send along with the image.
+            absolute_path (str | list[str]): The image file, or a list of them.
+            content (str): The textual content to send along with the images.
+            per_request (int, optional): Images per request; 0 sends all of
+                them together. Default is 0.
+            max_side (int | None, optional): Downscale images to this many
+                pixels on the longest side before sending (requires Pillow).
+            concurrency (int, optional): Maximum requests in flight.
+            on_text (Callable[[str], None] | None, optional): Receives the
+                answer as it streams; only used for a single request.
 
         Raises:
-            ValueError: If the provided path to the image does not exist.
+            ValueError: If no image is given or the provided path to an image
+                does not exist.
 
         Returns:
-            str: The descriptive rhyming response from the API.
+            str | list[str]: The response, or one response per group when
+            `per_request` splits the images.
         """
 
-        if not os.path.exists(absolute_path):
-            raise ValueError("The path to the image does not exist.")
-
-        base64_image = ""
-        with open(absolute_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
-
-        payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": content},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            },
-                        },
-                    ],
-                }
-            ],
-            "max_tokens": 600,
-        }
-
-        response = post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=self.__header_to_image,
-            json=payload,
-        )
-
-        assistant = response.json()["choices"][0]["message"]["content"]
+        paths = [absolute_path] if isinstance(absolute_path, str) else absolute_path
+        if not paths:
+            raise ValueError("No image to send.")
+        urls = [encode_image(path, max_side) for path in paths]
+        size = per_request or len(urls)
+        groups = [urls[i : i + size] for i in range(0, len(urls), size)]
 
-        return assistant
+        async def send(group: list[str]) -> str:
+            message = {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": content},
+                    *(
+                        {"type": "image_url", "image_url": {"url": url}}
+                        for url in group
+                    ),
+                ],
+            }
+            answer = await engine.stream_chat(
+                [message],
+                self.model,
+                self.max_tokens,
+                on_text if len(groups) == 1 else None,
+                client=self.__client,
+            )
+            return answer.strip()
+
+        async def send_all() -> list[str]:
+            return [
+                answer
+                async for _, answer in engine.bounded_map(send, groups, concurrency)
+            ]
+
+        answers = engine.run(send_all())
+        if isinstance(absolute_path, str) or not per_request:
+            return answers[0]
+        return answers
 
     def ask(self):
-        res = self.__client.chat.completions.create(
-            model=self.model,
-            messages=[
-                openaitypes.ChatCompletionSystemMessageParam(
-                    {"role": "system", "content": self.system}
-                ),
-                *self.messages,
-            ],
-            max_tokens=self.max_tokens,
-            n=1,
-            stream=True,
-        )
-
         print("> ", end="")
 
-        final = ""
-        for chunk in res:
-            _aux = chunk.choices[0].delta.content or ""
-            final += _aux
-            sys.stdout.write(_aux)
-            sys.stdout.flush()
+        out = StreamWriter()
+        try:
+            engine.run(
+                engine.stream_chat(
+                    [
+                        {"role": "system", "content": self.system},
+                        *self.messages.to_api(),
+                    ],
+                    self.model,
+                    self.max_tokens,
+                    out.write,
+                    client=self.__client,
+                )
+            )
+        except KeyboardInterrupt:
+            out.flush()
+            print(" <interrompido>", end="")
+        out.flush()
         print()
 
-        self.messages.append(Client.format_input(final.strip(), role="assistant"))
+        final = out.text()
+        if final.strip():
+            self.messages.append(Client.format_input(final.strip(), role="assistant"))
 
 
 class Chat:
@@ -0,0 +1,250 @@
+""" Token budget for the conversation history
+
+`TokenBudget` decides which part of a growing conversation is sent on each
+turn: the most recent messages that fit in `max_tokens`, optionally preceded
+by a summary of the older ones. Token counts are computed once per message,
+when it joins the conversation (see src/conversation.py).
+
+Requests are laid out so that consecutive turns share as long a prefix as
+possible, which providers with prompt caching bill and serve faster: system
+context, pinned documents (see src/pins.py), summary, history. When the
+history outgrows the budget, a whole block of old messages is dropped at once
+so that the window's first message stays the same for the following turns,
+instead of sliding, and changing the prefix, on every turn.
+"""
+
+from typing import TYPE_CHECKING, Callable
+
+from . import engine
+from .custom_types import TMESSAGE
+from .pins import Pins, prefix
+
+if TYPE_CHECKING:
+    from .conversation import Conversation, Message
+
+# overhead the API adds around each message
+MESSAGE_OVERHEAD = 4
+
+_encoders: dict[str, Callable[[str], list]] = {}
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """
+    Counts the tokens of a text.
+
+    Uses tiktoken when it is installed and a 4-characters-per-token estimate
+    otherwise.
+
+    Args:
+        text (str): The text.
+        model (str): The model whose tokenizer to use.
+
+    Returns:
+        int: The number of tokens.
+    """
+    if model not in _encoders:
+        try:
+            import tiktoken
+        except ImportError:
+            _encoders[model] = lambda text: [None] * ((len(text) + 3) // 4)
+        else:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _encoders[model] = encoding.encode
+    return len(_encoders[model](text))
+
+
+def message_tokens(message: TMESSAGE, model: str = "gpt-4o") -> int:
+    """
+    Counts the tokens a message takes in a request.
+
+    Args:
+        message (TMESSAGE): The message.
+        model (str): The model whose tokenizer to use.
+
+    Returns:
+        int: The number of tokens.
+    """
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = " ".join(
+            part.get("text", "") for part in content if isinstance(part, dict)
+        )
+    return count_tokens(content, model) + MESSAGE_OVERHEAD
+
+
+class TokenBudget:
+    """
+    Keeps the messages sent for a conversation under a token budget.
+
+    Attributes:
+        max_tokens (int): Budget for the whole prompt, system context included.
+        summarize (bool): Summarize dropped messages instead of only dropping.
+        keep (float): Fraction of the budget the history is cut down to when
+            it no longer fits.
+        reports (list[tuple[int, int]]): For each turn, the prompt tokens sent
+            and the tokens the whole history would have taken.
+    """
+
+    def __init__(
+        self, max_tokens: int = 6000, summarize: bool = False, keep: float = 0.5
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self.keep = keep
+        self.reports: list[tuple[int, int]] = []
+        self.summary: str = ""
+        self._summarized = 0
+        self._start = 0  # first message sent on the last turn
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "TokenBudget":
+        """
+        Builds a budget from the `history` section of `configs.json`.
+
+        Args:
+            settings (dict): The section, possibly empty.
+
+        Returns:
+            TokenBudget: The budget.
+        """
+        return cls(
+            settings.get("max_tokens", 6000),
+            settings.get("summarize", False),
+            settings.get("keep", 0.5),
+        )
+
+    async def select(
+        self,
+        messages: "Conversation",
+        context: str,
+        model: str,
+        pins: Pins | None = None,
+    ) -> list[TMESSAGE]:
+        """
+        Builds the message list to send for the next turn.
+
+        Args:
+            messages (Conversation): The whole conversation.
+            context (str): The system context.
+            model (str): The model that will answer.
+            pins (Pins | None): Documents pinned after the system context.
+
+        Returns:
+            list[TMESSAGE]: The system context, the pinned documents, the
+            summary if any and the most recent messages that fit in the
+            budget.
+        """
+        system, start, used = self._window(messages, context, model, pins)
+        self._start = start
+
+        if self.summarize and start > self._summarized:
+            await self._summarize(
+                [messages[i] for i in range(self._summarized, start)], model
+            )
+            self._summarized = start
+
+        sent = self._build(messages, context, start, pins)
+        prompt = system + used
+        if self.summary and start > 0:
+            prompt += self._summary_tokens(model)
+        self.reports.append((prompt, system + messages.total_tokens))
+        return sent
+
+    def preview(
+        self,
+        messages: "Conversation",
+        context: str,
+        model: str,
+        pins: Pins | None = None,
+    ) -> list[TMESSAGE] | None:
+        """
+        Returns what `select` would send, without side effects.
+
+        Args:
+            messages (Conversation): The whole conversation.
+            context (str): The system context.
+            model (str): The model that will answer.
+            pins (Pins | None): Documents pinned after the system context.
+
+        Returns:
+            list[TMESSAGE] | None: The messages, or None when the turn would
+            first have to summarize and so cannot be predicted.
+        """
+        _, start, _ = self._window(messages, context, model, pins)
+        if self.summarize and start > self._summarized:
+            return None
+        return self._build(messages, context, start, pins)
+
+    def _window(
+        self,
+        messages: "Conversation",
+        context: str,
+        model: str,
+        pins: Pins | None,
+    ) -> tuple[int, int, int]:
+        # (prefix tokens, first message sent, tokens of those sent); only
+        # the messages in the window are visited
+        system = count_tokens(context, model) + MESSAGE_OVERHEAD
+        if pins is not None:
+            system += pins.tokens
+        available = self.max_tokens - system - self._summary_tokens(model)
+
+        # the window keeps its start while the history fits...
+        start = min(self._start, max(len(messages) - 1, 0))
+        used = sum(messages[i].tokens for i in range(start, len(messages)))
+        if used > available:
+            # ...and then drops a block, down to `keep` of the budget
+            target = available * self.keep
+            while start < len(messages) - 1 and used > target:
+                used -= messages[start].tokens
+                start += 1
+        # never start the window with an answer whose question was dropped
+        while start < len(messages) - 1 and messages[start].role != "user":
+            used -= messages[start].tokens
+            start += 1
+        return system, start, used
+
+    def _build(
+        self,
+        messages: "Conversation",
+        context: str,
+        start: int,
+        pins: Pins | None,
+    ) -> list[TMESSAGE]:
+        sent = prefix(context, pins)
+        # after the pinned documents: it changes whenever a block is dropped
+        if self.summary and start > 0:
+            sent.append(
+                {
+                    "role": "system",
+                    "content": f"Resumo da conversa até aqui: {self.summary}",
+                }
+            )
+        sent.extend(messages.to_api(start))
+        return sent
+
+    def _summary_tokens(self, model: str) -> int:
+        if not self.summary:
+            return 0
+        return count_tokens(self.summary, model) + MESSAGE_OVERHEAD
+
+    async def _summarize(self, dropped: list["Message"], model: str) -> None:
+        transcript = "\n\n".join(f"{m.role}: {m.text()}" for m in dropped)
+        if self.summary:
+            transcript = f"Resumo anterior: {self.summary}\n\n{transcript}"
+        summary = await engine.stream_chat(
+            [
+                {
+                    "role": "system",
+                    "content": "Resuma a conversa a seguir em poucas frases,"
+                    " mantendo fatos, decisões e nomes importantes.",
+                },
+                {"role": "user", "content": transcript},
+            ],
+            model,
+            max(100, self.max_tokens // 10),
+        )
+        self.summary = summary.strip()
@@ -0,0 +1,170 @@
+""" Image encoding for vision requests
+
+Images are turned into `data:` URLs with their real MIME type, optionally
+downscaled first (requires Pillow), and the encoded payloads are cached by
+content hash, in memory and under `$XDG_CACHE_HOME/vox/images`, so sending the
+same image again costs neither the resize nor the base64 encoding. The disk
+cache keeps at most `DISK_ENTRIES` payloads and `DISK_BYTES` in total; the
+least recently used go first.
+"""
+
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+from collections import OrderedDict
+
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+_memory: "OrderedDict[str, str]" = OrderedDict()
+MEMORY_ENTRIES = 32
+DISK_ENTRIES = 64
+DISK_BYTES = 256 * 1024 * 1024
+
+
+def cache_dir() -> str:
+    """
+    Returns the directory of the on-disk payload cache.
+
+    Returns:
+        str: `$XDG_CACHE_HOME/vox/images`.
+    """
+    return os.path.join(
+        os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "vox",
+        "images",
+    )
+
+
+def evict(directory: str, max_entries: int, max_bytes: int) -> None:
+    """
+    Removes the least recently used payloads until the disk cache is within
+    its bounds.
+
+    Args:
+        directory (str): The cache directory.
+        max_entries (int): Maximum number of payloads.
+        max_bytes (int): Maximum total size, in bytes.
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    entries.sort()  # oldest first
+    total = sum(size for _, size, _ in entries)
+    while entries and (len(entries) > max_entries or total > max_bytes):
+        _, size, path = entries.pop(0)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def detect_mime(data: bytes, path: str = "") -> str:
+    """
+    Detects the MIME type of an image from its first bytes.
+
+    Args:
+        data (bytes): The image.
+        path (str): Its file name, used when the bytes are not recognized.
+
+    Returns:
+        str: The MIME type, `image/jpeg` if unknown.
+    """
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    guessed, _ = mimetypes.guess_type(path)
+    return guessed if guessed and guessed.startswith("image/") else "image/jpeg"
+
+
+def downscale(data: bytes, mime: str, max_side: int) -> tuple[bytes, str]:
+    """
+    Shrinks an image so that its longest side is at most `max_side` pixels.
+
+    Does nothing if Pillow is not installed or the image is already small.
+
+    Args:
+        data (bytes): The image.
+        mime (str): Its MIME type.
+        max_side (int): Maximum width and height, in pixels.
+
+    Returns:
+        tuple[bytes, str]: The image and its MIME type.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, mime
+
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_side:
+            return data, mime
+        image.thumbnail((max_side, max_side))
+        keep_png = mime == "image/png" and image.mode in ("RGBA", "LA", "P")
+        if not keep_png and image.mode != "RGB":
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        if keep_png:
+            image.save(out, "PNG", optimize=True)
+            return out.getvalue(), "image/png"
+        image.save(out, "JPEG", quality=85)
+        return out.getvalue(), "image/jpeg"
+
+
+def encode_image(path: str, max_side: int | None = None) -> str:
+    """
+    Returns an image file as a `data:` URL ready for an `image_url` part.
+
+    Args:
+        path (str): The image file.
+        max_side (int | None): Downscale to this many pixels on the longest
+            side before encoding.
+
+    Raises:
+        ValueError: If the path does not exist.
+
+    Returns:
+        str: The data URL.
+    """
+    if not os.path.exists(path):
+        raise ValueError("The path to the image does not exist.")
+
+    with open(path, "rb") as fp:
+        data = fp.read()
+    key = hashlib.sha256(data + f"|{max_side}".encode()).hexdigest()
+
+    if key in _memory:
+        _memory.move_to_end(key)
+        return _memory[key]
+
+    cached = os.path.join(cache_dir(), key)
+    if os.path.exists(cached):
+        with open(cached, "r", encoding="ascii") as fp:
+            url = fp.read()
+        os.utime(cached)  # recently used, for eviction
+    else:
+        mime = detect_mime(data, path)
+        if max_side:
+            data, mime = downscale(data, mime, max_side)
+        url = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+        os.makedirs(cache_dir(), exist_ok=True)
+        with open(cached + ".tmp", "w", encoding="ascii") as fp:
+            fp.write(url)
+        os.replace(cached + ".tmp", cached)
+        evict(cache_dir(), DISK_ENTRIES, DISK_BYTES)
+
+    _memory[key] = url
+    if len(_memory) > MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+    return url
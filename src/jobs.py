@@ -0,0 +1,237 @@
+""" Background jobs for the REPL
+
+A job answers one prompt on its own branch of the conversation, on the
+engine's loop, while the REPL keeps reading input. At most `concurrency` jobs
+stream at once; the others wait in line. The pieces of each answer are kept
+as they arrive, so a job can be attached to (its text so far, then the rest
+live), copied once finished, or turned into the current conversation.
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import threading
+from typing import Awaitable, Callable
+
+from . import engine
+from .conversation import Conversation
+from .custom_types import TMESSAGE
+
+LABELS = {
+    "queued": "na fila",
+    "running": "rodando",
+    "done": "pronto",
+    "failed": "erro",
+    "cancelled": "cancelado",
+}
+
+
+class Job:
+    """
+    One prompt answered in the background.
+
+    Attributes:
+        id (int): Its number, from 1.
+        prompt (str): The prompt, aliases expanded.
+        model (str): The model answering it.
+        branch (Conversation): The conversation it continues; the answer is
+            appended to it when the job finishes.
+        status (str): `queued`, `running`, `done`, `failed` or `cancelled`.
+        pieces (list[str]): The answer received so far.
+        error (str): What went wrong, when it failed.
+    """
+
+    def __init__(self, id: int, prompt: str, model: str, branch: Conversation):
+        self.id = id
+        self.prompt = prompt
+        self.model = model
+        self.branch = branch
+        self.status = "queued"
+        self.pieces: list[str] = []
+        self.error = ""
+        self.future: concurrent.futures.Future | None = None
+        self.changed = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def text(self) -> str:
+        """
+        Returns the answer received so far.
+
+        Returns:
+            str: The answer.
+        """
+        return "".join(self.pieces)
+
+    def _piece(self, text: str) -> None:
+        # called on the engine's loop
+        with self.changed:
+            self.pieces.append(text)
+            self.changed.notify_all()
+
+    def _set_status(self, status: str) -> None:
+        with self.changed:
+            self.status = status
+            self.changed.notify_all()
+
+
+class JobQueue:
+    """
+    The REPL's background jobs.
+    """
+
+    def __init__(self, concurrency: int = 4) -> None:
+        self.jobs: dict[int, Job] = {}
+        self.concurrency = max(1, concurrency)
+        self._ids = itertools.count(1)
+        self._running = 0
+        self._turn = asyncio.Condition()
+        self._unseen: list[Job] = []
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        prompt: str,
+        branch: Conversation,
+        model: str,
+        max_tokens: int,
+        build: Callable[[Conversation], Awaitable[list[TMESSAGE]]],
+    ) -> Job:
+        """
+        Queues a prompt.
+
+        Args:
+            prompt (str): The prompt, for listings.
+            branch (Conversation): The conversation to continue, ending with
+                the prompt's user message; the caller should not touch it
+                afterwards.
+            model (str): The model to use.
+            max_tokens (int): The maximum number of tokens to generate.
+            build (Callable[[Conversation], Awaitable[list[TMESSAGE]]]):
+                Builds the messages to send for the branch.
+
+        Returns:
+            Job: The job, already queued.
+        """
+        job = Job(next(self._ids), prompt, model, branch)
+        self.jobs[job.id] = job
+        job.future = engine.submit(self._run(job, max_tokens, build))
+        job.future.add_done_callback(lambda future: self._finished(job, future))
+        return job
+
+    async def _run(
+        self,
+        job: Job,
+        max_tokens: int,
+        build: Callable[[Conversation], Awaitable[list[TMESSAGE]]],
+    ) -> None:
+        try:
+            async with self._turn:
+                await self._turn.wait_for(lambda: self._running < self.concurrency)
+                self._running += 1
+            try:
+                job._set_status("running")
+                sent = await build(job.branch)
+                answer = await engine.stream_chat(
+                    sent, job.model, max_tokens, job._piece
+                )
+            finally:
+                async with self._turn:
+                    self._running -= 1
+                    self._turn.notify_all()
+            if answer.strip():
+                job.branch.append({"role": "assistant", "content": answer.strip()})
+            job._set_status("done")
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job._set_status("failed")
+
+    def _finished(self, job: Job, future: concurrent.futures.Future) -> None:
+        # also runs for jobs cancelled before they started
+        if future.cancelled():
+            job._set_status("cancelled")
+        with self._lock:
+            self._unseen.append(job)
+
+    def resize(self, concurrency: int) -> None:
+        """
+        Changes how many jobs may stream at once. Jobs already streaming go
+        on; queued ones start as slots allow.
+
+        Args:
+            concurrency (int): The new limit.
+        """
+
+        async def wake() -> None:
+            async with self._turn:
+                self.concurrency = max(1, concurrency)
+                self._turn.notify_all()
+
+        engine.submit(wake())
+
+    def get(self, id: int) -> Job | None:
+        """
+        Finds a job.
+
+        Args:
+            id (int): Its number.
+
+        Returns:
+            Job | None: The job, if there is one with that number.
+        """
+        return self.jobs.get(id)
+
+    def cancel(self, id: int) -> bool:
+        """
+        Cancels a job that has not finished.
+
+        Args:
+            id (int): Its number.
+
+        Returns:
+            bool: Whether there was such a job to cancel.
+        """
+        job = self.jobs.get(id)
+        if job is None or job.done or job.future is None:
+            return False
+        job.future.cancel()
+        return True
+
+    def finished(self) -> list[Job]:
+        """
+        Returns the jobs that finished since the last call, for the REPL to
+        announce.
+
+        Returns:
+            list[Job]: The jobs, in the order they finished.
+        """
+        with self._lock:
+            unseen, self._unseen = self._unseen, []
+        return unseen
+
+    @staticmethod
+    def attach(job: Job, write: Callable[[str], None]) -> None:
+        """
+        Writes a job's answer so far, then the rest as it arrives, until
+        the job finishes. Ctrl-C stops following it without cancelling it.
+
+        Args:
+            job (Job): The job.
+            write (Callable[[str], None]): Receives each piece.
+        """
+        shown = 0
+        while True:
+            # writing may block on the terminal, so it happens outside the
+            # lock that the engine's loop takes for every piece
+            with job.changed:
+                if shown == len(job.pieces) and not job.done:
+                    job.changed.wait(0.1)
+                new = job.pieces[shown:]
+                done = job.done
+            for piece in new:
+                write(piece)
+            shown += len(new)
+            if done:  # its last pieces were taken along with the status
+                return
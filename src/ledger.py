@@ -0,0 +1,445 @@
+""" Token and cost ledger
+
+Every completion the API answers is appended to a local ledger as one
+fixed-size record: when it finished, its cost, its prompt, completion and
+cached tokens, and the ids of its session, model and aliases. Model names and
+alias lists are stored once, in a string table next to the records, so a
+record takes 36 bytes whatever it describes.
+
+Records are appended in time order, so the ones in a period are found by a
+binary search over the memory-mapped file and only those are read;
+`vox usage` aggregates them by model, alias, day or session.
+
+The `ledger` section of `configs.json` may set budgets in USD per day and per
+month. When one is exceeded, requests are refused (`"action": "block"`) or
+sent to a cheaper model instead (`"action": "downgrade"`, to `fallback`).
+Answers from the response cache cost nothing and are neither recorded nor
+blocked.
+
+The aliases and session of a request are taken from `labels`, a context
+variable: set it before handing the request to the engine (tasks copy the
+context they are created in).
+"""
+
+import bisect
+import contextvars
+import fcntl
+import math
+import mmap
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Iterator
+
+from .config import Config
+from .metrics import CompletionMetrics, cost
+
+# finished, cost, prompt, completion, cached, session, model, aliases
+RECORD = struct.Struct("<dfIIIIII")
+
+# (aliases, session) of the requests started in the current context
+labels: contextvars.ContextVar[tuple[str, int | None]] = contextvars.ContextVar(
+    "labels", default=("", None)
+)
+
+GROUPS = ("model", "alias", "day", "session")
+
+
+class BudgetExceeded(Exception):
+    """
+    A budget in the `ledger` section of `configs.json` was exceeded.
+    """
+
+
+@dataclass
+class Entry:
+    """
+    One completion, as recorded.
+
+    Attributes:
+        finished (float): Unix time when the stream ended.
+        cost (float): Its cost in USD; NaN if the model has no price.
+        prompt_tokens (int): Prompt tokens.
+        completion_tokens (int): Completion tokens.
+        cached_tokens (int): Prompt tokens served from the provider's cache.
+        session (int | None): The REPL session, if any.
+        model (str): The model.
+        aliases (str): The aliases used in the prompt, separated by spaces.
+    """
+
+    finished: float
+    cost: float
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    session: int | None
+    model: str
+    aliases: str
+
+
+def default_path() -> str:
+    """
+    Returns the default location of the ledger.
+
+    Returns:
+        str: `$XDG_DATA_HOME/vox/ledger`.
+    """
+    return os.path.join(
+        os.getenv("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"),
+        "vox",
+        "ledger",
+    )
+
+
+def day_start(t: float) -> float:
+    """
+    Returns the local midnight that starts the day of a time.
+
+    Args:
+        t (float): Unix time.
+
+    Returns:
+        float: Unix time of the midnight.
+    """
+    d = time.localtime(t)
+    return time.mktime((d.tm_year, d.tm_mon, d.tm_mday, 0, 0, 0, 0, 0, -1))
+
+
+def month_start(t: float) -> float:
+    """
+    Returns the local midnight that starts the month of a time.
+
+    Args:
+        t (float): Unix time.
+
+    Returns:
+        float: Unix time of the midnight.
+    """
+    d = time.localtime(t)
+    return time.mktime((d.tm_year, d.tm_mon, 1, 0, 0, 0, 0, 0, -1))
+
+
+class _Times:
+    # the records' times as a sequence, for bisect
+    def __init__(self, data: memoryview) -> None:
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._data) // RECORD.size
+
+    def __getitem__(self, i: int) -> float:
+        return RECORD.unpack_from(self._data, i * RECORD.size)[0]
+
+
+class Ledger:
+    """
+    Append-only record of the tokens and cost of every completion.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        prices: dict[str, dict[str, float]] | None = None,
+        daily: float | None = None,
+        monthly: float | None = None,
+        action: str = "block",
+        fallback: str | None = None,
+    ) -> None:
+        """
+        Args:
+            path (str | None): Directory of the ledger.
+            prices (dict[str, dict[str, float]] | None): The `prices` section
+                of `configs.json`.
+            daily (float | None): Budget in USD per day.
+            monthly (float | None): Budget in USD per month.
+            action (str): `block` or `downgrade`, when a budget is exceeded.
+            fallback (str | None): Model to downgrade to.
+        """
+        self.path = path or default_path()
+        self.prices = prices or {}
+        self.daily = daily
+        self.monthly = monthly
+        self.action = action
+        self.fallback = fallback
+        os.makedirs(self.path, exist_ok=True)
+        self._records_path = os.path.join(self.path, "usage.bin")
+        self._strings_path = os.path.join(self.path, "strings.txt")
+        self._strings: list[str] = [""]  # id 0 is the empty string
+        self._ids: dict[str, int] = {"": 0}
+        self._strings_read = 0  # bytes of the string table already read
+        self._spent: dict[float, tuple[int, float]] = {}  # since -> (bytes, USD)
+
+    @classmethod
+    def from_config(cls, config: Config) -> "Ledger":
+        """
+        Builds a ledger from `configs.json`.
+
+        Args:
+            config (Config): The configuration.
+
+        Returns:
+            Ledger: The ledger.
+        """
+        settings = config.section("ledger")
+        fallback = settings.get("fallback")
+        return cls(
+            settings.get("path"),
+            config.section("prices"),
+            settings.get("daily"),
+            settings.get("monthly"),
+            settings.get("action", "block"),
+            config.model(fallback) if fallback else None,
+        )
+
+    def _read_strings(self, fp) -> None:
+        fp.seek(self._strings_read)
+        data = fp.read()
+        # a line is only complete once its newline is written
+        complete = data[: data.rfind(b"\n") + 1]
+        for line in complete.decode().splitlines():
+            self._ids.setdefault(line, len(self._strings))
+            self._strings.append(line)
+        self._strings_read += len(complete)
+
+    def _string(self, i: int) -> str:
+        if i >= len(self._strings):
+            with open(self._strings_path, "rb") as fp:
+                self._read_strings(fp)
+        return self._strings[i]
+
+    def _intern(self, s: str) -> int:
+        if s in self._ids:
+            return self._ids[s]
+        # another process may have added strings since; the lock keeps two
+        # of them from giving the same string different ids
+        with open(self._strings_path, "a+b") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            self._read_strings(fp)
+            if s not in self._ids:
+                fp.write(s.encode() + b"\n")
+                fp.flush()
+                self._strings_read += len(s.encode()) + 1
+                self._ids[s] = len(self._strings)
+                self._strings.append(s)
+        return self._ids[s]
+
+    def append(self, m: CompletionMetrics) -> None:
+        """
+        Records a completion, with the aliases and session in `labels`.
+
+        Args:
+            m (CompletionMetrics): Its metrics; needs the usage reported by
+                the API.
+        """
+        aliases, session = labels.get()
+        price = cost(m, self.prices)
+        record = RECORD.pack(
+            time.time(),
+            math.nan if price is None else price,
+            m.prompt_tokens or 0,
+            m.completion_tokens or 0,
+            m.cached_tokens or 0,
+            session or 0,
+            self._intern(m.model),
+            self._intern(aliases),
+        )
+        # one write with O_APPEND, so records from several processes (the
+        # daemon and a REPL) do not interleave
+        fd = os.open(
+            self._records_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+        try:
+            os.write(fd, record)
+        finally:
+            os.close(fd)
+
+    def entries(
+        self, since: float | None = None, until: float | None = None
+    ) -> Iterator[Entry]:
+        """
+        Reads the records of a period.
+
+        Args:
+            since (float | None): Unix time the period starts at.
+            until (float | None): Unix time the period ends before.
+
+        Yields:
+            Entry: Each record, oldest first.
+        """
+        for _, values in self._scan(since, until):
+            finished, price, prompt, completion, cached, session, model, aliases = (
+                values
+            )
+            yield Entry(
+                finished,
+                price,
+                prompt,
+                completion,
+                cached,
+                session or None,
+                self._string(model),
+                self._string(aliases),
+            )
+
+    def _scan(
+        self, since: float | None, until: float | None, offset: int = 0
+    ) -> Iterator[tuple[int, tuple]]:
+        # yields the offset past each record, and its values
+        if not os.path.exists(self._records_path):
+            return
+        with open(self._records_path, "rb") as fp:
+            size = os.fstat(fp.fileno()).st_size
+            size -= size % RECORD.size  # a record still being written
+            if size <= offset:
+                return
+            with mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                data = memoryview(mm)
+                try:
+                    times = _Times(data)
+                    first = max(
+                        offset // RECORD.size,
+                        0 if since is None else bisect.bisect_left(times, since),
+                    )
+                    last = len(times) if until is None else bisect.bisect_left(
+                        times, until
+                    )
+                    for i in range(first, last):
+                        yield (i + 1) * RECORD.size, RECORD.unpack_from(
+                            data, i * RECORD.size
+                        )
+                finally:
+                    del times
+                    data.release()
+
+    def report(
+        self, by: str, since: float | None = None, until: float | None = None
+    ) -> tuple[dict[str, dict[str, float]], dict[str, float]]:
+        """
+        Aggregates the records of a period.
+
+        A record with several aliases counts for each of them, and once in
+        the total.
+
+        Args:
+            by (str): `model`, `alias`, `day` or `session`.
+            since (float | None): Unix time the period starts at.
+            until (float | None): Unix time the period ends before.
+
+        Returns:
+            tuple[dict[str, dict[str, float]], dict[str, float]]: For each
+            group, and for the whole period, the number of requests, the
+            prompt, cached and completion tokens and the cost (NaN if some
+            model has no price).
+        """
+
+        def totals() -> dict[str, float]:
+            return {
+                "requests": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "completion_tokens": 0,
+                "cost": 0.0,
+            }
+
+        groups: dict[str, dict[str, float]] = {}
+        total = totals()
+        for e in self.entries(since, until):
+            if by == "model":
+                keys = [e.model]
+            elif by == "alias":
+                keys = e.aliases.split() or ["-"]
+            elif by == "day":
+                keys = [time.strftime("%Y-%m-%d", time.localtime(e.finished))]
+            else:
+                keys = [str(e.session) if e.session else "-"]
+            for g in [total, *(groups.setdefault(key, totals()) for key in keys)]:
+                g["requests"] += 1
+                g["prompt_tokens"] += e.prompt_tokens
+                g["cached_tokens"] += e.cached_tokens
+                g["completion_tokens"] += e.completion_tokens
+                g["cost"] += e.cost
+        return groups, total
+
+    def spent(self, since: float) -> float:
+        """
+        Returns the cost of the completions recorded since a time.
+
+        Only the records appended since the last call for the same time are
+        read.
+
+        Args:
+            since (float): Unix time.
+
+        Returns:
+            float: The cost in USD, not counting models without a price.
+        """
+        offset, total = self._spent.get(since, (0, 0.0))
+        for offset, values in self._scan(since, None, offset):
+            if not math.isnan(values[1]):
+                total += values[1]
+        self._spent[since] = (offset, total)
+        return total
+
+    def exceeded(self) -> str | None:
+        """
+        Checks the budgets.
+
+        Returns:
+            str | None: A description of the budget exceeded, if any.
+        """
+        now = time.time()
+        if self.daily is not None and self.spent(day_start(now)) >= self.daily:
+            return f"orçamento diário de US$ {self.daily:.2f} esgotado"
+        if self.monthly is not None and self.spent(month_start(now)) >= self.monthly:
+            return f"orçamento mensal de US$ {self.monthly:.2f} esgotado"
+        return None
+
+    def route(self, model: str) -> str:
+        """
+        Chooses the model for a request: the fallback one if a budget was
+        exceeded and the action is `downgrade`.
+
+        Args:
+            model (str): The model asked for.
+
+        Returns:
+            str: The model to use.
+        """
+        if self.action == "downgrade" and self.fallback and self.exceeded():
+            return self.fallback
+        return model
+
+    def check(self) -> None:
+        """
+        Refuses a request if a budget was exceeded and the action is `block`.
+
+        Raises:
+            BudgetExceeded: If so.
+        """
+        if self.action == "block" and (reason := self.exceeded()):
+            raise BudgetExceeded(reason)
+
+
+def format_report(
+    groups: dict[str, dict[str, float]], total: dict[str, float]
+) -> str:
+    """
+    Formats the result of `Ledger.report` as a table.
+
+    Args:
+        groups (dict[str, dict[str, float]]): The groups.
+        total (dict[str, float]): The whole period.
+
+    Returns:
+        str: One line per group, in key order, then the total.
+    """
+    lines = []
+    for key, g in [*sorted(groups.items()), ("total", total)]:
+        cost = "sem preço" if math.isnan(g["cost"]) else f"US$ {g['cost']:.4f}"
+        lines.append(
+            f"{key:<24} {g['requests']:>7} req  {g['prompt_tokens']:>11} prompt"
+            f" ({g['cached_tokens']} em cache)  {g['completion_tokens']:>10} resposta"
+            f"  {cost}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,158 @@
+""" Map-reduce over inputs larger than the context window
+
+The input (a file or stdin) is read lazily and cut into chunks of at most
+`chunk_tokens` tokens. The instruction is run over the chunks concurrently
+(map), and the partial answers are combined into one (reduce), in groups if
+they are too long to combine at once.
+"""
+
+import sys
+from typing import Callable, Iterator, TextIO
+
+from . import engine
+from .history import count_tokens
+from .vox import fill_input
+
+REDUCE_PROMPT = (
+    "As respostas a seguir foram obtidas aplicando a instrução"
+    " \"{instruction}\" a partes consecutivas de um mesmo texto. Combine-as"
+    " numa única resposta para a instrução, como se ela tivesse sido aplicada"
+    " ao texto inteiro.\n\n{parts}"
+)
+
+
+def read_chunks(source: TextIO, chunk_tokens: int, model: str) -> Iterator[str]:
+    """
+    Cuts a text stream into chunks of at most `chunk_tokens` tokens.
+
+    Chunks end at line breaks; a single line longer than a chunk is cut at
+    roughly `chunk_tokens` tokens' worth of characters.
+
+    Args:
+        source (TextIO): The input, read one line at a time.
+        chunk_tokens (int): Maximum tokens per chunk.
+        model (str): The model whose tokenizer to use.
+
+    Yields:
+        str: Each chunk.
+    """
+    lines: list[str] = []
+    used = 0
+    chars_per_token = 4.0  # of the text so far; sizes the cuts of long lines
+    for line in source:
+        while line:
+            # twice the estimate, so that a line that fits is rarely cut; only
+            # the piece is counted, never the rest of a long line
+            piece = line[: max(1, int(2 * chunk_tokens * chars_per_token))]
+            tokens = count_tokens(piece, model)
+            while tokens > chunk_tokens and len(piece) > 1:
+                piece = piece[: max(1, len(piece) * chunk_tokens // tokens)]
+                tokens = count_tokens(piece, model)
+            if tokens:
+                chars_per_token = len(piece) / tokens
+            line = line[len(piece) :]
+            if lines and used + tokens > chunk_tokens:
+                yield "".join(lines)
+                lines, used = [], 0
+            lines.append(piece)
+            used += tokens
+    if lines:
+        yield "".join(lines)
+
+
+async def map_reduce(
+    source: TextIO,
+    instruction: str,
+    model: str,
+    context: str,
+    max_tokens: int,
+    chunk_tokens: int = 3000,
+    concurrency: int = 4,
+    on_text: Callable[[str], None] | None = None,
+) -> str:
+    """
+    Applies an instruction to a text of any size.
+
+    Args:
+        source (TextIO): The input text.
+        instruction (str): What to do with it, aliases already expanded. If it
+            contains `-:p`, each chunk goes there; otherwise after it.
+        model (str): The model to use.
+        context (str): The system context.
+        max_tokens (int): The maximum number of tokens of each answer.
+        chunk_tokens (int): Maximum tokens of input per request.
+        concurrency (int): Maximum number of requests in flight.
+        on_text (Callable[[str], None] | None): Receives the final answer as
+            it streams.
+
+    Returns:
+        str: The final answer; empty, without any request, if the input is.
+    """
+
+    async def ask(prompt: str, stream: bool = False) -> str:
+        return await engine.stream_chat(
+            [
+                {"role": "system", "content": context},
+                {"role": "user", "content": prompt},
+            ],
+            model,
+            max_tokens,
+            on_text if stream else None,
+        )
+
+    async def map_one(chunk: str) -> str:
+        return (await ask(fill_input(instruction, chunk))).strip()
+
+    partials: list[str] = []
+    # read and cut off the loop: the source may be a slow pipe
+    chunks = engine.iterate_in_thread(
+        chunk for chunk in read_chunks(source, chunk_tokens, model) if chunk.strip()
+    )
+    async for i, answer in engine.bounded_map(map_one, chunks, concurrency):
+        partials.append(answer)
+        sys.stderr.write(f"\r<{i + 1} partes>")
+    if not partials:
+        # nothing to answer: no request, rather than whatever a reduce of
+        # nothing would make up
+        sys.stderr.write("<entrada vazia>\n")
+        return ""
+    sys.stderr.write("\n")
+
+    if len(partials) == 1:
+        if on_text is not None:
+            on_text(partials[0])
+        return partials[0]
+
+    # combine in groups that fit in a request, until one group is left
+    while True:
+        groups: list[list[str]] = [[]]
+        used = 0
+        for partial in partials:
+            tokens = count_tokens(partial, model)
+            if groups[-1] and used + tokens > chunk_tokens:
+                groups.append([])
+                used = 0
+            groups[-1].append(partial)
+            used += tokens
+        if len(groups) == 1:
+            return await ask(_reduce_prompt(instruction, partials), stream=True)
+        if len(groups) == len(partials):
+            # each partial alone is too long: pair them so the rounds converge
+            groups = [partials[i : i + 2] for i in range(0, len(partials), 2)]
+
+        async def reduce_one(group: list[str]) -> str:
+            return (await ask(_reduce_prompt(instruction, group))).strip()
+
+        partials = [
+            answer
+            async for _, answer in engine.bounded_map(reduce_one, groups, concurrency)
+        ]
+
+
+def _reduce_prompt(instruction: str, partials: list[str]) -> str:
+    parts = "\n\n".join(
+        f"Parte {i}:\n{partial}" for i, partial in enumerate(partials, 1)
+    )
+    return REDUCE_PROMPT.format(
+        instruction=instruction.replace("-:p", "").strip(), parts=parts
+    )
@@ -0,0 +1,197 @@
+""" Per-request latency and throughput metrics
+
+`engine.stream_chat` records a `CompletionMetrics` for every completion. The
+latest ones are kept in memory for `:stats`; with `--metrics FILE` each record
+is also appended to FILE as a JSON line.
+"""
+
+import json
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+
+records: deque["CompletionMetrics"] = deque(maxlen=1000)
+sink_path: str | None = None
+
+
+@dataclass
+class CompletionMetrics:
+    """
+    Timing and usage of one completion.
+
+    Attributes:
+        model (str): The model.
+        started (float): Unix time when the request was sent.
+        ttft (float | None): Seconds until the first piece of text.
+        total (float): Seconds until the stream ended.
+        chunks (int): Number of pieces of text received.
+        mean_itl (float | None): Mean seconds between pieces after the first.
+        tokens_per_second (float | None): Completion tokens per second after
+            the first token.
+        prompt_tokens (int | None): Prompt tokens reported by the API.
+        completion_tokens (int | None): Completion tokens reported by the API.
+        cached_tokens (int | None): Prompt tokens the provider served from
+            its prompt cache, when reported.
+        cached (bool): Whether the answer came from the response cache.
+        cancelled (bool): Whether the stream was cancelled before it ended;
+            its tokens are then estimated unless the API reported them.
+    """
+
+    model: str
+    started: float = field(default_factory=time.time)
+    ttft: float | None = None
+    total: float = 0.0
+    chunks: int = 0
+    mean_itl: float | None = None
+    tokens_per_second: float | None = None
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    cached_tokens: int | None = None
+    cached: bool = False
+    cancelled: bool = False
+
+
+class Timer:
+    """
+    Measures a stream as its pieces arrive.
+    """
+
+    def __init__(self, model: str) -> None:
+        self.metrics = CompletionMetrics(model)
+        self._start = time.perf_counter()
+        self._first: float | None = None
+        self._last: float | None = None
+
+    def piece(self) -> None:
+        """
+        Marks the arrival of a piece of text.
+        """
+        now = time.perf_counter()
+        if self._first is None:
+            self._first = now
+        self._last = now
+        self.metrics.chunks += 1
+
+    def finish(self, usage=None, cached: bool = False) -> CompletionMetrics:
+        """
+        Completes the measurement and records it.
+
+        Args:
+            usage: The `usage` object of the last chunk, if the API sent one.
+            cached (bool): Whether the answer came from the response cache.
+
+        Returns:
+            CompletionMetrics: The record.
+        """
+        m = self.metrics
+        m.total = time.perf_counter() - self._start
+        m.cached = cached
+        if usage is not None:
+            m.prompt_tokens = usage.prompt_tokens
+            m.completion_tokens = usage.completion_tokens
+            m.cached_tokens = cached_tokens(usage)
+        if self._first is not None:
+            m.ttft = self._first - self._start
+            if m.chunks > 1:
+                m.mean_itl = (self._last - self._first) / (m.chunks - 1)
+            generating = m.total - m.ttft
+            if generating > 0:
+                m.tokens_per_second = (m.completion_tokens or m.chunks) / generating
+        record(m)
+        return m
+
+
+def cached_tokens(usage) -> int | None:
+    """
+    Reads the cached prompt tokens from a `usage` object.
+
+    Older versions of the openai package keep `prompt_tokens_details` as a
+    plain dict, and providers without prompt caching leave it out.
+
+    Args:
+        usage: The `usage` object of a completion.
+
+    Returns:
+        int | None: The cached tokens, or None if not reported.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens")
+    return getattr(details, "cached_tokens", None)
+
+
+def record(m: CompletionMetrics) -> None:
+    """
+    Keeps a record in memory and appends it to `sink_path`, if set.
+
+    Args:
+        m (CompletionMetrics): The record.
+    """
+    records.append(m)
+    if sink_path is not None:
+        with open(sink_path, "a", encoding="utf-8") as fp:
+            fp.write(json.dumps(asdict(m)) + "\n")
+
+
+def summary() -> dict[str, dict[str, float]]:
+    """
+    Aggregates the records in memory by model, ignoring cache hits.
+
+    Cancelled streams count as requests and for their tokens, but not for
+    the timings.
+
+    Returns:
+        dict[str, dict[str, float]]: For each model, the number of requests
+        and the mean TTFT, inter-token latency, tokens/s and total time.
+    """
+    by_model: dict[str, list[CompletionMetrics]] = {}
+    for m in records:
+        if not m.cached:
+            by_model.setdefault(m.model, []).append(m)
+
+    def mean(ms: list[CompletionMetrics], name: str) -> float:
+        values = [getattr(m, name) for m in ms if not m.cancelled]
+        values = [v for v in values if v is not None]
+        return sum(values) / len(values) if values else float("nan")
+
+    return {
+        model: {
+            "requests": len(ms),
+            "ttft": mean(ms, "ttft"),
+            "itl": mean(ms, "mean_itl"),
+            "tokens_per_second": mean(ms, "tokens_per_second"),
+            "total": mean(ms, "total"),
+            "prompt_tokens": sum(m.prompt_tokens or 0 for m in ms),
+            "completion_tokens": sum(m.completion_tokens or 0 for m in ms),
+            "cached_tokens": sum(m.cached_tokens or 0 for m in ms),
+        }
+        for model, ms in by_model.items()
+    }
+
+
+def cost(
+    m: CompletionMetrics, prices: dict[str, dict[str, float]]
+) -> float | None:
+    """
+    Computes the price of a completion.
+
+    Args:
+        m (CompletionMetrics): The record.
+        prices (dict[str, dict[str, float]]): The `prices` section of
+            `configs.json`: USD per million `input` and `output` tokens of
+            each model, and optionally `cached_input` for prompt tokens
+            served from the provider's cache.
+
+    Returns:
+        float | None: The cost in USD, or None if the model has no price or
+        the usage is unknown.
+    """
+    price = prices.get(m.model)
+    if price is None or m.prompt_tokens is None:
+        return None
+    cached = m.cached_tokens or 0
+    return (
+        (m.prompt_tokens - cached) * price.get("input", 0.0)
+        + cached * price.get("cached_input", price.get("input", 0.0))
+        + (m.completion_tokens or 0) * price.get("output", 0.0)
+    ) / 1_000_000
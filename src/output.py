@@ -0,0 +1,78 @@
+""" Buffered writer for streamed answers
+"""
+
+import sys
+import time
+from typing import TextIO
+
+
+class StreamWriter:
+    """
+    Collects the pieces of a streamed answer and writes them out.
+
+    On a terminal every piece is written and flushed as it arrives. When the
+    output is a pipe or a file, pieces are buffered and flushed every
+    `interval` seconds or `max_size` characters, which saves a syscall per
+    token on long answers.
+
+    Attributes:
+        pieces (list[str]): Everything written so far.
+    """
+
+    def __init__(
+        self,
+        stream: TextIO | None = None,
+        interval: float = 0.05,
+        max_size: int = 8192,
+    ) -> None:
+        self.stream = stream or sys.stdout
+        try:
+            self.immediate = self.stream.isatty()
+        except (AttributeError, ValueError):
+            self.immediate = False
+        self.interval = interval
+        self.max_size = max_size
+        self.pieces: list[str] = []
+        self._pending = 0  # pieces not yet written out
+        self._size = 0
+        self._flushed_at = time.monotonic()
+
+    def write(self, text: str) -> None:
+        """
+        Adds a piece of the answer.
+
+        Args:
+            text (str): The piece.
+        """
+        self.pieces.append(text)
+        if self.immediate:
+            self.stream.write(text)
+            self.stream.flush()
+            return
+        self._pending += 1
+        self._size += len(text)
+        if (
+            self._size >= self.max_size
+            or time.monotonic() - self._flushed_at >= self.interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes out whatever is still buffered.
+        """
+        if self._pending:
+            self.stream.write("".join(self.pieces[-self._pending :]))
+            self._pending = 0
+            self._size = 0
+        self.stream.flush()
+        self._flushed_at = time.monotonic()
+
+    def text(self) -> str:
+        """
+        Returns the whole answer written so far.
+
+        Returns:
+            str: The answer.
+        """
+        return "".join(self.pieces)
@@ -0,0 +1,112 @@
+""" Reference documents pinned into the prompt prefix
+
+Providers cache the longest prefix a request shares with earlier ones, so
+everything that does not change between turns goes first and stays
+byte-identical: the system context, then the pinned documents, then the
+history (see src/history.py). Pinned files are read once, when pinned.
+"""
+
+import os
+from typing import Iterable
+
+from .custom_types import TMESSAGE
+
+
+class Pins:
+    """
+    Documents sent after the system context in every request.
+
+    Attributes:
+        tokens (int): Tokens the pinned documents take together.
+    """
+
+    def __init__(self, paths: Iterable[str] = ()) -> None:
+        self._paths: list[str] = []
+        self._messages: list[TMESSAGE] = []
+        self._tokens: list[int] = []
+        self.tokens = 0
+        for path in paths:
+            self.add(path)
+
+    def add(self, path: str) -> None:
+        """
+        Pins a text file.
+
+        Args:
+            path (str): The file.
+
+        Raises:
+            OSError: If the file cannot be read.
+        """
+        # deferred: src/history.py builds its prefix with this module
+        from .history import message_tokens
+
+        with open(path, "r", encoding="utf-8", errors="replace") as fp:
+            text = fp.read()
+        name = os.path.basename(path)
+        message: TMESSAGE = {
+            "role": "system",
+            "content": f"Documento de referência ({name}):\n\n{text}",
+        }
+        self._paths.append(path)
+        self._messages.append(message)
+        self._tokens.append(message_tokens(message))
+        self.tokens += self._tokens[-1]
+
+    def remove(self, index: int) -> str:
+        """
+        Unpins a document.
+
+        Args:
+            index (int): Its position in `paths()`, starting at 1.
+
+        Raises:
+            IndexError: If there is no such document.
+
+        Returns:
+            str: Its path.
+        """
+        if not 1 <= index <= len(self._paths):
+            raise IndexError(index)
+        del self._messages[index - 1]
+        self.tokens -= self._tokens.pop(index - 1)
+        return self._paths.pop(index - 1)
+
+    def paths(self) -> list[tuple[str, int]]:
+        """
+        Returns the pinned files and their tokens, in prefix order.
+
+        Returns:
+            list[tuple[str, int]]: Path and tokens of each document.
+        """
+        return list(zip(self._paths, self._tokens))
+
+    def messages(self) -> list[TMESSAGE]:
+        """
+        Returns the pinned documents as system messages.
+
+        Returns:
+            list[TMESSAGE]: The messages.
+        """
+        return list(self._messages)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+
+def prefix(context: str, pins: Pins | None = None) -> list[TMESSAGE]:
+    """
+    Returns the stable start of a request: the system context and the pinned
+    documents.
+
+    Args:
+        context (str): The system context.
+        pins (Pins | None): The pinned documents.
+
+    Returns:
+        list[TMESSAGE]: The messages.
+    """
+    sent: list[TMESSAGE] = [{"role": "system", "content": context}]
+    if pins is not None:
+        sent.extend(pins.messages())
+    return sent
@@ -0,0 +1,85 @@
+""" Unix filter mode
+
+With `--per-line`, every line of stdin is a separate request: the
+instruction is applied to each line concurrently, and the answers are written
+to stdout in input order, one per line (or one JSON object per line with
+`--jsonl`), without any prompt decoration.
+"""
+
+import json
+import sys
+from typing import TextIO
+
+from . import engine
+from .vox import fill_input
+
+
+async def per_line(
+    source: TextIO,
+    instruction: str,
+    model: str,
+    context: str,
+    max_tokens: int,
+    concurrency: int = 8,
+    jsonl: bool = False,
+    out: TextIO | None = None,
+) -> int:
+    """
+    Answers each line of `source` and writes the answers in order.
+
+    In text mode each answer is collapsed to a single line so that output
+    lines match input lines. Blank input lines give blank output lines
+    without a request.
+
+    Lines are read from a thread of their own (see
+    `engine.iterate_in_thread`), so a slow producer such as `tail -f` does not
+    stall the answers already streaming.
+
+    Args:
+        source (TextIO): The input, read lazily.
+        instruction (str): What to do with each line, aliases already
+            expanded. If it contains `-:p`, the line goes there.
+        model (str): The model to use.
+        context (str): The system context.
+        max_tokens (int): The maximum number of tokens of each answer.
+        concurrency (int): Maximum number of requests in flight.
+        jsonl (bool): Write `{"input": ..., "answer": ...}` objects.
+        out (TextIO | None): Where to write. Defaults to stdout.
+
+    Returns:
+        int: The number of lines that failed.
+    """
+    out = out or sys.stdout
+
+    async def answer(line: str) -> dict:
+        line = line.rstrip("\n")
+        record = {"input": line}
+        if not line.strip():
+            record["answer"] = ""
+            return record
+        try:
+            text = await engine.stream_chat(
+                [
+                    {"role": "system", "content": context},
+                    {"role": "user", "content": fill_input(instruction, line)},
+                ],
+                model,
+                max_tokens,
+            )
+            record["answer"] = text.strip()
+        except Exception as e:  # reported per line, the others go on
+            record["error"] = f"{type(e).__name__}: {e}"
+        return record
+
+    errors = 0
+    lines = engine.iterate_in_thread(source)
+    async for _, record in engine.bounded_map(answer, lines, concurrency):
+        if "error" in record:
+            errors += 1
+            sys.stderr.write(f"<erro: {record['error']}>\n")
+        if jsonl:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            out.write(" ".join(record.get("answer", "").split()) + "\n")
+        out.flush()
+    return errors
@@ -0,0 +1,137 @@
+""" Speculative prefetch of alias answers
+
+While the REPL waits for input, `Prefetcher` polls the clipboard. When its
+contents change, the configured prompts (e.g. `-kw -:p`) are answered over
+them in the background, so the answer is already in the response cache, or
+on its way, when the user asks for it. The work is bounded by a token budget
+and cancelled as soon as it can no longer be used: when the clipboard
+changes again or the conversation moves on.
+"""
+
+import concurrent.futures
+import threading
+from typing import Callable
+
+from . import engine
+from .custom_types import TMESSAGE
+
+# what a prompt needs to be requested: messages, model and max_tokens
+TRequest = tuple[list[TMESSAGE], str, int]
+
+
+class Prefetcher:
+    """
+    Answers prompts over the clipboard before they are asked.
+
+    Attributes:
+        prompts (list[str]): The prompts to prefetch, as the user types them.
+        token_budget (int): Estimated tokens the prefetches may spend in total.
+        spent (int): Estimated tokens spent so far.
+        requested (int): Prefetches sent so far.
+    """
+
+    def __init__(
+        self,
+        prompts: list[str],
+        prepare: Callable[[str, str], TRequest | None],
+        paste: Callable[[], str],
+        token_budget: int = 20000,
+        interval: float = 1.0,
+        max_chars: int = 20000,
+    ) -> None:
+        """
+        Args:
+            prompts (list[str]): The prompts to prefetch.
+            prepare (Callable[[str, str], TRequest | None]): Builds the request
+                the REPL would send for a prompt over the given clipboard
+                text, or returns None when it cannot be predicted.
+            paste (Callable[[], str]): Reads the clipboard.
+            token_budget (int): Estimated tokens the prefetches may spend.
+            interval (float): Seconds between clipboard polls.
+            max_chars (int): Larger clipboard contents are not prefetched.
+        """
+        self.prompts = prompts
+        self.token_budget = token_budget
+        self.spent = 0
+        self.requested = 0
+        self._prepare = prepare
+        self._paste = paste
+        self._interval = interval
+        self._max_chars = max_chars
+        self._futures: list[concurrent.futures.Future] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """
+        Starts polling the clipboard in a background thread.
+
+        What is on the clipboard at this point is taken as already seen; only
+        later changes are prefetched.
+        """
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="vox-prefetch", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops polling and cancels the prefetches still running.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self._interval + 1)
+        self.cancel()
+
+    def cancel(self) -> None:
+        """
+        Cancels the prefetches still running.
+
+        The REPL calls this after every turn: prefetches were built for the
+        conversation as it was, so a new turn makes them useless.
+        """
+        with self._lock:
+            for future in self._futures:
+                future.cancel()
+            self._futures.clear()
+
+    def _watch(self) -> None:
+        try:
+            last = self._paste()
+            while not self._stop.wait(self._interval):
+                text = self._paste()
+                if text != last:
+                    last = text
+                    self._changed(text)
+        except Exception:
+            # no clipboard here; prefetching is only an optimization
+            self._stop.set()
+
+    def _changed(self, text: str) -> None:
+        self.cancel()
+        if not text.strip() or len(text) > self._max_chars:
+            return
+        with self._lock:
+            for prompt in self.prompts:
+                request = self._prepare(prompt, text)
+                if request is None:
+                    continue
+                messages, model, max_tokens = request
+                # same estimate the scheduler uses
+                tokens = engine.estimate_tokens(messages, max_tokens, model)
+                if self.spent + tokens > self.token_budget:
+                    break
+                self.spent += tokens
+                self.requested += 1
+                future = engine.submit(engine.stream_chat(messages, model, max_tokens))
+                # failures only mean the answer will be requested normally
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self._futures.append(future)
@@ -0,0 +1,183 @@
+""" Recording and replaying API traffic
+
+With `--record DIR`, every HTTP exchange made by the shared transport (see
+src/transport.py), which carries `chat`, `cli_quick_answer`, `Client.ask` and
+`Client.send_images`, is saved to DIR. A recording keeps the request, the
+response status and headers, and each chunk of the body as it arrived, with
+the delay since the previous one. Streams that do not complete are not
+saved.
+
+With `--replay DIR`, the transport answers from those files instead of the
+network. The bytes are the same, so everything above the transport runs as
+it did: the openai client, the scheduler, the cache, metrics and output.
+Chunks are delayed as recorded, divided by `speed` (0 sends them at once).
+Identical requests recorded several times are answered by their recordings
+in turn.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import TYPE_CHECKING, AsyncIterator
+
+if TYPE_CHECKING:
+    import httpx
+
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """
+    Identifies a request by what determines its answer.
+
+    The host is left out, so recordings made against one server can be
+    replayed for another.
+
+    Args:
+        method (str): The HTTP method.
+        path (str): The URL path.
+        body (bytes): The request body.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256(f"{method} {path}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _as_text(data: bytes) -> str:
+    # latin-1 maps every byte to one character, so any body (even cut in
+    # the middle of a UTF-8 sequence, or compressed) survives the JSON file
+    return data.decode("latin-1")
+
+
+def recording_transport(
+    inner: "httpx.AsyncBaseTransport", directory: str
+) -> "httpx.AsyncBaseTransport":
+    """
+    Wraps a transport so that its exchanges are saved to a directory.
+
+    Args:
+        inner (httpx.AsyncBaseTransport): The transport that sends requests.
+        directory (str): Where the recordings go.
+
+    Returns:
+        httpx.AsyncBaseTransport: The recording transport.
+    """
+    import httpx
+
+    os.makedirs(directory, exist_ok=True)
+
+    class RecordingStream(httpx.AsyncByteStream):
+        def __init__(
+            self, stream: httpx.AsyncByteStream, recording: dict, started: float
+        ) -> None:
+            self._stream = stream
+            self._recording = recording
+            self._started = started
+            self._complete = False
+
+        async def __aiter__(self) -> AsyncIterator[bytes]:
+            last = self._started
+            async for data in self._stream:
+                now = time.perf_counter()
+                self._recording["chunks"].append([round(now - last, 6), _as_text(data)])
+                last = now
+                yield data
+            self._complete = True
+
+        async def aclose(self) -> None:
+            await self._stream.aclose()
+            if self._complete:
+                key = self._recording["key"]
+                name = f"{key[:16]}-{time.time_ns()}.json"
+                with open(os.path.join(directory, name), "w", encoding="utf-8") as fp:
+                    json.dump(self._recording, fp, ensure_ascii=False)
+
+    class RecordingTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            body = await request.aread()
+            started = time.perf_counter()
+            response = await inner.handle_async_request(request)
+            recording = {
+                "key": request_key(request.method, request.url.path, body),
+                "method": request.method,
+                "path": request.url.path,
+                "body": _as_text(body),
+                "status": response.status_code,
+                "headers": response.headers.multi_items(),
+                "recorded": time.time(),
+                "chunks": [],
+            }
+            return httpx.Response(
+                response.status_code,
+                headers=response.headers,
+                stream=RecordingStream(response.stream, recording, started),
+                extensions=response.extensions,
+            )
+
+        async def aclose(self) -> None:
+            await inner.aclose()
+
+    return RecordingTransport()
+
+
+def replay_transport(directory: str, speed: float = 1.0) -> "httpx.AsyncBaseTransport":
+    """
+    Builds a transport that answers from recordings.
+
+    Args:
+        directory (str): Where the recordings are.
+        speed (float): Divides the recorded delays; 0 removes them.
+
+    Raises:
+        FileNotFoundError: If the directory does not exist.
+
+    Returns:
+        httpx.AsyncBaseTransport: The replaying transport.
+    """
+    import httpx
+
+    recordings: dict[str, list[dict]] = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as fp:
+                recording = json.load(fp)
+            recordings.setdefault(recording["key"], []).append(recording)
+    turns: dict[str, int] = {}
+
+    class ReplayStream(httpx.AsyncByteStream):
+        def __init__(self, chunks: list[list]) -> None:
+            self._chunks = chunks
+
+        async def __aiter__(self) -> AsyncIterator[bytes]:
+            for delay, data in self._chunks:
+                if speed > 0 and delay > 0:
+                    await asyncio.sleep(delay / speed)
+                yield data.encode("latin-1")
+
+    class ReplayTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            body = await request.aread()
+            key = request_key(request.method, request.url.path, body)
+            if key not in recordings:
+                return httpx.Response(
+                    404,
+                    json={
+                        "error": {
+                            "message": f"no recording of this request ({key[:16]})",
+                            "type": "replay",
+                        }
+                    },
+                )
+            turn = turns.get(key, 0)
+            turns[key] = turn + 1
+            recording = recordings[key][turn % len(recordings[key])]
+            return httpx.Response(
+                recording["status"],
+                headers=recording["headers"],
+                stream=ReplayStream(recording["chunks"]),
+            )
+
+    return ReplayTransport()
@@ -0,0 +1,486 @@
+""" Local retrieval index over files and stored sessions
+
+Text is cut into chunks (see src/mapreduce.py), embedded and stored on disk:
+the vectors in a flat float32 file that only grows, and the chunks and their
+sources in SQLite. Re-ingesting only embeds sources whose modification time,
+size or session update changed; their old chunks are deleted and their
+vectors left behind as unused rows. Once unused rows make up more than
+`compact` of the file, the live vectors are copied to a new file and the
+chunks renumbered.
+
+Only one process writes at a time (an exclusive lock on `lock`). The number
+of committed vectors is kept in SQLite, in the same transaction as their
+chunks, so readers never look past it: vectors a writer appended but has not
+committed yet, or left behind when interrupted, are invisible to them and
+cut off by the next writer. Compaction writes a new file, named after a
+generation number that changes in the same transaction, and the previous
+generation is only deleted by the compaction after it, so a query that
+started before it still finds its file.
+
+Queries score every vector at once. With NumPy installed the vector file is
+memory-mapped and scored with a single matrix product; without it, it is read
+into an `array` and only the dimensions the query uses are scored, which
+suits the sparse default embedding.
+
+The default embedding hashes words and word pairs into a fixed number of
+dimensions, so the index works offline and needs no model. Any function that
+maps a list of texts to a list of vectors can replace it (`embedding` in the
+`retrieval` section of `configs.json`, as `module:function`).
+"""
+
+import contextlib
+import fcntl
+import heapq
+import importlib
+import io
+import math
+import os
+import re
+import sqlite3
+import zlib
+from array import array
+from collections import Counter
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Sequence
+
+from .mapreduce import read_chunks
+
+if TYPE_CHECKING:
+    from .sessions import SessionStore
+
+TEmbedding = Callable[[list[str]], list[Sequence[float]]]
+
+CONTEXT_PROMPT = (
+    "Trechos de material de referência que podem ser relevantes para a"
+    " próxima mensagem:\n\n{chunks}"
+)
+
+
+def default_path() -> str:
+    """
+    Returns the default location of the index.
+
+    Returns:
+        str: `$XDG_DATA_HOME/vox/index`.
+    """
+    return os.path.join(
+        os.getenv("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"),
+        "vox",
+        "index",
+    )
+
+
+def hash_embedding(texts: list[str], dim: int = 512) -> list[array]:
+    """
+    Embeds texts by hashing their words and word pairs.
+
+    Each feature adds a weight, with a hash-derived sign, to one of `dim`
+    dimensions; repeated features count logarithmically and vectors are
+    normalized, so the dot product is a cosine similarity.
+
+    Args:
+        texts (list[str]): The texts.
+        dim (int): Number of dimensions.
+
+    Returns:
+        list[array]: One float32 vector per text.
+    """
+    vectors = []
+    for text in texts:
+        words = re.findall(r"\w+", text.lower())
+        features = Counter(words)
+        features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+        vector = array("f", bytes(4 * dim))
+        for feature, count in features.items():
+            h = zlib.crc32(feature.encode())
+            weight = 1 + math.log(count)
+            vector[h % dim] += weight if h & 0x80000000 else -weight
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        vectors.append(array("f", (x / norm for x in vector)))
+    return vectors
+
+
+def load_embedding(spec: str) -> TEmbedding:
+    """
+    Imports an embedding function.
+
+    Args:
+        spec (str): `module:function`.
+
+    Returns:
+        TEmbedding: The function.
+    """
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class Index:
+    """
+    On-disk index of text chunks and their embeddings.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        embed: TEmbedding | None = None,
+        chunk_tokens: int = 300,
+        compact: float = 0.5,
+    ) -> None:
+        """
+        Args:
+            path (str | None): Directory of the index.
+            embed (TEmbedding | None): Embedding function; hashing by default.
+                An index must always be queried with the function that
+                built it.
+            chunk_tokens (int): Maximum tokens per chunk.
+            compact (float): Fraction of unused rows in the vector file
+                above which it is compacted.
+        """
+        self.path = path or default_path()
+        self.embed = embed or hash_embedding
+        self.chunk_tokens = chunk_tokens
+        self.compact = compact
+        os.makedirs(self.path, exist_ok=True)
+        self.db = sqlite3.connect(
+            os.path.join(self.path, "chunks.sqlite"), isolation_level=None
+        )
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS sources (
+                source TEXT PRIMARY KEY,
+                version TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+            """
+        )
+        dim = self.db.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        self.dim: int | None = int(dim[0]) if dim else None
+        # fallback copy of the vector file, and its generation
+        self._cache: array | None = None
+        self._cache_generation = -1
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "Index":
+        """
+        Builds an index from the `retrieval` section of `configs.json`.
+
+        Args:
+            settings (dict): The section, possibly empty.
+
+        Returns:
+            Index: The index.
+        """
+        spec = settings.get("embedding")
+        if spec:
+            embed = load_embedding(spec)
+        else:
+            dim = settings.get("dim", 512)
+
+            def embed(texts: list[str]) -> list[array]:
+                return hash_embedding(texts, dim)
+
+        return cls(
+            settings.get("path"),
+            embed,
+            settings.get("chunk_tokens", 300),
+            settings.get("compact", 0.5),
+        )
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+    def _meta(self, key: str) -> str | None:
+        value = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        found = value.fetchone()
+        return None if found is None else found[0]
+
+    def _state(self) -> tuple[int, int]:
+        # committed vectors and generation of the vector file
+        rows = self._meta("rows")
+        if rows is None:  # indexes written before `rows` was kept
+            last = self.db.execute("SELECT max(row) FROM chunks").fetchone()[0]
+            rows = 0 if last is None else last + 1
+        return int(rows), int(self._meta("generation") or 0)
+
+    def _vectors_path(self, generation: int) -> str:
+        name = f"vectors.{generation}.f32" if generation else "vectors.f32"
+        return os.path.join(self.path, name)
+
+    @contextlib.contextmanager
+    def _writing(self) -> Iterator[None]:
+        with open(os.path.join(self.path, "lock"), "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            yield
+
+    def add(self, source: str, version: str, chunks: Iterable[str]) -> int:
+        """
+        Replaces the chunks of a source, unless it is already indexed at
+        this version.
+
+        Args:
+            source (str): Identifies the source, e.g. a file path.
+            version (str): Changes whenever the source's contents change.
+            chunks (Iterable[str]): Its chunks, read only if needed.
+
+        Returns:
+            int: Number of chunks added.
+        """
+        if self._version(source) == version:
+            return 0
+        texts = [chunk for chunk in chunks if chunk.strip()]
+        vectors = self.embed(texts) if texts else []
+        with self._writing():
+            if self._version(source) == version:  # another writer did it
+                return 0
+            if self.dim is None:
+                dim = self._meta("dim")
+                self.dim = int(dim) if dim else None
+            if vectors and self.dim is None:
+                self.dim = len(vectors[0])
+                self.db.execute(
+                    "INSERT INTO meta (key, value) VALUES ('dim', ?)", (str(self.dim),)
+                )
+            for vector in vectors:
+                if len(vector) != self.dim:
+                    raise ValueError(
+                        f"embedding has {len(vector)} dimensions, index has {self.dim}"
+                    )
+            first, generation = self._state()
+            with open(self._vectors_path(generation), "ab") as fp:
+                # drop what an interrupted writer appended but never committed
+                fp.truncate(first * (self.dim or 0) * 4)
+                for vector in vectors:
+                    fp.write(array("f", vector).tobytes())
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                self.db.executemany(
+                    "INSERT INTO chunks (row, source, text) VALUES (?, ?, ?)",
+                    ((first + i, source, text) for i, text in enumerate(texts)),
+                )
+                self.db.execute(
+                    "INSERT OR REPLACE INTO sources (source, version) VALUES (?, ?)",
+                    (source, version),
+                )
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('rows', ?)",
+                    (str(first + len(vectors)),),
+                )
+            rows = first + len(vectors)
+            if rows and (rows - len(self)) / rows > self.compact:
+                self._compact(rows, generation)
+        return len(texts)
+
+    def _compact(self, rows: int, generation: int) -> None:
+        # called with the write lock held
+        size = self.dim * 4
+        live = [
+            row for (row,) in self.db.execute("SELECT row FROM chunks ORDER BY row")
+        ]
+        new_path = self._vectors_path(generation + 1)
+        with open(self._vectors_path(generation), "rb") as old, open(
+            new_path, "wb"
+        ) as new:
+            for row in live:
+                old.seek(row * size)
+                new.write(old.read(size))
+            new.flush()
+            os.fsync(new.fileno())
+        with self.db:
+            self.db.execute("BEGIN")
+            # rows only move down and in order, so they never collide
+            self.db.executemany(
+                "UPDATE chunks SET row = ? WHERE row = ?",
+                ((i, row) for i, row in enumerate(live) if i != row),
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (("rows", str(len(live))), ("generation", str(generation + 1))),
+            )
+        # the generation before this one may still be read by a query that
+        # started before the last compaction; older ones cannot
+        for old in range(generation):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._vectors_path(old))
+
+    def _version(self, source: str) -> str | None:
+        known = self.db.execute(
+            "SELECT version FROM sources WHERE source = ?", (source,)
+        ).fetchone()
+        return None if known is None else known[0]
+
+    def add_file(self, path: str) -> int:
+        """
+        Indexes a text file; binary files are skipped.
+
+        Args:
+            path (str): The file.
+
+        Returns:
+            int: Number of chunks added.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with open(path, "rb") as fp:
+            if b"\0" in fp.read(1024):
+                return 0
+        with open(path, "r", encoding="utf-8", errors="replace") as fp:
+            return self.add(
+                path,
+                f"{st.st_mtime_ns}:{st.st_size}",
+                read_chunks(fp, self.chunk_tokens, "gpt-4o"),
+            )
+
+    def add_tree(self, path: str) -> tuple[int, int]:
+        """
+        Indexes a file, or every file under a directory except hidden ones.
+
+        Args:
+            path (str): The file or directory.
+
+        Returns:
+            tuple[int, int]: Files seen and chunks added.
+        """
+        if not os.path.isdir(path):
+            return 1, self.add_file(path)
+        files = chunks = 0
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for name in sorted(names):
+                if not name.startswith("."):
+                    files += 1
+                    chunks += self.add_file(os.path.join(root, name))
+        return files, chunks
+
+    def add_sessions(self, store: "SessionStore") -> int:
+        """
+        Indexes the stored REPL sessions that changed since the last time.
+
+        Args:
+            store (SessionStore): The session store.
+
+        Returns:
+            int: Number of chunks added.
+        """
+        added = 0
+        for session_id, updated in store.versions():
+            source, version = f"session:{session_id}", repr(updated)
+            if self._version(source) == version:
+                continue
+            transcript = "\n\n".join(
+                f"{m['role']}: {m['content']}" for m in store.load(session_id)
+            )
+            added += self.add(
+                source,
+                version,
+                read_chunks(io.StringIO(transcript), self.chunk_tokens, "gpt-4o"),
+            )
+        return added
+
+    def search(self, query: str, k: int = 5) -> list[tuple[float, str, str]]:
+        """
+        Finds the chunks most similar to a query.
+
+        Args:
+            query (str): The query.
+            k (int): Number of chunks to return.
+
+        Returns:
+            list[tuple[float, str, str]]: Score, source and text of each
+            chunk, best first.
+        """
+        if k <= 0:
+            return []
+        q = self.embed([query])[0]
+        # one read transaction, so that the rows, the generation and the
+        # chunks all come from the same commit
+        with self.db:
+            self.db.execute("BEGIN")
+            rows, generation = self._state()
+            if not rows:
+                return []
+            if self.dim is None:
+                self.dim = int(self._meta("dim"))
+            live = self.db.execute("SELECT row FROM chunks ORDER BY row")
+            live_rows = [row for (row,) in live]
+            candidates = self._top(q, rows, generation, live_rows, k)
+            found = []
+            for score, row in candidates:
+                source, text = self.db.execute(
+                    "SELECT source, text FROM chunks WHERE row = ?", (row,)
+                ).fetchone()
+                found.append((score, source, text))
+        return found
+
+    def _top(
+        self,
+        q: Sequence[float],
+        rows: int,
+        generation: int,
+        live_rows: list[int],
+        k: int,
+    ) -> list[tuple[float, int]]:
+        try:
+            import numpy as np
+        except ImportError:
+            return self._top_python(q, rows, generation, live_rows, k)
+
+        vectors = np.memmap(
+            self._vectors_path(generation),
+            dtype=np.float32,
+            mode="r",
+            shape=(rows, self.dim),
+        )
+        live = np.asarray(live_rows, dtype=np.int64)
+        # score every row straight from the mapping, then keep the live ones
+        scores = (vectors @ np.asarray(q, dtype=np.float32))[live]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), int(live[i])) for i in best]
+
+    def _top_python(
+        self,
+        q: Sequence[float],
+        rows: int,
+        generation: int,
+        live_rows: list[int],
+        k: int,
+    ) -> list[tuple[float, int]]:
+        if self._cache_generation != generation:
+            self._cache, self._cache_generation = None, generation
+        if self._cache is None or len(self._cache) < rows * self.dim:
+            # read only what was appended since the last query
+            cache = self._cache if self._cache is not None else array("f")
+            with open(self._vectors_path(generation), "rb") as fp:
+                fp.seek(len(cache) * 4)
+                cache.frombytes(fp.read((rows * self.dim - len(cache)) * 4))
+            self._cache = cache
+        scores = [0.0] * rows
+        for j, weight in enumerate(q):
+            if weight:
+                column = self._cache[j : rows * self.dim : self.dim]
+                scores = [s + weight * v for s, v in zip(scores, column)]
+        return heapq.nlargest(k, ((scores[row], row) for row in live_rows))
+
+
+def format_context(found: list[tuple[float, str, str]]) -> str:
+    """
+    Formats retrieved chunks as the content of a system message.
+
+    Args:
+        found (list[tuple[float, str, str]]): The result of `Index.search`.
+
+    Returns:
+        str: The message content.
+    """
+    return CONTEXT_PROMPT.format(
+        chunks="\n\n".join(f"[{source}]\n{text.strip()}" for _, source, text in found)
+    )
@@ -0,0 +1,230 @@
+""" Retries, backoff and per-model rate budgets
+
+Every completion goes through `Scheduler`: before a request is sent it waits
+for room in the model's requests-per-minute and tokens-per-minute budgets
+(`rate_limits` in `configs.json`), so excess work queues instead of failing.
+Requests that fail with a 429, a timeout, a connection error or a 5xx are
+retried with jittered exponential backoff, honouring `Retry-After`; a stream
+is only retried if it failed before its first token.
+"""
+
+import asyncio
+import email.utils
+import random
+import re
+import time
+
+
+class TokenBucket:
+    """
+    Budget of `per_minute` units that refills continuously.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Returns how long to wait until `amount` units are available.
+
+        Args:
+            amount (float): Units needed, capped at the capacity.
+
+        Returns:
+            float: Seconds to wait, 0 if available now.
+        """
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+def parse_duration(value: str) -> float | None:
+    """
+    Parses the durations used by rate-limit headers.
+
+    Args:
+        value (str): Seconds (`"2"`, `"0.5"`), an OpenAI-style duration
+            (`"1m30s"`, `"250ms"`) or an HTTP date.
+
+    Returns:
+        float | None: Seconds, or None if the value is not understood.
+    """
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(n) * scale[u] for n, u in parts)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(headers) -> float | None:
+    """
+    Reads how long the server asked to wait.
+
+    Args:
+        headers: Response headers.
+
+    Returns:
+        float | None: Seconds, or None if the server did not say.
+    """
+    if headers is None:
+        return None
+    if "retry-after-ms" in headers:
+        delay = parse_duration(headers["retry-after-ms"])
+        return None if delay is None else delay / 1000
+    if "retry-after" in headers:
+        return parse_duration(headers["retry-after"])
+    return None
+
+
+class Scheduler:
+    """
+    Queues requests within per-model budgets and decides about retries.
+    """
+
+    def __init__(
+        self,
+        limits: dict[str, dict] | None = None,
+        max_attempts: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ) -> None:
+        self.limits = limits or {}
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._paused_until: dict[str, float] = {}
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> "Scheduler":
+        """
+        Builds a scheduler from `configs.json`.
+
+        Args:
+            settings (dict): The whole configuration.
+
+        Returns:
+            Scheduler: The scheduler.
+        """
+        retry = settings.get("retry", {})
+        return cls(
+            settings.get("rate_limits", {}),
+            retry.get("max_attempts", 6),
+            retry.get("base_delay", 0.5),
+            retry.get("max_delay", 30.0),
+        )
+
+    def _bucket(self, model: str, kind: str) -> TokenBucket | None:
+        per_minute = self.limits.get(model, {}).get(kind)
+        if not per_minute:
+            return None
+        if (model, kind) not in self._buckets:
+            self._buckets[model, kind] = TokenBucket(per_minute)
+        return self._buckets[model, kind]
+
+    async def acquire(self, model: str, tokens: int) -> None:
+        """
+        Waits until a request of `tokens` tokens fits in the model's budget.
+
+        Waiters for the same model are served in order.
+
+        Args:
+            model (str): The model.
+            tokens (int): Estimated prompt plus completion tokens.
+        """
+        lock = self._locks.setdefault(model, asyncio.Lock())
+        async with lock:
+            while True:
+                wait = self._paused_until.get(model, 0.0) - time.monotonic()
+                for kind, amount in (("rpm", 1), ("tpm", tokens)):
+                    bucket = self._bucket(model, kind)
+                    if bucket is not None:
+                        wait = max(wait, bucket.wait_time(amount))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            for kind, amount in (("rpm", 1), ("tpm", tokens)):
+                bucket = self._bucket(model, kind)
+                if bucket is not None:
+                    bucket.take(amount)
+
+    def observe(self, model: str, headers) -> None:
+        """
+        Pauses a model whose rate-limit headers say the budget is exhausted.
+
+        Args:
+            model (str): The model.
+            headers: Headers of a successful response.
+        """
+        for kind in ("requests", "tokens"):
+            if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}", ""))
+                if reset:
+                    self.pause(model, reset)
+
+    def pause(self, model: str, seconds: float) -> None:
+        """
+        Holds every request for a model for some time.
+
+        Args:
+            model (str): The model.
+            seconds (float): How long.
+        """
+        until = time.monotonic() + seconds
+        self._paused_until[model] = max(self._paused_until.get(model, 0.0), until)
+
+    def backoff(self, model: str, attempt: int, error: Exception) -> float | None:
+        """
+        Decides whether and when to retry a failed request.
+
+        A 429 also pauses the other requests for the same model.
+
+        Args:
+            model (str): The model.
+            attempt (int): Attempts made so far, starting at 1.
+            error (Exception): The failure.
+
+        Returns:
+            float | None: Seconds to wait before retrying, or None to give up.
+        """
+        import openai
+
+        retryable = isinstance(
+            error,
+            (
+                openai.RateLimitError,
+                openai.APITimeoutError,
+                openai.APIConnectionError,
+                openai.InternalServerError,
+            ),
+        ) or (
+            isinstance(error, openai.APIStatusError)
+            and error.status_code in (408, 409)
+        )
+        if not retryable or attempt >= self.max_attempts:
+            return None
+        response = getattr(error, "response", None)
+        delay = retry_after(response.headers if response is not None else None)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            delay = random.uniform(delay / 2, delay)
+        if isinstance(error, openai.RateLimitError):
+            self.pause(model, delay)
+        return delay
@@ -0,0 +1,188 @@
+""" Persistent session store
+
+REPL conversations are appended to SQLite as each message arrives, with an
+FTS5 index over the contents. Listing, resuming and searching only touch the
+rows they need, so they stay fast with thousands of stored sessions.
+"""
+
+import os
+import sqlite3
+import time
+
+from .custom_types import TMESSAGE
+
+
+def default_path() -> str:
+    """
+    Returns the default location of the session database.
+
+    Returns:
+        str: `$XDG_DATA_HOME/vox/sessions.sqlite`.
+    """
+    return os.path.join(
+        os.getenv("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"),
+        "vox",
+        "sessions.sqlite",
+    )
+
+
+class SessionStore:
+    """
+    SQLite store of REPL sessions and their messages.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path or default_path()
+        self._db: sqlite3.Connection | None = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY,
+                    started REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    model TEXT NOT NULL,
+                    title TEXT NOT NULL DEFAULT '',
+                    messages INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    session_id INTEGER NOT NULL REFERENCES sessions (id),
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS messages_session
+                    ON messages (session_id, id);
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+                    content, content='messages', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages
+                BEGIN
+                    INSERT INTO messages_fts (rowid, content)
+                    VALUES (new.id, new.content);
+                END;
+                """
+            )
+        return self._db
+
+    def start(self, model: str) -> int:
+        """
+        Creates a new, empty session.
+
+        Args:
+            model (str): The model in use.
+
+        Returns:
+            int: The session id.
+        """
+        now = time.time()
+        cursor = self.db.execute(
+            "INSERT INTO sessions (started, updated, model) VALUES (?, ?, ?)",
+            (now, now, model),
+        )
+        return cursor.lastrowid
+
+    def append(self, session_id: int, message: TMESSAGE) -> None:
+        """
+        Appends a message to a session.
+
+        Args:
+            session_id (int): The session.
+            message (TMESSAGE): The message.
+        """
+        now = time.time()
+        content = message["content"]
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.execute(
+                "INSERT INTO messages (session_id, role, content, created)"
+                " VALUES (?, ?, ?, ?)",
+                (session_id, message["role"], content, now),
+            )
+            self.db.execute(
+                """
+                UPDATE sessions SET
+                    updated = ?,
+                    messages = messages + 1,
+                    title = CASE WHEN title = '' AND ? = 'user'
+                        THEN substr(?, 1, 60) ELSE title END
+                WHERE id = ?
+                """,
+                (now, message["role"], " ".join(content.split()), session_id),
+            )
+
+    def recent(self, limit: int = 20) -> list[tuple[int, float, int, str]]:
+        """
+        Lists the most recently updated sessions.
+
+        Args:
+            limit (int): How many to list.
+
+        Returns:
+            list[tuple[int, float, int, str]]: Id, last update, number of
+            messages and title of each session.
+        """
+        return self.db.execute(
+            "SELECT id, updated, messages, title FROM sessions"
+            " WHERE messages > 0 ORDER BY updated DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    def versions(self) -> list[tuple[int, float]]:
+        """
+        Lists every session with messages and when it last changed.
+
+        Returns:
+            list[tuple[int, float]]: Id and update time of each session.
+        """
+        return self.db.execute(
+            "SELECT id, updated FROM sessions WHERE messages > 0 ORDER BY id"
+        ).fetchall()
+
+    def load(self, session_id: int) -> list[TMESSAGE]:
+        """
+        Loads the messages of a session.
+
+        Args:
+            session_id (int): The session.
+
+        Returns:
+            list[TMESSAGE]: Its messages, oldest first.
+        """
+        return [
+            {"role": role, "content": content}
+            for role, content in self.db.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            )
+        ]
+
+    def search(self, query: str, limit: int = 20) -> list[tuple[int, str, str]]:
+        """
+        Full-text search over every stored message.
+
+        Args:
+            query (str): FTS5 query, e.g. `palavra` or `"frase exata"`.
+            limit (int): Maximum number of results.
+
+        Returns:
+            list[tuple[int, str, str]]: Session id, role and a snippet of each
+            matching message, best matches first.
+        """
+        return self.db.execute(
+            """
+            SELECT m.session_id, m.role,
+                snippet(messages_fts, 0, '[', ']', '…', 12)
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?
+            """,
+            (query, limit),
+        ).fetchall()
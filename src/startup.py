@@ -0,0 +1,43 @@
+""" Startup profiling
+"""
+
+import sys
+import time
+
+STARTED_AT = time.perf_counter()
+
+_marks: list[tuple[str, float]] = []
+_enabled = False
+
+
+def enable() -> None:
+    """
+    Turns on the report printed by `report`.
+    """
+    global _enabled
+    _enabled = True
+
+
+def mark(label: str) -> None:
+    """
+    Records the elapsed time since the process started importing vox.
+
+    Args:
+        label (str): Name of the phase that just finished.
+    """
+    _marks.append((label, time.perf_counter()))
+
+
+def report() -> None:
+    """
+    Prints the duration of each recorded phase to stderr, if enabled.
+    """
+    if not _enabled:
+        return
+    previous = STARTED_AT
+    for label, at in _marks:
+        sys.stderr.write(
+            f"<{label}: {(at - previous) * 1000:.1f} ms"
+            f" (total {(at - STARTED_AT) * 1000:.1f} ms)>\n"
+        )
+        previous = at
@@ -0,0 +1,120 @@
+""" Shared HTTP transport
+
+Every request (text and images, from the engine and from `Client`) goes
+through one `httpx.AsyncClient`, so they share a single keep-alive connection
+pool. HTTP/2 is used when the `h2` package is installed. With the environment
+variable VOX_DEBUG set, each request reports on stderr whether it opened a new
+connection or reused one. The transport can also record or replay the traffic
+(see src/replay.py).
+"""
+
+import importlib.util
+import os
+import sys
+import weakref
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+
+# the `http` section of configs.json
+options: dict = {}
+
+# set by --record / --replay; see src/replay.py
+record_dir: str | None = None
+replay_dir: str | None = None
+replay_speed: float = 1.0
+
+_client: "httpx.AsyncClient | None" = None
+
+
+@dataclass
+class ConnectionStats:
+    """
+    Connection reuse counters.
+
+    Attributes:
+        requests (int): Requests sent.
+        opened (int): Connections opened for them.
+    """
+
+    requests: int = 0
+    opened: int = 0
+
+    @property
+    def reused(self) -> int:
+        return self.requests - self.opened
+
+
+stats = ConnectionStats()
+
+
+def http2_available() -> bool:
+    """
+    Tells whether HTTP/2 can be used.
+
+    Returns:
+        bool: True if the `h2` package is installed.
+    """
+    return importlib.util.find_spec("h2") is not None
+
+
+def http_client() -> "httpx.AsyncClient":
+    """
+    Returns the shared HTTP client, creating it on first use.
+
+    Returns:
+        httpx.AsyncClient: The client, configured from `options`.
+    """
+    global _client
+    if _client is None:
+        import httpx
+
+        class CountingTransport(httpx.AsyncHTTPTransport):
+            """
+            Transport that tells new connections from reused ones.
+            """
+
+            def __init__(self, *args, **kwargs) -> None:
+                super().__init__(*args, **kwargs)
+                self._seen: "weakref.WeakSet" = weakref.WeakSet()
+
+            async def handle_async_request(self, request):
+                response = await super().handle_async_request(request)
+                opened = [c for c in self._pool.connections if c not in self._seen]
+                self._seen.update(opened)
+                stats.requests += 1
+                stats.opened += len(opened)
+                if os.getenv("VOX_DEBUG"):
+                    state = "nova conexão" if opened else "conexão reutilizada"
+                    sys.stderr.write(
+                        f"<http: {request.method} {request.url.path} {state};"
+                        f" {stats.requests} requisições, {stats.opened} conexões>\n"
+                    )
+                return response
+
+        from . import replay
+
+        http2 = options.get("http2", True) and http2_available()
+        transport: httpx.AsyncBaseTransport = CountingTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=options.get("max_connections", 20),
+                max_keepalive_connections=options.get("max_connections", 20),
+                keepalive_expiry=options.get("keepalive", 60.0),
+            ),
+        )
+        if replay_dir is not None:
+            transport = replay.replay_transport(replay_dir, replay_speed)
+        elif record_dir is not None:
+            transport = replay.recording_transport(transport, record_dir)
+        _client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(
+                options.get("timeout", 600.0),
+                connect=options.get("connect_timeout", 5.0),
+            ),
+            follow_redirects=True,
+        )
+    return _client
@@ -1,73 +1,91 @@
-import json
 import os
 import sys
-from dotenv import load_dotenv
-from openai import OpenAI
-import openai.types.chat as openaitypes
-import pyperclip
+from typing import TYPE_CHECKING
 
-load_dotenv()
-
-# -----
-
-TMESSAGE = (
-    openaitypes.ChatCompletionSystemMessageParam
-    | openaitypes.ChatCompletionUserMessageParam
-    | openaitypes.ChatCompletionAssistantMessageParam
-    | openaitypes.ChatCompletionToolMessageParam
-    | openaitypes.ChatCompletionFunctionMessageParam
-)
+if TYPE_CHECKING:
+    import openai.types.chat as openaitypes
 
+if __name__ == "__main__" and not __package__:
+    # run as `python src/vox.py`: import the package this file belongs to,
+    # as `python -m src.vox` does
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "src"
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
+# -----
 
-def chat(messages: list[TMESSAGE], model: str, context: str, max_tokens: int) -> None:
+from .custom_types import TMESSAGE
+from . import config, engine
+from .ledger import BudgetExceeded
+from .conversation import Conversation
+from .history import TokenBudget
+from .pins import Pins, prefix
+from .output import StreamWriter
+
+
+def chat(
+    messages: Conversation,
+    model: str,
+    context: str,
+    max_tokens: int,
+    history: TokenBudget | None = None,
+    pins: Pins | None = None,
+    retrieved: list[TMESSAGE] | None = None,
+) -> None:
     """
     Chat with the OpenAI GPT model using a list of messages.
-    The assistant's answer is appended to messages list.
+    The assistant's answer is appended to the conversation.
+
+    With a `history` budget, only the part of the conversation that fits in it
+    is sent (see src/history.py). Pinned documents follow the system context
+    (see src/pins.py); retrieved chunks go right before the last message, so
+    they do not change the prefix shared with earlier turns.
+
+    Ctrl-C stops the generation; whatever was already received is kept as the
+    answer and the caller goes on. So does a request refused by a budget (see
+    src/ledger.py).
 
     Args:
-        messages (list[TMESSAGE]): List of messages exchanged in the chat.
+        messages (Conversation): Messages exchanged in the chat.
         model (str): The name of the GPT-3 model to use.
         context (str): The system context of the chat.
         max_tokens (int): The maximum number of tokens to generate.
+        history (TokenBudget | None): Budget for the messages sent.
+        pins (Pins | None): Documents pinned into the prompt.
+        retrieved (list[TMESSAGE] | None): Context for this turn only (see
+            src/retrieval.py).
 
     Returns:
         None
     """
 
-    res = client.chat.completions.create(
-        model=model,
-        messages=[
-            openaitypes.ChatCompletionSystemMessageParam(
-                {"role": "system", "content": context}
-            ),
-            *messages,
-        ],
-        max_tokens=max_tokens,
-        n=1,
-        stream=True,
-    )
+    async def request() -> str:
+        if history is None:
+            sent = [*prefix(context, pins), *messages.to_api()]
+        else:
+            sent = await history.select(messages, context, model, pins)
+        if retrieved:
+            sent[-1:-1] = retrieved
+        return await engine.stream_chat(sent, model, max_tokens, out.write)
 
     print("> ", end="")
 
-    final = ""
-    for chunk in res:
-        _aux = chunk.choices[0].delta.content or ""
-        final += _aux
-        sys.stdout.write(_aux)
-        sys.stdout.flush()
+    out = StreamWriter()
+    try:
+        engine.run(request())
+    except KeyboardInterrupt:
+        out.flush()
+        print(" <interrompido>", end="")
+    except BudgetExceeded as e:
+        print(f"<{e}>", end="")
+    out.flush()
     print()
 
-    messages.append(
-        openaitypes.ChatCompletionAssistantMessageParam(
-            {"role": "assistant", "content": final.strip()}
-        )
-    )
+    final = out.text()
+    if final.strip():
+        messages.append({"role": "assistant", "content": final.strip()})
 
 
-def user_says(text: str) -> openaitypes.ChatCompletionUserMessageParam:
+def user_says(text: str) -> "openaitypes.ChatCompletionUserMessageParam":
     """
     Creates a user message for the chat completion.
 
@@ -77,10 +95,35 @@ def user_says(text: str) -> openaitypes.ChatCompletionUserMessageParam:
     Returns:
         openaitypes.ChatCompletionUserMessageParam: The user message parameter object.
     """
-    return openaitypes.ChatCompletionUserMessageParam({"role": "user", "content": text})
+    return {"role": "user", "content": text}
 
 
-def cli_quick_answer(text: str, model: str, context: str, max_tokens: int):
+def fill_input(instruction: str, text: str) -> str:
+    """
+    Puts a text where the instruction has `-:p`, or after it if there is none.
+
+    Args:
+        instruction (str): The instruction, aliases already expanded.
+        text (str): The content it applies to.
+
+    Returns:
+        str: The prompt.
+    """
+    if "-:p" in instruction:
+        return instruction.replace("-:p", text)
+    if not instruction:
+        return text
+    return f"{instruction}\n\n{text}"
+
+
+def cli_quick_answer(
+    text: str,
+    model: str,
+    context: str,
+    max_tokens: int,
+    pins: Pins | None = None,
+    retrieved: list[TMESSAGE] | None = None,
+):
     """
     Generates a quick answer using the OpenAI Chat API.
 
@@ -89,103 +132,86 @@ def cli_quick_answer(text: str, model: str, context: str, max_tokens: int):
         model (str): The model to use for generating the answer.
         context (str): The system context.
         max_tokens (int): The maximum number of tokens to generate.
+        pins (Pins | None): Documents pinned into the prompt.
+        retrieved (list[TMESSAGE] | None): Retrieved context (see
+            src/retrieval.py).
 
     Returns:
         None
     """
 
-    res = client.chat.completions.create(
-        model=model,
-        messages=[
-            openaitypes.ChatCompletionSystemMessageParam(
-                {"role": "system", "content": context}
-            ),
-            openaitypes.ChatCompletionUserMessageParam(
-                {"role": "user", "content": text}
-            ),
-        ],
-        max_tokens=max_tokens,
-        n=1,
-        stream=True,
-    )
-
-    final = ""
-    for chunk in res:
-        _aux = chunk.choices[0].delta.content or ""
-        final += _aux
-        sys.stdout.write(_aux)
-        sys.stdout.flush()
+    out = StreamWriter()
+    try:
+        engine.run(
+            engine.stream_chat(
+                [*prefix(context, pins), *(retrieved or []), user_says(text)],
+                model,
+                max_tokens,
+                out.write,
+            )
+        )
+    except BudgetExceeded as e:
+        print(f"<{e}>", end="")
+    out.flush()
     print()
 
 
 if __name__ == "__main__":
-    CONFIGS_PATH = os.path.sep.join(
-        os.path.dirname(__file__).split(os.path.sep) + ["configs.json"]
-    )
+    import pyperclip
 
-    with open(CONFIGS_PATH, "r", encoding="utf-8") as fp:
-        settings = json.load(fp)
-
-    CONTEXT = settings["system"].strip()
-    MAX_TOKENS = settings["max_tokens"]
-    MODEL: str = settings["models"]["gpt4"]
+    CONFIG = config.load()
+    ALIASES = CONFIG.aliases
+    CONTEXT = CONFIG.system
+    MODEL_KEY = "gpt4"
     cli_args: list[str] = [x.strip() for x in sys.argv[1:]]
     if "3" in cli_args:
-        MODEL = settings["models"]["gpt3"]
+        MODEL_KEY = "gpt3"
     if "v" in cli_args:
-        MODEL = settings["models"]["gpt4vision"]
+        MODEL_KEY = "gpt4vision"
+    MODEL: str = CONFIG.model(MODEL_KEY)
+    MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
 
     if "-p" in cli_args:
         _i = cli_args.index("-p")
 
-        aliases = set(settings["aliases"].keys())
-        _user_input: str = " ".join(cli_args[_i + 1 :])
-        _user_input_raw_set = set(_user_input.split())
-        while not aliases.isdisjoint(_user_input_raw_set):
-            alias = aliases.intersection(_user_input_raw_set).pop()
-            _user_input = _user_input.replace(alias, settings["aliases"][alias])
-            _user_input_raw_set = set(_user_input.split())
+        _user_input: str = ALIASES.expand(" ".join(cli_args[_i + 1 :]))
         if "-:p" in _user_input:
             _user_input = _user_input.replace("-:p", pyperclip.paste())
 
         cli_quick_answer(_user_input, MODEL, CONTEXT, MAX_TOKENS)
     else:
-        msgs: list[TMESSAGE] = []
+        msgs = Conversation()
         user_input_raw: str = input("> ").strip()
         while user_input_raw not in ("", ":q"):
+            try:
+                _config = config.load()
+            except config.ConfigError as e:
+                print(f"<configs.json inválido, mantendo o anterior: {e}>")
+                _config = CONFIG
+            if _config is not CONFIG:
+                CONFIG = _config
+                ALIASES, CONTEXT = CONFIG.aliases, CONFIG.system
+                MODEL = CONFIG.model(MODEL_KEY)
+                MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
+                print("<configs.json recarregado>")
             match user_input_raw:
-                case ":3":
-                    MODEL = settings["models"]["gpt3"]
-                    print(f"<using {MODEL=}>")
-                case ":4":
-                    MODEL = settings["models"]["gpt4"]
+                case ":3" | ":4":
+                    MODEL_KEY = "gpt3" if user_input_raw == ":3" else "gpt4"
+                    MODEL = CONFIG.model(MODEL_KEY)
+                    MAX_TOKENS = CONFIG.max_tokens_for(MODEL)
                     print(f"<using {MODEL=}>")
                 case ":c":
-                    last_assistant_message = [
-                        x["content"] for x in msgs if x["role"] == "assistant"
-                    ].pop()
-                    if last_assistant_message is None:
+                    if msgs.last_assistant is None:
                         print("Nenhuma resposta na lista.")
                     else:
-                        pyperclip.copy(last_assistant_message)
+                        pyperclip.copy(msgs.last_assistant.text())
                 case ":ca":
-                    ALL_MSGS = "\n\n".join(
-                        [f"{x['role']}: {x['content']}" for x in msgs]
-                    )
-                    if ALL_MSGS is None:
+                    if not msgs:
                         print("Nenhuma resposta na lista.")
                     else:
-                        pyperclip.copy(ALL_MSGS)
+                        pyperclip.copy(msgs.transcript())
                 case _:
-                    aliases = set(settings["aliases"].keys())
-                    user_input: str = user_input_raw
-                    user_input_raw_set = set(user_input.split())
-                    while not aliases.isdisjoint(user_input_raw_set):
-                        alias = aliases.intersection(user_input_raw_set).pop()
-                        user_input = user_input.replace(
-                            alias, settings["aliases"][alias]
-                        )
-                        user_input_raw_set = set(user_input.split())
+                    user_input: str = ALIASES.expand(user_input_raw)
                     if "-:p" in user_input:
                         user_input = user_input.replace("-:p", pyperclip.paste())
                     msgs.append(user_says(user_input))
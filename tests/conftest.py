@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+# the tests import the `src` package from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import engine  # noqa: E402
+from src.fake_server import FakeServer, FakeSettings  # noqa: E402
+from src.scheduler import Scheduler  # noqa: E402
+
+
+@pytest.fixture
+def fake_server():
+    """
+    Starts a fake API server; call it with `FakeSettings` fields.
+    """
+    servers = []
+
+    def start(**settings) -> FakeServer:
+        server = FakeServer(0, FakeSettings(**settings)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def client_for():
+    """
+    Builds an AsyncOpenAI client for a fake server, without retries of its
+    own (the scheduler retries).
+    """
+    from openai import AsyncOpenAI
+
+    def make(server: FakeServer) -> AsyncOpenAI:
+        return AsyncOpenAI(api_key="x", base_url=server.base_url, max_retries=0)
+
+    return make
+
+
+@pytest.fixture(autouse=True)
+def isolated_engine(monkeypatch, tmp_path):
+    """
+    No response cache nor ledger, a fresh scheduler with short backoff, and
+    data and cache directories of the test's own.
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    monkeypatch.setattr(engine, "cache", None)
+    monkeypatch.setattr(engine, "ledger", None)
+    monkeypatch.setattr(engine, "scheduler", Scheduler(base_delay=0.01, max_delay=0.05))
+
+
+@pytest.fixture
+def engine_server(fake_server, client_for, monkeypatch):
+    """
+    Starts a fake API server and makes it the engine's shared client.
+    """
+
+    def start(**settings) -> FakeServer:
+        server = fake_server(**settings)
+        monkeypatch.setattr(engine, "_client", client_for(server))
+        return server
+
+    return start
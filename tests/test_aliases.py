@@ -0,0 +1,41 @@
+from src.aliases import AliasEngine
+
+
+def test_expands_only_whole_tokens():
+    aliases = AliasEngine({"-kw": "extraia as palavras-chave"})
+    assert aliases.expand("-kw do texto") == "extraia as palavras-chave do texto"
+    assert aliases.expand("a-kw -kwx") == "a-kw -kwx"
+
+
+def test_parameters():
+    aliases = AliasEngine({"-tr": "traduza para {1}", "-x": "{1} e {2}"})
+    assert aliases.expand("-tr:inglês isto") == "traduza para inglês isto"
+    assert aliases.expand("-x:a,b") == "a e b"
+    # a missing argument leaves its placeholder
+    assert aliases.expand("-x:a") == "a e {2}"
+    # a parameterized alias needs its arguments
+    assert aliases.expand("-tr") == "traduza para {1}"
+
+
+def test_nested_aliases():
+    aliases = AliasEngine({"-a": "primeiro -b", "-b": "segundo"})
+    assert aliases.expand("-a") == "primeiro segundo"
+
+
+def test_cycles_are_left_as_typed():
+    aliases = AliasEngine({"-a": "x -b", "-b": "y -a", "-self": "de novo -self"})
+    assert aliases.expand("-a") == "x y -a"
+    assert aliases.expand("-b") == "y x -b"
+    assert aliases.expand("-self") == "de novo -self"
+
+
+def test_depth_is_bounded():
+    chain = {f"-{i}": f"-{i + 1}" for i in range(20)}
+    aliases = AliasEngine(chain, max_depth=3)
+    assert aliases.expand("-0") == "-4"
+
+
+def test_used():
+    aliases = AliasEngine({"-kw": "palavras", "-tr": "traduza para {1}"})
+    assert aliases.used("-tr:inglês -kw texto -kw -nada") == ["-tr", "-kw"]
+    assert aliases.used("sem aliases") == []
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+from src import batch, engine
+from src.config import compile_settings
+
+CONFIG = compile_settings(
+    {
+        "system": "sistema",
+        "max_tokens": 50,
+        "models": {"gpt3": "gpt-3.5-turbo", "gpt4": "gpt-4o"},
+        "aliases": {"-kw": "palavras-chave:"},
+    }
+)
+
+
+async def _collect(ordered: bool) -> list[tuple[int, int]]:
+    async def slow(n: int) -> int:
+        # later items finish first
+        await asyncio.sleep(0.01 * (5 - n))
+        return n * n
+
+    return [pair async for pair in engine.bounded_map(slow, range(5), 5, ordered)]
+
+
+def test_bounded_map_keeps_input_order():
+    assert engine.run(_collect(True)) == [(i, i * i) for i in range(5)]
+
+
+def test_bounded_map_yields_in_completion_order():
+    assert engine.run(_collect(False)) == [(i, i * i) for i in reversed(range(5))]
+
+
+def test_bounded_map_limits_concurrency():
+    running = peak = 0
+
+    async def work(n: int) -> int:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return n
+
+    async def run() -> list[int]:
+        return [n async for _, n in engine.bounded_map(work, range(10), 3)]
+
+    assert engine.run(run()) == list(range(10))
+    assert peak == 3
+
+
+def test_batch_resumes_where_it_stopped(tmp_path, engine_server):
+    server = engine_server(tokens=2)
+    source, out = tmp_path / "prompts.jsonl", tmp_path / "prompts.out.jsonl"
+    source.write_text(
+        "primeira\n"
+        '"segunda"\n'
+        "\n"
+        '{"id": "c", "prompt": "-kw terceira", "model": "gpt3"}\n'
+        '{"prompt": "quarta"}\n',
+        encoding="utf-8",
+    )
+    # a previous run answered the first line, failed the second and was
+    # killed while writing the next record
+    out.write_text(
+        '{"id": 1, "model": "gpt-4o", "answer": "já"}\n'
+        '{"id": 2, "model": "gpt-4o", "error": "APIError: falhou"}\n'
+        '{"id": "c", "mod',
+        encoding="utf-8",
+    )
+    # the truncated line is skipped, not joined to the next record
+    with open(out, "a", encoding="utf-8") as fp:
+        fp.write("\n")
+
+    def run() -> tuple[int, int]:
+        return engine.run(batch.run_batch(str(source), str(out), CONFIG, "gpt-4o", 2))
+
+    assert run() == (3, 0)
+    sent = {r["messages"][-1]["content"]: r["model"] for r in server.requests}
+    assert sent == {
+        "segunda": "gpt-4o",
+        "palavras-chave: terceira": "gpt-3.5-turbo",
+        "quarta": "gpt-4o",
+    }
+    assert batch.finished_ids(str(out)) == {"1", "2", "c", "5"}
+
+    # nothing is left to answer
+    assert run() == (0, 0)
+    assert len(server.requests) == 3
+    records = [json.loads(line) for line in out.read_text().splitlines()[3:]]
+    assert [r["answer"] for r in records] == ["vox vox"] * 3
@@ -0,0 +1,87 @@
+import asyncio
+
+import openai
+import pytest
+
+from src import cache, engine
+from src.cache import ResponseCache, request_key
+
+MESSAGES = [{"role": "system", "content": "s"}, {"role": "user", "content": "oi"}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    responses = ResponseCache(str(tmp_path / "c.sqlite"), ttl=60)
+    responses.put("a", "resposta")
+    clock[0] += 59
+    assert responses.get("a") == "resposta"
+    clock[0] += 2  # use does not extend the TTL
+    assert responses.get("a") is None
+    assert (responses.hits, responses.misses) == (1, 1)
+    assert responses.totals() == {"hits": 1, "misses": 1, "entries": 0}
+
+
+def test_least_recently_used_is_evicted(tmp_path, clock):
+    responses = ResponseCache(str(tmp_path / "c.sqlite"), max_entries=2)
+    for key in ("a", "b"):
+        clock[0] += 1
+        responses.put(key, key.upper())
+    clock[0] += 1
+    assert responses.get("a") == "A"
+    clock[0] += 1
+    responses.put("c", "C")
+    assert responses.get("b") is None
+    assert responses.get("a") == "A" and responses.get("c") == "C"
+    assert responses.totals()["entries"] == 2
+
+
+def test_key_covers_the_whole_request():
+    key = request_key("gpt-4o", MESSAGES, 50)
+    assert key == request_key("gpt-4o", [dict(m) for m in MESSAGES], 50)
+    assert key != request_key("gpt-4o", MESSAGES, 51)
+    assert key != request_key("gpt-3.5-turbo", MESSAGES, 50)
+    assert key != request_key("gpt-4o", MESSAGES[1:], 50)
+
+
+def test_engine_answers_repeats_from_the_cache(engine_server, monkeypatch, tmp_path):
+    server = engine_server(tokens=3)
+    monkeypatch.setattr(engine, "cache", ResponseCache(str(tmp_path / "c.sqlite")))
+    first = engine.run(engine.stream_chat(MESSAGES, "gpt-4o", 50))
+    pieces: list[str] = []
+    again = engine.run(engine.stream_chat(MESSAGES, "gpt-4o", 50, pieces.append))
+    assert first == again == "".join(pieces) == "vox vox vox "
+    assert len(server.requests) == 1
+    # bypassed on request, and not shared with another max_tokens
+    engine.run(engine.stream_chat(MESSAGES, "gpt-4o", 50, use_cache=False))
+    engine.run(engine.stream_chat(MESSAGES, "gpt-4o", 40))
+    assert len(server.requests) == 3
+
+
+def test_identical_requests_in_flight_are_sent_once(
+    engine_server, monkeypatch, tmp_path
+):
+    server = engine_server(tokens=3, ttft=0.2)
+    monkeypatch.setattr(engine, "cache", ResponseCache(str(tmp_path / "c.sqlite")))
+
+    async def both() -> list[str]:
+        return await asyncio.gather(
+            *(engine.stream_chat(MESSAGES, "gpt-4o", 50) for _ in range(2))
+        )
+
+    assert engine.run(both()) == ["vox vox vox "] * 2
+    assert len(server.requests) == 1
+
+
+def test_failures_are_not_cached(engine_server, monkeypatch, tmp_path):
+    server = engine_server(tokens=2, fail_first=1, fail_status=400)
+    monkeypatch.setattr(engine, "cache", ResponseCache(str(tmp_path / "c.sqlite")))
+    with pytest.raises(openai.BadRequestError):
+        engine.run(engine.stream_chat(MESSAGES, "gpt-4o", 50))
+    assert engine.run(engine.stream_chat(MESSAGES, "gpt-4o", 50)) == "vox vox "
+    assert len(server.requests) == 2
@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+from src import config
+from src.config import ConfigError, compile_settings
+
+SETTINGS = {
+    "system": " sistema ",
+    "max_tokens": 800,
+    "models": {"gpt3": "gpt-3.5-turbo", "gpt4": {"name": "gpt-4o", "max_tokens": 1200}},
+    "aliases": {"-kw": "palavras-chave:"},
+    "cache": {"enabled": True},
+}
+
+
+def test_compiles_models_and_aliases():
+    snapshot = compile_settings(SETTINGS)
+    assert snapshot.system == "sistema"
+    assert snapshot.model("gpt4") == "gpt-4o"
+    assert snapshot.model("gpt-4-turbo") == "gpt-4-turbo"
+    assert snapshot.max_tokens_for("gpt-4o") == 1200
+    assert snapshot.max_tokens_for("gpt-3.5-turbo") == 800
+    assert snapshot.aliases.expand("-kw x") == "palavras-chave: x"
+    assert snapshot.section("cache") == {"enabled": True}
+    assert snapshot.section("jobs") == {}
+
+
+@pytest.mark.parametrize(
+    "change, message",
+    [
+        ({"system": None}, "`system`"),
+        ({"max_tokens": 0}, "`max_tokens`"),
+        ({"max_tokens": "800"}, "`max_tokens`"),
+        ({"models": {}}, "`models`"),
+        ({"models": {"gpt4": {"max_tokens": 10}}}, "`models.gpt4`"),
+        ({"models": {"gpt4": {"name": "gpt-4o", "max_tokens": "10"}}}, "max_tokens"),
+        ({"aliases": {"-kw": 1}}, "`aliases`"),
+        ({"cache": True}, "`cache`"),
+    ],
+)
+def test_rejects_invalid_settings(change, message):
+    with pytest.raises(ConfigError, match=message):
+        compile_settings({**SETTINGS, **change})
+
+
+def write(path, settings) -> None:
+    path.write_text(json.dumps(settings), encoding="utf-8")
+    # a new version even within the file system's timestamp resolution
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+
+def test_reload_returns_a_new_snapshot_only_on_change(tmp_path):
+    path = tmp_path / "configs.json"
+    write(path, SETTINGS)
+    first = config.load(str(path))
+    assert config.load(str(path)) is first
+
+    write(path, {**SETTINGS, "aliases": {"-kw": "extraia:"}})
+    second = config.load(str(path))
+    assert second is not first
+    assert second.aliases.expand("-kw x") == "extraia: x"
+    assert second.version != first.version
+
+
+def test_invalid_edit_raises_and_the_fix_is_picked_up(tmp_path):
+    path = tmp_path / "configs.json"
+    write(path, SETTINGS)
+    first = config.load(str(path))
+
+    path.write_text("{quebrado", encoding="utf-8")
+    with pytest.raises(ConfigError, match="configs.json"):
+        config.load(str(path))
+    write(path, {**SETTINGS, "max_tokens": -1})
+    with pytest.raises(ConfigError, match="`max_tokens`"):
+        config.load(str(path))
+
+    write(path, SETTINGS)
+    assert config.load(str(path)) is not first
+    os.unlink(path)
+    with pytest.raises(ConfigError):
+        config.load(str(path))
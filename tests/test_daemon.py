@@ -0,0 +1,87 @@
+import os
+import socket
+import stat
+import time
+
+import pytest
+
+from src import daemon, engine
+
+
+@pytest.fixture
+def running_daemon(monkeypatch, tmp_path):
+    """
+    Serves the daemon on the engine's loop, at the default path under
+    `tmp_path`.
+    """
+    monkeypatch.delenv("VOX_SOCKET", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    path = daemon.socket_path()
+    future = engine.submit(daemon._serve(path))
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path):
+        assert time.monotonic() < deadline and not future.done()
+        time.sleep(0.01)
+    yield path
+    future.cancel()
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def ask() -> bool:
+    return daemon.quick_answer("oi", "gpt-4o", "sistema", 50, aliases="-kw")
+
+
+def test_round_trip(running_daemon, engine_server, capsys):
+    server = engine_server(tokens=3)
+    assert ask()
+    assert capsys.readouterr().out == "vox vox vox \n"
+    assert server.requests[0]["messages"] == [
+        {"role": "system", "content": "sistema"},
+        {"role": "user", "content": "oi"},
+    ]
+    assert server.requests[0]["max_tokens"] == 50
+
+
+def test_socket_is_private(running_daemon):
+    directory = os.path.dirname(running_daemon)
+    assert directory == daemon.socket_dir()
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(running_daemon).st_mode) & 0o077 == 0
+
+
+def test_loose_directory_is_tightened(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    os.mkdir(daemon.socket_dir(), 0o755)
+    os.chmod(daemon.socket_dir(), 0o755)
+    daemon._make_private(daemon.socket_dir())
+    assert stat.S_IMODE(os.stat(daemon.socket_dir()).st_mode) == 0o700
+
+
+def test_error_before_any_text_falls_back(running_daemon, engine_server, capsys):
+    server = engine_server(fail_first=1, fail_status=400)
+    assert not ask()
+    assert capsys.readouterr().out == ""
+    assert server.failures == 1
+
+
+def test_no_daemon(monkeypatch, tmp_path):
+    monkeypatch.setenv("VOX_SOCKET", str(tmp_path / "nada.sock"))
+    assert not ask()
+
+
+def test_ignores_a_socket_of_another_user(monkeypatch, tmp_path, engine_server):
+    server = engine_server()
+    path = str(tmp_path / "outro.sock")
+    monkeypatch.setenv("VOX_SOCKET", path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    uid = os.getuid()
+    monkeypatch.setattr(daemon.os, "getuid", lambda: uid + 1)
+    with listener:
+        assert not ask()
+        listener.setblocking(False)
+        with pytest.raises(BlockingIOError):
+            listener.accept()
+    assert server.requests == []
@@ -0,0 +1,62 @@
+import time
+
+import openai
+import pytest
+
+from src import engine
+
+MESSAGES = [{"role": "user", "content": "oi"}]
+
+
+def test_retries_failures_before_the_first_token(fake_server, client_for):
+    server = fake_server(tokens=5, fail_first=2, fail_status=503)
+    answer = engine.run(
+        engine.stream_chat(MESSAGES, "gpt-4o", 50, client=client_for(server))
+    )
+    assert answer == "vox " * 5
+    assert server.failures == 2
+
+
+def test_honours_retry_after(fake_server, client_for):
+    server = fake_server(tokens=3, fail_first=1, fail_status=429, retry_after=0.4)
+    started = time.monotonic()
+    answer = engine.run(
+        engine.stream_chat(MESSAGES, "gpt-4o", 50, client=client_for(server))
+    )
+    assert answer == "vox " * 3
+    # the configured backoff is at most 0.05 s, so only Retry-After explains it
+    assert time.monotonic() - started >= 0.4
+
+
+def test_gives_up_after_max_attempts(fake_server, client_for):
+    server = fake_server(fail_first=100, fail_status=503)
+    engine.scheduler.max_attempts = 3
+    with pytest.raises(openai.InternalServerError):
+        engine.run(
+            engine.stream_chat(MESSAGES, "gpt-4o", 50, client=client_for(server))
+        )
+    assert server.failures == 3
+
+
+def test_does_not_retry_client_errors(fake_server, client_for):
+    server = fake_server(fail_first=1, fail_status=400)
+    with pytest.raises(openai.BadRequestError):
+        engine.run(
+            engine.stream_chat(MESSAGES, "gpt-4o", 50, client=client_for(server))
+        )
+    assert server.failures == 1
+
+
+def test_estimate_counts_images_at_a_fixed_cost():
+    image = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "descreva"},
+            {
+                "type": "image_url",
+                "image_url": {"url": "data:image/png;base64," + "A" * 600_000},
+            },
+        ],
+    }
+    tokens = engine.estimate_tokens([image], 100, "gpt-4o")
+    assert engine.IMAGE_TOKENS + 100 < tokens < engine.IMAGE_TOKENS + 200
@@ -0,0 +1,41 @@
+from src import engine, fanout, metrics
+from src.ledger import Ledger
+
+MESSAGES = [{"role": "system", "content": "s"}, {"role": "user", "content": "oi"}]
+PRICES = {"gpt-4o": {"input": 5.0, "output": 15.0}, "gpt-3.5-turbo": {"input": 0.5}}
+
+
+def test_race_streams_the_winner_and_records_the_losers(
+    engine_server, monkeypatch, tmp_path
+):
+    server = engine_server(tokens=3, slow_models={"gpt-3.5-turbo": 1.0})
+    book = Ledger(str(tmp_path), PRICES)
+    monkeypatch.setattr(engine, "ledger", book)
+    pieces: list[str] = []
+    winner, answer = engine.run(
+        fanout.race(MESSAGES, ["gpt-3.5-turbo", "gpt-4o"], 50, pieces.append)
+    )
+    assert (winner, answer) == ("gpt-4o", "vox vox vox ")
+    assert "".join(pieces) == answer
+    assert {r["model"] for r in server.requests} == {"gpt-4o", "gpt-3.5-turbo"}
+
+    entries = {entry.model: entry for entry in book.entries()}
+    assert set(entries) == {"gpt-4o", "gpt-3.5-turbo"}
+    # the loser's prompt was billed; without its usage it is estimated
+    loser = entries["gpt-3.5-turbo"]
+    assert loser.prompt_tokens > 0 and loser.completion_tokens == 0
+    assert loser.cost > 0
+    cancelled = [m.model for m in metrics.records if m.cancelled]
+    assert cancelled[-1:] == ["gpt-3.5-turbo"]
+    assert metrics.summary()["gpt-3.5-turbo"]["requests"] >= 1
+
+
+def test_compare_keeps_every_answer(engine_server):
+    engine_server(tokens=2)
+    results = engine.run(fanout.compare(MESSAGES, ["gpt-4o", "gpt-3.5-turbo"], 50))
+    assert [(model, answer) for model, answer, _ in results] == [
+        ("gpt-4o", "vox vox"),
+        ("gpt-3.5-turbo", "vox vox"),
+    ]
+    text = fanout.format_comparison(results, PRICES)
+    assert "=== gpt-4o (" in text and "US$" in text
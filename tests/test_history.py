@@ -0,0 +1,61 @@
+import pytest
+
+from src import engine, history
+from src.conversation import Conversation
+from src.history import TokenBudget
+
+
+@pytest.fixture(autouse=True)
+def four_chars_per_token(monkeypatch):
+    # the same counts with or without tiktoken installed
+    monkeypatch.setattr(history, "_encoders", {})
+    monkeypatch.setitem(
+        history._encoders, "gpt-4o", lambda text: [None] * (len(text) // 4)
+    )
+
+
+def message(n: int) -> dict:
+    # 36 characters: 9 tokens, 13 with the message overhead
+    role = "user" if n % 2 == 0 else "assistant"
+    return {"role": role, "content": f"{n:04d}" + "a" * 32}
+
+
+def test_window_drops_whole_blocks():
+    budget = TokenBudget(max_tokens=200, keep=0.5)
+    conversation = Conversation()
+    starts = []
+    for n in range(60):
+        conversation.append(message(n))
+        if n % 2:
+            continue
+        sent = engine.run(budget.select(conversation, "", "gpt-4o"))
+        assert sum(history.message_tokens(m) for m in sent) <= 200
+        assert sent[-1]["content"] == message(n)["content"]
+        # the window always starts with a question
+        assert sent[1]["role"] == "user"
+        starts.append(sent[1]["content"])
+    changes = [i for i in range(1, len(starts)) if starts[i] != starts[i - 1]]
+    assert changes, "the history never outgrew the budget"
+    # each drop makes room for several turns, so the prefix stays put
+    assert all(b - a > 1 for a, b in zip(changes, changes[1:]))
+
+
+def test_drop_goes_down_to_keep():
+    budget = TokenBudget(max_tokens=200, keep=0.5)
+    conversation = Conversation()
+    for n in range(15):  # 15 * 13 = 195 tokens, over the 196 - 4 available
+        conversation.append(message(n))
+    conversation.append(message(16))
+    sent = engine.run(budget.select(conversation, "", "gpt-4o"))
+    history_tokens = sum(history.message_tokens(m) for m in sent[1:])
+    assert history_tokens <= (200 - 4) * 0.5
+
+
+def test_preview_matches_select_without_side_effects():
+    budget = TokenBudget(max_tokens=200, keep=0.5)
+    conversation = Conversation()
+    for n in range(21):
+        conversation.append(message(n))
+    preview = budget.preview(conversation, "", "gpt-4o")
+    assert budget.reports == []
+    assert engine.run(budget.select(conversation, "", "gpt-4o")) == preview
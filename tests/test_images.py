@@ -0,0 +1,54 @@
+import pytest
+
+from src import images
+from src.helpers import Client
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+@pytest.fixture
+def client(engine_server, monkeypatch):
+    server = engine_server(tokens=2)
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    return server, Client("x", "sistema", max_tokens=50)
+
+
+def image_files(tmp_path, count: int) -> list[str]:
+    paths = []
+    for n in range(count):
+        path = tmp_path / f"{n}.png"
+        path.write_bytes(PNG + bytes([n]))
+        paths.append(str(path))
+    return paths
+
+
+def test_no_images_is_an_error(client):
+    server, vox = client
+    with pytest.raises(ValueError, match="No image"):
+        vox.send_images([], "descreva")
+    with pytest.raises(ValueError, match="No image"):
+        vox.send_images([], "descreva", per_request=2)
+    assert server.requests == []
+
+
+def test_groups_of_per_request(client, tmp_path):
+    server, vox = client
+    answers = vox.send_images(image_files(tmp_path, 5), "descreva", per_request=2)
+    assert answers == ["vox vox"] * 3
+    sizes = sorted(
+        sum(part["type"] == "image_url" for part in r["messages"][0]["content"])
+        for r in server.requests
+    )
+    assert sizes == [1, 2, 2]
+
+
+def test_single_request_and_payload_cache(client, tmp_path):
+    server, vox = client
+    paths = image_files(tmp_path, 2)
+    assert vox.send_images(paths, "descreva") == "vox vox"
+    assert len(server.requests) == 1
+    url = server.requests[0]["messages"][0]["content"][1]["image_url"]["url"]
+    assert url.startswith("data:image/png;base64,")
+    images._memory.clear()
+    # read back from disk, the same payload
+    assert images.encode_image(paths[0]) == url
@@ -0,0 +1,110 @@
+import threading
+import time
+
+from src.conversation import Conversation
+from src.jobs import JobQueue
+
+
+async def as_is(branch: Conversation) -> list:
+    return branch.to_api()
+
+
+def submit(queue: JobQueue, prompt: str = "oi"):
+    branch = Conversation()
+    branch.append({"role": "user", "content": prompt})
+    return queue.submit(prompt, branch, "gpt-4o", 50, as_is)
+
+
+def wait(job, status: str | None = None) -> None:
+    with job.changed:
+        assert job.changed.wait_for(
+            lambda: job.status == status if status else job.done, 5
+        ), job.status
+
+
+def test_job_answers_on_its_branch(engine_server):
+    engine_server(tokens=3)
+    queue = JobQueue()
+    job = submit(queue)
+    wait(job)
+    assert job.status == "done"
+    assert job.text() == "vox vox vox "
+    assert job.branch.to_api()[-1] == {"role": "assistant", "content": "vox vox vox"}
+    time.sleep(0.05)  # the done callback runs right after
+    assert queue.finished() == [job]
+    assert queue.finished() == []
+
+
+def test_jobs_wait_for_a_slot(engine_server):
+    server = engine_server(tokens=2, ttft=0.3)
+    queue = JobQueue(concurrency=1)
+    first, second = submit(queue, "um"), submit(queue, "dois")
+    wait(first, "running")
+    time.sleep(0.1)
+    assert second.status == "queued"
+    wait(second)
+    assert first.status == second.status == "done"
+    assert [r["messages"][-1]["content"] for r in server.requests] == ["um", "dois"]
+
+
+def test_cancel(engine_server):
+    server = engine_server(tokens=50, delay=0.05)
+    queue = JobQueue(concurrency=1)
+    running, queued = submit(queue, "um"), submit(queue, "dois")
+    with running.changed:
+        assert running.changed.wait_for(lambda: running.pieces, 5)
+    assert queue.cancel(queued.id)
+    assert queue.cancel(running.id)
+    wait(running)
+    wait(queued)
+    assert running.status == queued.status == "cancelled"
+    received = len(running.pieces)
+    time.sleep(0.2)
+    assert len(running.pieces) == received < 50
+    assert not queue.cancel(running.id)
+    assert not queue.cancel(99)
+    # the queued job never reached the API
+    assert [r["messages"][-1]["content"] for r in server.requests] == ["um"]
+
+
+def test_failed_job_keeps_the_error(engine_server):
+    engine_server(fail_first=1, fail_status=400)
+    job = submit(JobQueue())
+    wait(job)
+    assert job.status == "failed"
+    assert job.error.startswith("BadRequestError")
+
+
+def test_attach_follows_the_job_to_the_end(engine_server):
+    engine_server(tokens=10, delay=0.02)
+    job = submit(JobQueue())
+    with job.changed:
+        assert job.changed.wait_for(lambda: job.pieces, 5)
+    written: list[str] = []
+    attached = threading.Thread(target=JobQueue.attach, args=(job, written.append))
+    attached.start()
+    attached.join(5)
+    assert not attached.is_alive()
+    assert job.done
+    assert "".join(written) == job.text() == "vox " * 10
+
+    # attaching to a finished job writes it all at once
+    again: list[str] = []
+    JobQueue.attach(job, again.append)
+    assert again == job.pieces
+
+
+def test_slow_writer_does_not_hold_up_the_stream(engine_server):
+    engine_server(tokens=10, delay=0.01)
+    job = submit(JobQueue())
+
+    def slow(piece: str) -> None:
+        time.sleep(0.05)  # a terminal that cannot keep up
+
+    started = time.monotonic()
+    attached = threading.Thread(target=JobQueue.attach, args=(job, slow))
+    attached.start()
+    wait(job)
+    # the job finished long before the writer was through
+    assert time.monotonic() - started < 0.4
+    attached.join(5)
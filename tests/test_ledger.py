@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from src import ledger
+from src.ledger import Ledger
+from src.metrics import CompletionMetrics
+
+PRICES = {"gpt-4o": {"input": 1.0, "output": 2.0}}  # USD per million tokens
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Sets the time the ledger records completions at.
+    """
+    now = [time.time()]
+    monkeypatch.setattr(ledger.time, "time", lambda: now[0])
+    return now
+
+
+def record(book: Ledger, model: str = "gpt-4o", aliases: str = "", session=None):
+    # one USD of input and one of output at PRICES
+    token = ledger.labels.set((aliases, session))
+    try:
+        book.append(
+            CompletionMetrics(model, prompt_tokens=1_000_000, completion_tokens=500_000)
+        )
+    finally:
+        ledger.labels.reset(token)
+
+
+def test_report_groups_and_period(tmp_path, clock):
+    book = Ledger(str(tmp_path), PRICES)
+    start = clock[0] = ledger.day_start(time.time()) - 3 * 86400
+    for day in range(3):
+        clock[0] = start + day * 86400 + 3600
+        record(book, aliases="-kw -tpt" if day else "-kw", session=day or None)
+    record(book, model="sem-preço")
+
+    groups, total = book.report("model")
+    assert groups["gpt-4o"]["requests"] == 3
+    assert groups["gpt-4o"]["cost"] == pytest.approx(6.0)
+    assert total["requests"] == 4
+    assert groups["sem-preço"]["cost"] != groups["sem-preço"]["cost"]  # NaN
+
+    groups, total = book.report("alias")
+    assert groups["-kw"]["requests"] == 3
+    assert groups["-tpt"]["requests"] == 2
+    assert total["requests"] == 4  # once each, whatever the aliases
+
+    groups, _ = book.report("session")
+    assert set(groups) == {"-", "1", "2"}
+
+    # the period starts at `since` and ends before `until`
+    groups, total = book.report("day", start + 86400, start + 2 * 86400)
+    assert total["requests"] == 1
+    assert list(groups) == [time.strftime("%Y-%m-%d", time.localtime(start + 86400))]
+    _, total = book.report("day", start + 86400 + 3600)
+    assert total["requests"] == 3
+
+
+def test_spent_reads_only_new_records(tmp_path, clock):
+    book = Ledger(str(tmp_path), PRICES)
+    today = ledger.day_start(clock[0])
+    clock[0] = today - 60  # yesterday
+    record(book)
+    clock[0] = today + 60
+    record(book)
+    assert book.spent(today) == pytest.approx(2.0)
+    offset, _ = book._spent[today]
+    record(book)
+    assert book.spent(today) == pytest.approx(4.0)
+    assert book._spent[today][0] == offset + ledger.RECORD.size
+
+
+def test_strings_are_shared_between_instances(tmp_path, clock):
+    first, second = Ledger(str(tmp_path), PRICES), Ledger(str(tmp_path), PRICES)
+    record(first, model="gpt-4o", aliases="-kw")
+    record(second, model="gpt-3.5-turbo", aliases="-kw")
+    record(first, model="gpt-3.5-turbo")
+    for book in (first, second, Ledger(str(tmp_path))):
+        models = [entry.model for entry in book.entries()]
+        assert models == ["gpt-4o", "gpt-3.5-turbo", "gpt-3.5-turbo"]
+        assert [entry.aliases for entry in book.entries()] == ["-kw", "-kw", ""]
+
+
+def test_budgets(tmp_path, clock):
+    book = Ledger(str(tmp_path), PRICES, daily=2.5, fallback="gpt-3.5-turbo")
+    record(book)
+    book.check()
+    assert book.route("gpt-4o") == "gpt-4o"
+    record(book)
+    record(book)
+    with pytest.raises(ledger.BudgetExceeded):
+        book.check()
+    book.action = "downgrade"
+    book.check()
+    assert book.route("gpt-4o") == "gpt-3.5-turbo"
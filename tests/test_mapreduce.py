@@ -0,0 +1,59 @@
+import io
+
+from src import engine, mapreduce
+from src.history import count_tokens
+from src.mapreduce import map_reduce, read_chunks
+
+
+def test_chunks_end_at_line_breaks():
+    text = "".join(f"linha {n:03d} " * 5 + "\n" for n in range(50))
+    chunks = list(read_chunks(io.StringIO(text), 100, "gpt-4o"))
+    assert "".join(chunks) == text
+    assert len(chunks) > 1
+    assert all(chunk.endswith("\n") for chunk in chunks)
+    assert all(count_tokens(chunk, "gpt-4o") <= 100 for chunk in chunks)
+
+
+def test_long_line_is_counted_piece_by_piece(monkeypatch):
+    counted = 0
+
+    def counting(text: str, model: str) -> int:
+        nonlocal counted
+        counted += len(text)
+        return count_tokens(text, model)
+
+    monkeypatch.setattr(mapreduce, "count_tokens", counting)
+    text = "palavra " * 100_000 + "\n"
+    chunks = list(read_chunks(io.StringIO(text), 500, "gpt-4o"))
+    assert "".join(chunks) == text
+    assert all(count_tokens(chunk, "gpt-4o") <= 500 for chunk in chunks)
+    # each character is counted a few times, not once per piece cut before it
+    assert counted < 3 * len(text)
+
+
+def test_empty_input_sends_nothing(engine_server, capsys):
+    server = engine_server()
+    for text in ("", "\n  \n"):
+        answer = engine.run(
+            map_reduce(io.StringIO(text), "resuma", "gpt-4o", "s", 50, on_text=print)
+        )
+        assert answer == ""
+    assert server.requests == []
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "<entrada vazia>" in captured.err
+
+
+def test_map_then_reduce(engine_server):
+    server = engine_server(tokens=2)
+    text = "".join(f"linha {n}\n" for n in range(40))
+    pieces: list[str] = []
+    answer = engine.run(
+        map_reduce(io.StringIO(text), "resuma", "gpt-4o", "s", 50, 40, 4, pieces.append)
+    )
+    assert answer == "vox vox " == "".join(pieces)
+    *mapped, reduced = [r["messages"][-1]["content"] for r in server.requests]
+    assert len(mapped) > 1
+    assert "".join(m.removeprefix("resuma\n\n") for m in mapped) == text
+    assert reduced.count("vox vox") == len(mapped)
+    assert f"Parte {len(mapped)}:" in reduced
@@ -0,0 +1,87 @@
+import asyncio
+import io
+import json
+import os
+import time
+
+import pytest
+
+from src import engine
+from src.mapreduce import map_reduce
+from src.pipeline import per_line
+
+
+@pytest.fixture
+def pipe():
+    """
+    A pipe whose reading end is a text stream, like `tail -f log | vox`.
+    """
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, "r", encoding="utf-8")
+    writer = os.fdopen(write_fd, "w", encoding="utf-8")
+    yield reader, writer
+    for stream in (reader, writer):
+        if not stream.closed:
+            stream.close()
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_per_line_answers_in_order(engine_server):
+    server = engine_server(tokens=2, delay=0.01)
+    out = io.StringIO()
+    errors = engine.run(
+        per_line(io.StringIO("um\n\ndois\n"), "traduza -:p", "gpt-4o", "s", 50, out=out)
+    )
+    assert errors == 0
+    assert out.getvalue() == "vox vox\n\nvox vox\n"
+    assert sorted(r["messages"][-1]["content"] for r in server.requests) == [
+        "traduza dois",
+        "traduza um",
+    ]
+
+
+def test_per_line_jsonl_reports_errors(engine_server):
+    engine_server(fail_first=1, fail_status=400)
+    out = io.StringIO()
+    errors = engine.run(
+        per_line(io.StringIO("um\n"), "x", "gpt-4o", "s", 50, jsonl=True, out=out)
+    )
+    assert errors == 1
+    record = json.loads(out.getvalue())
+    assert record["input"] == "um" and "BadRequestError" in record["error"]
+
+
+def test_per_line_answers_while_the_producer_is_idle(engine_server, pipe):
+    engine_server(tokens=2)
+    reader, writer = pipe
+    out = io.StringIO()
+    future = engine.submit(per_line(reader, "x", "gpt-4o", "s", 50, out=out))
+    writer.write("primeira\n")
+    writer.flush()
+    # the next line has not come yet, and the first answer is already out
+    wait_for(lambda: out.getvalue() == "vox vox\n")
+    assert engine.run(asyncio.sleep(0, "livre")) == "livre"
+    writer.write("segunda\n")
+    writer.close()
+    assert future.result(5) == 0
+    assert out.getvalue() == "vox vox\n" * 2
+
+
+def test_map_reduce_does_not_block_the_loop(engine_server, pipe):
+    server = engine_server(tokens=2)
+    reader, writer = pipe
+    future = engine.submit(map_reduce(reader, "resuma", "gpt-4o", "s", 50, 100))
+    writer.write("uma linha\n")
+    writer.flush()
+    time.sleep(0.05)
+    assert engine.run(asyncio.sleep(0, "livre")) == "livre"
+    assert not future.done()
+    writer.close()
+    assert future.result(5) == "vox vox"
+    assert len(server.requests) == 1
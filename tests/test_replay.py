@@ -0,0 +1,91 @@
+import os
+import time
+
+import httpx
+import openai
+import pytest
+from openai import AsyncOpenAI
+
+from src import engine, replay
+
+MESSAGES = [{"role": "user", "content": "oi"}]
+
+
+def client(transport: httpx.AsyncBaseTransport, base_url: str) -> AsyncOpenAI:
+    return AsyncOpenAI(
+        api_key="x",
+        base_url=base_url,
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=transport),
+    )
+
+
+def ask(vox: AsyncOpenAI, content: str = "oi", on_text=None) -> str:
+    return engine.run(
+        engine.stream_chat(
+            [{"role": "user", "content": content}], "gpt-4o", 50, on_text, client=vox
+        )
+    )
+
+
+@pytest.fixture
+def recorded(fake_server, tmp_path):
+    """
+    Records two answers to the same request and one to another.
+    """
+    server = fake_server(tokens=3, delay=0.01)
+    directory = str(tmp_path / "gravações")
+    recorder = client(
+        replay.recording_transport(httpx.AsyncHTTPTransport(), directory),
+        server.base_url,
+    )
+    assert ask(recorder) == "vox vox vox "
+    server.settings.word = "outra "
+    assert ask(recorder) == "outra outra outra "
+    assert ask(recorder, "tchau") == "outra outra outra "
+    return server, directory
+
+
+def test_replays_without_the_network(recorded):
+    server, directory = recorded
+    assert len(os.listdir(directory)) == 3
+    # another host: only the method, path and body identify a request
+    player = client(replay.replay_transport(directory, 0), "http://127.0.0.1:9/v1")
+    pieces: list[str] = []
+    assert ask(player, on_text=pieces.append) == "vox vox vox "
+    assert pieces == ["vox "] * 3
+    # identical requests get their recordings in turn
+    assert ask(player) == "outra outra outra "
+    assert ask(player) == "vox vox vox "
+    assert ask(player, "tchau") == "outra outra outra "
+    assert len(server.requests) == 3
+
+
+def test_unrecorded_request_is_a_404(recorded):
+    _, directory = recorded
+    player = client(replay.replay_transport(directory, 0), "http://127.0.0.1:9/v1")
+    with pytest.raises(openai.NotFoundError, match="no recording"):
+        ask(player, "nunca perguntado")
+
+
+def test_keeps_the_recorded_pace(recorded):
+    _, directory = recorded
+    for speed, at_least in ((1.0, 0.02), (0, 0.0)):
+        player = client(replay.replay_transport(directory, speed), "http://x/v1")
+        started = time.monotonic()
+        ask(player)
+        assert time.monotonic() - started >= at_least
+
+
+def test_incomplete_streams_are_not_saved(fake_server, tmp_path):
+    server = fake_server(tokens=50, delay=0.02)
+    directory = str(tmp_path / "gravações")
+    recorder = client(
+        replay.recording_transport(httpx.AsyncHTTPTransport(), directory),
+        server.base_url,
+    )
+    future = engine.submit(engine.stream_chat(MESSAGES, "gpt-4o", 50, client=recorder))
+    time.sleep(0.2)
+    future.cancel()
+    time.sleep(0.1)
+    assert os.listdir(directory) == []
@@ -0,0 +1,101 @@
+import os
+import threading
+
+from src.retrieval import Index, format_context
+
+TEXTS = {
+    "gatos": ["gatos dormem muito durante o dia", "o gato caça ratos à noite"],
+    "python": ["python usa indentação para blocos", "listas python são mutáveis"],
+    "chuva": ["a chuva de verão é forte e curta"],
+}
+
+
+def fill(index: Index, version: str = "1") -> None:
+    for source, chunks in TEXTS.items():
+        index.add(source, version, chunks)
+
+
+def test_search_finds_the_closest_chunks(tmp_path):
+    index = Index(str(tmp_path))
+    fill(index)
+    assert len(index) == 5
+    _, source, text = index.search("gatos dormem de dia", 1)[0]
+    assert (source, text) == ("gatos", "gatos dormem muito durante o dia")
+    assert [s for _, s, _ in index.search("blocos em python", 2)] == ["python"] * 2
+    assert "[chuva]" in format_context(index.search("chuva forte", 1))
+
+
+def test_unchanged_sources_are_skipped(tmp_path):
+    index = Index(str(tmp_path))
+    fill(index)
+    size = os.path.getsize(index._vectors_path(0))
+    assert index.add("gatos", "1", iter(["não é lido"])) == 0
+    assert os.path.getsize(index._vectors_path(0)) == size
+
+
+def test_compaction_drops_dead_vectors(tmp_path):
+    index = Index(str(tmp_path), compact=0.5)
+    fill(index)
+    reader = Index(str(tmp_path))
+    assert reader.search("gato", 1)[0][1] == "gatos"  # caches generation 0
+
+    # replacing sources leaves their old vectors behind until compaction
+    index.add("python", "2", ["python tem tipagem dinâmica"])
+    index.add("gatos", "2", ["gatos ronronam"])
+    rows, generation = index._state()
+    assert generation == 1
+    assert rows == len(index) == 3
+    assert os.path.getsize(index._vectors_path(1)) == 3 * index.dim * 4
+    # a query that started before the compaction can still read its file
+    assert os.path.exists(index._vectors_path(0))
+
+    assert reader.search("gatos ronronam", 1)[0][1:] == ("gatos", "gatos ronronam")
+    assert reader.search("tipagem", 1)[0][1] == "python"
+
+    index.add("chuva", "2", ["chove"])
+    index.add("chuva", "3", ["garoa fina"])
+    index.add("chuva", "4", ["neblina"])
+    index.add("chuva", "5", ["tempestade"])
+    assert index._state()[1] == 2
+    assert not os.path.exists(index._vectors_path(0))
+    assert reader.search("tempestade", 1)[0][1:] == ("chuva", "tempestade")
+
+
+def test_uncommitted_vectors_are_invisible_and_cut_off(tmp_path):
+    index = Index(str(tmp_path))
+    fill(index)
+    path = index._vectors_path(0)
+    committed = os.path.getsize(path)
+    # a writer killed after appending, before its commit
+    with open(path, "ab") as fp:
+        fp.write(b"\xff" * index.dim * 4 * 2)
+
+    reader = Index(str(tmp_path))
+    assert reader.search("gato", 1)[0][1] == "gatos"
+    assert os.path.getsize(path) == committed + index.dim * 4 * 2  # left alone
+
+    index.add("nova", "1", ["uma fonte nova"])
+    assert os.path.getsize(path) == committed + index.dim * 4
+    assert reader.search("fonte nova", 1)[0][1:] == ("nova", "uma fonte nova")
+
+
+def test_concurrent_writers(tmp_path):
+    Index(str(tmp_path))  # creates the tables before the threads race
+
+    def write(n: int) -> None:
+        index = Index(str(tmp_path))
+        for i in range(10):
+            index.add(f"fonte {n}.{i}", "1", [f"texto {n} {i} único{n}x{i}"])
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    index = Index(str(tmp_path))
+    assert len(index) == 40
+    assert index._state()[0] == 40
+    for n in range(4):
+        for i in range(10):
+            assert index.search(f"único{n}x{i}", 1)[0][1] == f"fonte {n}.{i}"